@@ -0,0 +1,257 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+''' An in-process stand-in for the EC2 API, for benchmarking. It answers
+the calls Graffiti Monkey makes with the XML EC2 would send, so boto's own
+request building and response parsing are part of what is measured.
+
+The inventory is synthetic and computed from each resource's index rather
+than stored, so that the memory measured is Graffiti Monkey's own:
+
+- instance n is tagged Name=instance-n
+- volume n is attached to instance n % instances, except every tenth volume
+  which is available
+- snapshot n is of volume n % (volumes + deleted volumes); those beyond the
+  last volume were taken of volumes since deleted
+- volumes and snapshots are spread evenly over the last year, newest first
+
+Tags written with CreateTags are counted, not kept. '''
+
+import datetime
+import fnmatch
+import random
+import threading
+import time
+
+from boto.ec2.connection import EC2Connection
+
+__all__ = ('Inventory', 'FakeEC2Connection')
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.000Z'
+
+# Largest page returned when no MaxResults is given
+DEFAULT_PAGE_SIZE = 1000
+
+ERROR_RESPONSE = ('<?xml version="1.0" encoding="UTF-8"?>\n<Response><Errors><Error>'
+                  '<Code>%s</Code><Message>%s</Message></Error></Errors>'
+                  '<RequestID>00000000-0000-0000-0000-000000000000</RequestID></Response>')
+
+
+class Inventory(object):
+    ''' The synthetic resources of one account, and the calls made against
+    them. Shared by every connection of a benchmark '''
+
+    def __init__(self, instances=1000, volumes=10000, snapshots=100000, deleted_volumes=0.05, days=365):
+        self.instances = instances
+        self.volumes = volumes
+        self.snapshots = snapshots
+        self.snapshot_volumes = volumes + int(volumes * deleted_volumes)
+        self.now = datetime.datetime(2014, 1, 1)
+        self.span = datetime.timedelta(days=days)
+
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.throttled = 0
+        self.resources_tagged = 0
+
+    def record(self, action, throttled=False):
+        with self._lock:
+            self.calls[action] = self.calls.get(action, 0) + 1
+            if throttled:
+                self.throttled += 1
+
+    def record_tagged(self, count):
+        with self._lock:
+            self.resources_tagged += count
+
+    def _time(self, n, count):
+        ''' Resource n of count, the first being the newest '''
+
+        return (self.now - datetime.timedelta(seconds=self.span.total_seconds() * n / max(count, 1))).strftime(TIME_FORMAT)
+
+    @staticmethod
+    def index(resource_id):
+        return int(resource_id.split('-', 1)[1], 16)
+
+    def instance_xml(self, n):
+        return ('<item><instanceId>i-%08x</instanceId><imageId>ami-00000000</imageId>'
+                '<instanceState><code>16</code><name>running</name></instanceState>'
+                '<tagSet><item><key>Name</key><value>instance-%d</value></item></tagSet></item>') % (n, n)
+
+    def volume_instance(self, n):
+        ''' The instance volume n is attached to, or None '''
+
+        if n % 10 == 0:
+            return None
+        return n % self.instances
+
+    def volume_xml(self, n):
+        instance = self.volume_instance(n)
+        if instance is None:
+            status, attachment = 'available', ''
+        else:
+            status = 'in-use'
+            attachment = ('<item><volumeId>vol-%08x</volumeId><instanceId>i-%08x</instanceId>'
+                          '<device>/dev/sd%s</device><status>attached</status></item>') % (n, instance, 'fghijklmnop'[n / self.instances % 11])
+        return ('<item><volumeId>vol-%08x</volumeId><size>%d</size><availabilityZone>us-east-1a</availabilityZone>'
+                '<status>%s</status><createTime>%s</createTime><attachmentSet>%s</attachmentSet><tagSet/></item>'
+                ) % (n, 8 + n % 100, status, self._time(n, self.volumes), attachment)
+
+    def snapshot_xml(self, n):
+        return ('<item><snapshotId>snap-%08x</snapshotId><volumeId>vol-%08x</volumeId><status>completed</status>'
+                '<startTime>%s</startTime><progress>100%%</progress><ownerId>000000000000</ownerId>'
+                '<volumeSize>8</volumeSize><tagSet/></item>') % (n, n % self.snapshot_volumes, self._time(n, self.snapshots))
+
+    def instance_tag_xml(self, n):
+        return ('<item><resourceId>i-%08x</resourceId><resourceType>instance</resourceType>'
+                '<key>Name</key><value>instance-%d</value></item>') % (n, n)
+
+
+def _filters(params):
+    ''' The Filter.N.Name / Filter.N.Value.M parameters, as a dict of lists '''
+
+    filters = {}
+    n = 1
+    while 'Filter.%d.Name' % n in params:
+        values = []
+        m = 1
+        while 'Filter.%d.Value.%d' % (n, m) in params:
+            values.append(params['Filter.%d.Value.%d' % (n, m)])
+            m += 1
+        filters[params['Filter.%d.Name' % n]] = values
+        n += 1
+    return filters
+
+
+def _list(params, label):
+    values = []
+    n = 1
+    while '%s.%d' % (label, n) in params:
+        values.append(params['%s.%d' % (label, n)])
+        n += 1
+    return values
+
+
+class FakeResponse(object):
+    def __init__(self, status, body, reason='OK'):
+        self.status = status
+        self.reason = reason
+        self._body = body
+
+    def read(self):
+        return self._body
+
+    def getheader(self, name, default=None):
+        return default
+
+
+class FakeEC2Connection(EC2Connection):
+    ''' An EC2Connection whose requests are answered from an Inventory after
+    latency seconds, a throttle_rate share of them with RequestLimitExceeded '''
+
+    def __init__(self, inventory, latency=0.0, throttle_rate=0.0):
+        EC2Connection.__init__(self, aws_access_key_id='benchmark', aws_secret_access_key='benchmark')
+        self._inventory = inventory
+        self._latency = latency
+        self._throttle_rate = throttle_rate
+
+    def make_request(self, action, params=None, path='/', verb='GET'):
+        params = params or {}
+        if self._latency:
+            time.sleep(self._latency)
+        if self._throttle_rate and random.random() < self._throttle_rate:
+            self._inventory.record(action, True)
+            return FakeResponse(503, ERROR_RESPONSE % ('RequestLimitExceeded', 'Request limit exceeded.'),
+                                'Service Unavailable')
+        self._inventory.record(action)
+
+        handler = getattr(self, '_' + action, None)
+        if handler is None:
+            return FakeResponse(400, ERROR_RESPONSE % ('InvalidAction', 'Not supported by the benchmark'), 'Bad Request')
+        return FakeResponse(200, handler(params))
+
+    @staticmethod
+    def _page(params, indexes, render, item_set, action):
+        ''' Renders the page of indexes that NextToken and MaxResults ask for.
+        indexes may be a list or an xrange, so large listings are never built '''
+
+        start = int(params.get('NextToken') or 0)
+        size = int(params.get('MaxResults') or DEFAULT_PAGE_SIZE)
+        items = ''.join(render(indexes[n]) for n in xrange(start, min(start + size, len(indexes))))
+        next_token = '<nextToken>%d</nextToken>' % (start + size) if start + size < len(indexes) else ''
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n<%sResponse xmlns="http://ec2.amazonaws.com/doc/2014-10-01/">'
+                '<requestId>00000000-0000-0000-0000-000000000000</requestId><%s>%s</%s>%s</%sResponse>'
+                ) % (action, item_set, items, item_set, next_token, action)
+
+    def _DescribeTags(self, params):
+        inventory = self._inventory
+        filters = _filters(params)
+        if filters.get('resource-type', ['instance']) != ['instance']:
+            indexes = []
+        elif 'resource-id' in filters:
+            indexes = sorted(set(inventory.index(i) for i in filters['resource-id'] if i.startswith('i-'))
+                             & set(xrange(inventory.instances)))
+        else:
+            indexes = xrange(inventory.instances)
+        return self._page(params, indexes, inventory.instance_tag_xml, 'tagSet', 'DescribeTags')
+
+    def _DescribeInstances(self, params):
+        inventory = self._inventory
+        indexes = xrange(inventory.instances)
+        for name, values in _filters(params).iteritems():
+            if name == 'tag:Name':
+                indexes = [n for n in indexes if any(fnmatch.fnmatch('instance-%d' % n, value) for value in values)]
+            elif name == 'instance-id':
+                wanted = set(inventory.index(i) for i in values)
+                indexes = [n for n in indexes if n in wanted]
+
+        def reservation(n):
+            return ('<item><reservationId>r-%08x</reservationId><ownerId>000000000000</ownerId>'
+                    '<instancesSet>%s</instancesSet></item>') % (n, inventory.instance_xml(n))
+        return self._page(params, indexes, reservation, 'reservationSet', 'DescribeInstances')
+
+    def _DescribeVolumes(self, params):
+        inventory = self._inventory
+        filters = _filters(params)
+        if 'volume-id' in filters:
+            indexes = sorted(n for n in set(inventory.index(i) for i in filters['volume-id'])
+                             if n < inventory.volumes)
+        elif 'attachment.instance-id' in filters:
+            indexes = sorted(volume
+                             for instance in set(inventory.index(i) for i in filters['attachment.instance-id'])
+                             if instance < inventory.instances
+                             for volume in xrange(instance, inventory.volumes, inventory.instances)
+                             if inventory.volume_instance(volume) is not None)
+        else:
+            indexes = xrange(inventory.volumes)
+        return self._page(params, indexes, inventory.volume_xml, 'volumeSet', 'DescribeVolumes')
+
+    def _DescribeSnapshots(self, params):
+        inventory = self._inventory
+        filters = _filters(params)
+        if 'snapshot-id' in filters:
+            indexes = sorted(n for n in set(inventory.index(i) for i in filters['snapshot-id'])
+                             if n < inventory.snapshots)
+        elif 'start-time' in filters:
+            patterns = filters['start-time']
+            indexes = [n for n in xrange(inventory.snapshots)
+                       if any(fnmatch.fnmatch(inventory._time(n, inventory.snapshots), p) for p in patterns)]
+        else:
+            indexes = xrange(inventory.snapshots)
+        return self._page(params, indexes, inventory.snapshot_xml, 'snapshotSet', 'DescribeSnapshots')
+
+    def _CreateTags(self, params):
+        self._inventory.record_tagged(len(_list(params, 'ResourceId')))
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n<CreateTagsResponse xmlns="http://ec2.amazonaws.com/doc/2014-10-01/">'
+                '<requestId>00000000-0000-0000-0000-000000000000</requestId><return>true</return></CreateTagsResponse>')
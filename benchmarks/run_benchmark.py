@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+''' Runs GraffitiMonkey.propagate_tags against a synthetic inventory served
+by the in-process fake EC2 endpoint, and reports the wall time, API calls
+and peak memory, e.g.
+
+    python benchmarks/run_benchmark.py --instances 10000 --volumes 100000 --snapshots 1000000
+'''
+
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from graffiti_monkey.core import GraffitiMonkey, DEFAULT_PAGE_SIZE
+from graffiti_monkey.tagger import DEFAULT_BATCH_SIZE
+from graffiti_monkey.throttle import RateLimiter
+
+from fake_ec2 import Inventory, FakeEC2Connection
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmarks Graffiti Monkey against a fake EC2 endpoint')
+    parser.add_argument('--instances', type=int, default=1000)
+    parser.add_argument('--volumes', type=int, default=10000)
+    parser.add_argument('--snapshots', type=int, default=100000)
+    parser.add_argument('--deleted-volumes', type=float, default=0.05, metavar='SHARE',
+                        help='snapshots of deleted volumes, as a share of the volumes (default 0.05)')
+    parser.add_argument('--latency', type=float, default=0.0, metavar='MS',
+                        help='milliseconds each API call takes (default 0)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, metavar='SHARE',
+                        help='share of API calls rejected with RequestLimitExceeded (default 0); each one '
+                             'halves the adaptive call rate, so the rate limiter soon dominates the wall time')
+    parser.add_argument('--max-rate', type=float, default=1000000.0,
+                        help='Graffiti Monkey\'s API call rate limit (default effectively none)')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--pipeline', action='store_true')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--verbose', '-v', action='count', default=0,
+                        help='log what Graffiti Monkey does, which slows it down')
+    return parser.parse_args(argv)
+
+
+def benchmark(args):
+    ''' Runs one benchmark, returning its results as a dict '''
+
+    inventory = Inventory(args.instances, args.volumes, args.snapshots, args.deleted_volumes)
+    latency = args.latency / 1000.0
+
+    class BenchmarkMonkey(GraffitiMonkey):
+        def _connect(self):
+            return FakeEC2Connection(inventory, latency, args.throttle_rate)
+
+    monkey = BenchmarkMonkey('us-east-1', None, ['Name'], ['Name', 'instance_id', 'device'], [], [],
+                             False, False, None, None, None, False, False,
+                             batch_size=args.batch_size, workers=args.workers,
+                             rate_limiter=RateLimiter(args.max_rate), page_size=args.page_size,
+                             pipeline=args.pipeline)
+
+    started = time.time()
+    monkey.propagate_tags()
+    elapsed = time.time() - started
+
+    return {
+        'inventory': {'instances': args.instances, 'volumes': args.volumes, 'snapshots': args.snapshots},
+        'wall_seconds': round(elapsed, 3),
+        'api_calls': inventory.calls,
+        'api_calls_total': sum(inventory.calls.itervalues()),
+        'throttled': inventory.throttled,
+        'resources_tagged': inventory.resources_tagged,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        'phase_seconds': monkey._metrics.summary()['phase_seconds'],
+    }
+
+
+def report(results):
+    print 'Inventory:        %(instances)d instances, %(volumes)d volumes, %(snapshots)d snapshots' % results['inventory']
+    print 'Wall time:        %.3f s' % results['wall_seconds']
+    for phase, seconds in sorted(results['phase_seconds'].iteritems()):
+        print '  %-15s %.3f s' % (phase, seconds)
+    print 'API calls:        %d (%d throttled)' % (results['api_calls_total'], results['throttled'])
+    for action, count in sorted(results['api_calls'].iteritems()):
+        print '  %-15s %d' % (action, count)
+    print 'Resources tagged: %d' % results['resources_tagged']
+    print 'Peak RSS:         %.1f MB' % results['peak_rss_mb']
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(level=logging.WARNING - 10 * min(args.verbose, 2),
+                        format='%(asctime)s [%(levelname)s] %(message)s')
+    if not args.verbose:
+        # boto logs every throttled call as an error
+        logging.getLogger('boto').setLevel(logging.CRITICAL)
+    results = benchmark(args)
+    if args.json:
+        print json.dumps(results, indent=2, sort_keys=True)
+    else:
+        report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import sys
+import threading
+
+from graffiti_monkey.exceptions import GraffitiMonkeyException
+
+__all__ = ('AuditReport', )
+log = logging.getLogger(__name__)
+
+
+class AuditReport(object):
+    ''' Counts the resources audited and writes those whose tags differ from
+    what Graffiti Monkey would set to a JSON list, as they are found. Shared
+    by the monkeys of every account and region being audited '''
+
+    def __init__(self, path='-'):
+        if path == '-':
+            self._fh = sys.stdout
+        else:
+            try:
+                self._fh = open(path, 'w')
+            except IOError as e:
+                raise GraffitiMonkeyException('Cannot write the audit to %s: %s' % (path, e.strerror))
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # Resources audited, and those whose tags differ, by kind
+        self.audited = {}
+        self.drifted = {}
+
+    def add(self, profile, region, resource, delta_tags):
+        ''' Counts resource, listing it when delta_tags, the tags it lacks or
+        has different values of, are not empty '''
+
+        with self._lock:
+            self.audited[resource.kind] = self.audited.get(resource.kind, 0) + 1
+            if not delta_tags:
+                return
+            entry = json.dumps({
+                'profile': profile,
+                'region': region,
+                'kind': resource.kind,
+                'id': resource.id,
+                'expected': delta_tags,
+                'current': dict((key, resource.tags.get(key)) for key in delta_tags),
+            }, sort_keys=True)
+            self._fh.write(('[\n  ' if not self.drifted_total() else ',\n  ') + entry)
+            self.drifted[resource.kind] = self.drifted.get(resource.kind, 0) + 1
+
+    def drifted_total(self):
+        return sum(self.drifted.itervalues())
+
+    def close(self):
+        ''' Ends the list and logs the summary '''
+
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._fh.write('\n]\n' if self.drifted else '[]\n')
+            if self._fh is not sys.stdout:
+                self._fh.close()
+            else:
+                self._fh.flush()
+
+        for kind in sorted(self.audited):
+            log.info('Audited %d %s(s): %d with tags to change', self.audited[kind], kind, self.drifted.get(kind, 0))
+        if not self.audited:
+            log.info('Nothing to audit')
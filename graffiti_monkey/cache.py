@@ -0,0 +1,125 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+__all__ = ('TagCache', 'fingerprint')
+log = logging.getLogger(__name__)
+
+# Seconds a cached fingerprint is trusted before the resource is looked at again
+DEFAULT_TTL = 24 * 60 * 60
+
+# Number of resources kept, the least recently tagged are dropped first
+DEFAULT_MAX_ENTRIES = 1000000
+
+# Seconds a volume found to be deleted is not asked for again
+DEFAULT_MISSING_TTL = 7 * 24 * 60 * 60
+
+
+def fingerprint(*parts):
+    ''' A short digest of the given JSON serializable values '''
+
+    return hashlib.sha1(json.dumps(parts, sort_keys=True)).hexdigest()
+
+
+class TagCache(object):
+    ''' SQLite backed record of the fingerprint of the inputs each resource
+    was last tagged from. A resource whose inputs have the same fingerprint
+    already carries the right tags and can be skipped '''
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, missing_ttl=DEFAULT_MISSING_TTL):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._missing_ttl = missing_ttl
+
+        # One connection shared by all worker threads, serialized by the lock.
+        # The timeout lets separate processes wait for each other's writes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS fingerprints ('
+                             'resource_id TEXT PRIMARY KEY, '
+                             'fingerprint TEXT NOT NULL, '
+                             'updated_at REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS fingerprints_updated_at '
+                             'ON fingerprints (updated_at)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS missing_volumes ('
+                             'volume_id TEXT PRIMARY KEY, '
+                             'checked_at REAL NOT NULL)')
+        self.evict()
+
+    def unchanged(self, resource_id, fingerprint):
+        ''' Whether resource_id was tagged from inputs with this fingerprint
+        within the TTL '''
+
+        with self._lock:
+            row = self._db.execute('SELECT fingerprint FROM fingerprints '
+                                   'WHERE resource_id = ? AND updated_at >= ?',
+                                   (resource_id, time.time() - self._ttl)).fetchone()
+        return row is not None and row[0] == fingerprint
+
+    def put(self, resource_id, fingerprint):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?)',
+                             (resource_id, fingerprint, time.time()))
+
+    def forget(self, resource_ids):
+        with self._lock, self._db:
+            self._db.executemany('DELETE FROM fingerprints WHERE resource_id = ?',
+                                 ((resource_id, ) for resource_id in resource_ids))
+
+    def missing(self, volume_ids):
+        ''' The volume_ids found not to exist within the missing TTL '''
+
+        volume_ids = list(volume_ids)
+        found = set()
+        since = time.time() - self._missing_ttl
+        with self._lock:
+            # SQLite allows at most 999 parameters in a statement
+            for chunk in (volume_ids[n:n+900] for n in xrange(0, len(volume_ids), 900)):
+                rows = self._db.execute('SELECT volume_id FROM missing_volumes '
+                                        'WHERE checked_at >= ? AND volume_id IN (%s)' % ','.join('?' * len(chunk)),
+                                        [since] + chunk)
+                found.update(row[0] for row in rows)
+        return found
+
+    def put_missing(self, volume_ids):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO missing_volumes VALUES (?, ?)',
+                                 ((volume_id, now) for volume_id in volume_ids))
+
+    def evict(self):
+        ''' Drops expired entries, then the oldest entries beyond the size limit '''
+
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM missing_volumes WHERE checked_at < ?',
+                             (time.time() - self._missing_ttl, ))
+            expired = self._db.execute('DELETE FROM fingerprints WHERE updated_at < ?',
+                                       (time.time() - self._ttl, )).rowcount
+            excess = self._db.execute('SELECT COUNT(*) FROM fingerprints').fetchone()[0] - self._max_entries
+            if excess > 0:
+                self._db.execute('DELETE FROM fingerprints WHERE resource_id IN ('
+                                 'SELECT resource_id FROM fingerprints ORDER BY updated_at LIMIT ?)',
+                                 (excess, ))
+        log.debug('Evicted %d expired and %d excess tag cache entries', expired, max(excess, 0))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -13,25 +13,75 @@
 # limitations under the License.
 
 import argparse
+import atexit
 import logging
 import sys
-
-from graffiti_monkey.core import GraffitiMonkey, Logging
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from graffiti_monkey.core import GraffitiMonkey, Logging, DEFAULT_PAGE_SIZE, MIN_PAGE_SIZE, MAX_PAGE_SIZE, \
+    DEFAULT_CHECKPOINT_PAGES
+from graffiti_monkey.tagger import DEFAULT_BATCH_SIZE
+from graffiti_monkey.throttle import RateLimiter, DEFAULT_MAX_RATE
 from graffiti_monkey import __version__
 from graffiti_monkey.exceptions import GraffitiMonkeyException
-
+from graffiti_monkey.state import StateFile, DEFAULT_STATE_FILE
+from graffiti_monkey.metrics import Metrics
+from graffiti_monkey.progress import DEFAULT_INTERVAL as DEFAULT_PROGRESS_INTERVAL
+from graffiti_monkey import plan, rules
+from graffiti_monkey.audit import AuditReport
+from graffiti_monkey.cache import TagCache, DEFAULT_TTL, DEFAULT_MAX_ENTRIES, DEFAULT_MISSING_TTL
+
+from boto import ec2
 from boto.utils import get_instance_metadata
 
 
 __all__ = ('run', )
 log = logging.getLogger(__name__)
 
+# Exit status of an audit that found resources whose tags need changing
+AUDIT_DRIFT_EXIT_CODE = 3
+
+# Regions that need separate credentials, so are left out of --region all
+ISOLATED_REGION_PREFIXES = ('us-gov-', 'cn-')
+
+
+def read_ids(lines):
+    ''' Yields the resource ids in lines, which may hold several ids
+    separated by whitespace or commas, skipping # comments '''
+
+    for line in lines:
+        for resource_id in line.split('#', 1)[0].replace(',', ' ').split():
+            yield resource_id
+
+
+class IdFile(object):
+    ''' The resource ids in a file, read afresh each time they are iterated
+    so that a long list is never held in memory '''
+
+    def __init__(self, path):
+        self._path = path
+
+    def __iter__(self):
+        with open(self._path) as fh:
+            for resource_id in read_ids(fh):
+                yield resource_id
+
 
 class GraffitiMonkeyCli(object):
-    def __init__(self):
+    # What create_monkey makes
+    monkey_class = GraffitiMonkey
+
+    def __init__(self, argv=None):
+        # The arguments to use instead of the command line's
+        self.argv = argv
         self.region = None
+        self.regions = None
         self.profile = None
+        self.profiles = None
         self.monkey = None
+        self.parallel = 1
         self.args = None
         self.config = {"_instance_tags_to_propagate": ['Name'],
                        "_volume_tags_to_propagate": ['Name', 'instance_id', 'device'],
@@ -46,6 +96,27 @@ class GraffitiMonkeyCli(object):
         self.instancefilter = None
         self.novolumes = False
         self.nosnapshots = False
+        self.amis = False
+        self.enis = False
+        self.batch_size = DEFAULT_BATCH_SIZE
+        self.workers = 1
+        self.rate_limiter = None
+        self.page_size = DEFAULT_PAGE_SIZE
+        self.state = None
+        self.incremental = False
+        self.full = False
+        self.tag_cache = None
+        self.pipeline = False
+        self.checkpoint_pages = 0
+        self.resume = False
+        self.deadline = None
+        self.shard = None
+        self.metrics = None
+        self.progress_interval = DEFAULT_PROGRESS_INTERVAL
+        self.progress_every = 0
+        self.rules = None
+        self.plan_out = None
+        self.audit_report = None
 
     @staticmethod
     def _fail(message="Unknown failure", code=1):
@@ -57,33 +128,105 @@ class GraffitiMonkeyCli(object):
         The parse_args method from ArgumentParser expects to not get the script title when arguments are passed to the
         method. So the first element is omitted.
         """
+        if self.argv is not None:
+            return self.argv
         return sys.argv[1:]
 
-    def set_cli_args(self):
+    def create_parser(self):
         parser = argparse.ArgumentParser(description='Propagates tags from AWS EC2 instances to EBS volumes, and then to EBS snapshots. This makes it much easier to find things down the road.')
-        parser.add_argument('--region', metavar='REGION',
-                            help='the region to tag things in (default is current region of EC2 instance this is running on). E.g. us-east-1')
-        parser.add_argument('--profile', metavar='PROFILE',
-                            help='the profile (credentials) to use to connect to EC2')
+        parser.add_argument('--region', metavar='REGION', action='append',
+                            help='the region to tag things in (default is current region of EC2 instance this is running on). E.g. us-east-1. '
+                                 'Repeat or separate with commas for several regions, or use "all"')
+        parser.add_argument('--profile', metavar='PROFILE', action='append',
+                            help='the profile (credentials) to use to connect to EC2. Repeat or separate with commas for several accounts')
+        parser.add_argument('--parallel', type=int, default=4, metavar='N',
+                            help='number of account and region pairs processed at the same time (default 4)')
         parser.add_argument('--verbose', '-v', action='count',
                             help='enable verbose output (-vvv for more)')
         parser.add_argument('--version', action='version', version='%(prog)s ' + __version__,
                             help='display version number and exit')
         parser.add_argument('--config', '-c', nargs="?", type=argparse.FileType('r'),
                         default=None, help="Give a yaml configuration file")
+        parser.add_argument('--rules', type=argparse.FileType('r'), metavar='RULES.YML',
+                            help='yaml collect/inspect/tag rules (see conf/graffiti_monkey.yml) replacing the configured '
+                                 'tags of the resource types they cover')
         parser.add_argument('--dryrun', action='store_true',
                             help='dryrun only, display tagging actions but do not perform them')
+        parser.add_argument('--plan-out', metavar='FILE',
+                            help='write the tag changes to FILE as a JSON lines plan instead of making them')
+        parser.add_argument('--apply', metavar='FILE',
+                            help='make the tag changes of a plan written with --plan-out, without listing anything')
+        parser.add_argument('--audit', action='store_true',
+                            help='tag nothing, but list the volumes and snapshots whose tags differ from those they '
+                                 'should have as JSON, and exit with status %d if there are any' % AUDIT_DRIFT_EXIT_CODE)
+        parser.add_argument('--audit-out', metavar='FILE', default='-',
+                            help='where to write the audit (default stdout)')
         parser.add_argument('--append', action='store_true',
                             help='append propagated tags to existing tags (up to a total of ten tags)')
         parser.add_argument('--volumes', action='append',
                             help='volume-ids to tag')
         parser.add_argument('--snapshots', action='append',
                             help='snapshot-ids to tag'),
+        parser.add_argument('--volumes-from', metavar='FILE',
+                            help='file listing volume-ids to tag, one or more per line, - for stdin')
+        parser.add_argument('--snapshots-from', metavar='FILE',
+                            help='file listing snapshot-ids to tag, one or more per line, - for stdin')
         parser.add_argument('--novolumes', action='store_true',
                             help='do not perform volume tagging')
         parser.add_argument('--nosnapshots', action='store_true',
                             help='do not perform snapshot tagging')
-        self.args = parser.parse_args(self.get_argv())
+        parser.add_argument('--amis', action='store_true',
+                            help='also tag the images (AMIs) the account owns with the tags of their root snapshot')
+        parser.add_argument('--enis', action='store_true',
+                            help='also tag the network interfaces attached to instances with the instance tags')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, metavar='N',
+                            help='maximum number of resources given identical tags in a single CreateTags call (default %d, max 1000)' % DEFAULT_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=1, metavar='N',
+                            help='number of threads tagging resources concurrently, each with its own connection (default 1)')
+        parser.add_argument('--max-rate', type=float, default=DEFAULT_MAX_RATE, metavar='N',
+                            help='maximum EC2 API calls per second, lowered automatically when throttled (default %d)' % DEFAULT_MAX_RATE)
+        parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, metavar='N',
+                            help='number of resources fetched per Describe call; tagging starts on the first page (default %d, from %d to %d)'
+                                 % (DEFAULT_PAGE_SIZE, MIN_PAGE_SIZE, MAX_PAGE_SIZE))
+        parser.add_argument('--incremental', action='store_true',
+                            help='only process snapshots started since the last successful run')
+        parser.add_argument('--full', action='store_true',
+                            help='with --incremental, process all snapshots this time and reset the high-water mark')
+        parser.add_argument('--state-file', metavar='FILE', default=DEFAULT_STATE_FILE,
+                            help='where to keep state between runs (default %s)' % DEFAULT_STATE_FILE)
+        parser.add_argument('--cache', metavar='FILE',
+                            help='SQLite file remembering what each resource was last tagged from, to skip unchanged resources')
+        parser.add_argument('--cache-ttl', type=int, default=DEFAULT_TTL / 3600, metavar='HOURS',
+                            help='hours before a cached resource is looked at again (default %d)' % (DEFAULT_TTL / 3600))
+        parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_ENTRIES, metavar='N',
+                            help='maximum number of resources kept in the cache (default %d)' % DEFAULT_MAX_ENTRIES)
+        parser.add_argument('--cache-missing-ttl', type=int, default=DEFAULT_MISSING_TTL / 3600, metavar='HOURS',
+                            help='hours before a volume found to be deleted is looked for again (default %d)'
+                                 % (DEFAULT_MISSING_TTL / 3600))
+        parser.add_argument('--pipeline', action='store_true',
+                            help='list snapshots while volumes are being tagged, tagging each snapshot once its volume is done')
+        parser.add_argument('--checkpoint-every', type=int, default=0, metavar='N',
+                            help='save progress to the state file every N pages, so an interrupted run can be resumed')
+        parser.add_argument('--deadline', type=float, metavar='SECONDS',
+                            help='stop cleanly within SECONDS, working on the newest volumes and snapshots first')
+        parser.add_argument('--shard', metavar='K/N',
+                            help='only process the volumes and snapshots whose id hashes to shard K of N (K from 0 to N-1)')
+        parser.add_argument('--metrics-json', metavar='FILE',
+                            help='write API call, resource and timing metrics to FILE as JSON at exit')
+        parser.add_argument('--metrics-prom', metavar='FILE',
+                            help='write the metrics to FILE in the Prometheus textfile format at exit')
+        parser.add_argument('--progress-interval', type=float, default=DEFAULT_PROGRESS_INTERVAL, metavar='SECONDS',
+                            help='log progress, rate and time left every SECONDS, 0 for never (default %d)'
+                                 % DEFAULT_PROGRESS_INTERVAL)
+        parser.add_argument('--progress-every', type=int, default=0, metavar='N',
+                            help='also log progress every N resources')
+        parser.add_argument('--resume', action='store_true',
+                            help='carry on from the progress saved by an interrupted run, checkpointing every %d pages '
+                                 'unless --checkpoint-every is given' % DEFAULT_CHECKPOINT_PAGES)
+        return parser
+
+    def set_cli_args(self):
+        self.args = self.create_parser().parse_args(self.get_argv())
 
     @staticmethod
     def fail_due_to_bad_config_file(self):
@@ -110,11 +253,38 @@ class GraffitiMonkeyCli(object):
 
 
 
+    @staticmethod
+    def split_names(values):
+        ''' Flattens repeated and comma separated names into one list, keeping
+        the order they were given in and dropping duplicates '''
+
+        if isinstance(values, basestring):
+            values = [values]
+        names = []
+        for value in values:
+            for name in value.split(','):
+                name = name.strip()
+                if name and name not in names:
+                    names.append(name)
+        return names
+
+    @staticmethod
+    def all_regions():
+        return sorted(region.name for region in ec2.regions()
+                      if not region.name.startswith(ISOLATED_REGION_PREFIXES))
+
     def set_region(self):
         if self.args.region:
-            self.region = self.args.region
+            self.regions = self.split_names(self.args.region)
         elif "region" in self.config.keys():
-            self.region = self.config["region"]
+            self.regions = self.split_names(self.config["region"])
+        if self.regions:
+            if 'all' in self.regions:
+                self.regions = self.all_regions()
+            self.region = self.regions[0]
+        elif self.args.apply:
+            # The plan says where its changes are made
+            self.regions = []
         else:
             # If no region was specified, assume this is running on an EC2 instance
             # and work out what region it is in
@@ -125,16 +295,21 @@ class GraffitiMonkeyCli(object):
                 GraffitiMonkeyCli._fail('Could not determine region. This script is either not running on an EC2 instance (in which case you should use the --region option), or the meta-data service is down')
 
             self.region = instance_metadata['placement']['availability-zone'][:-1]
-        log.debug("Running in region: %s", self.region)
+            self.regions = [self.region]
+        log.debug("Running in region(s): %s", ', '.join(self.regions))
 
     def set_profile(self):
         if self.args.profile:
-            self.profile = self.args.profile
+            self.profiles = self.split_names(self.args.profile)
         elif "profile" in self.config.keys():
-            self.profile = self.config["profile"]
+            self.profiles = self.split_names(self.config["profile"])
         else:
-            self.profile = 'default'
-        log.debug("Using profile: %s", self.profile)
+            self.profiles = ['default']
+        self.profile = self.profiles[0]
+        log.debug("Using profile(s): %s", ', '.join(self.profiles))
+
+    def set_parallel(self):
+        self.parallel = self.args.parallel
 
     def set_dryrun(self):
         self.dryrun = self.args.dryrun
@@ -142,14 +317,37 @@ class GraffitiMonkeyCli(object):
     def set_append(self):
         self.append = self.args.append
 
+    @staticmethod
+    def ids_from(path):
+        ''' The ids listed in path. Standard input can only be read once, and
+        may be needed for several regions, so it is read up front '''
+
+        if path == '-':
+            return list(read_ids(sys.stdin))
+        try:
+            open(path).close()
+        except IOError as e:
+            GraffitiMonkeyCli._fail('Cannot read %s: %s' % (path, e.strerror), 2)
+        return IdFile(path)
+
+    @staticmethod
+    def has_ids(ids):
+        ''' Whether ids holds any id, reading no further than the first '''
+
+        return next(iter(ids), None) is not None
+
     def set_volumes(self):
-        if self.args.volumes:
+        if self.args.volumes_from:
+            self.volumes = self.ids_from(self.args.volumes_from)
+        elif self.args.volumes:
             self.volumes = self.args.volumes
         elif "_volumes_to_tag" in self.config.keys():
             self.volumes = self.config["_volumes_to_tag"]
 
     def set_snapshots(self):
-        if self.args.snapshots:
+        if self.args.snapshots_from:
+            self.snapshots = self.ids_from(self.args.snapshots_from)
+        elif self.args.snapshots:
             self.snapshots = self.args.snapshots
         elif "_snapshots_to_tag" in self.config.keys():
             self.snapshots = self.config["_snapshots_to_tag"]
@@ -161,38 +359,294 @@ class GraffitiMonkeyCli(object):
     def set_novolumes(self):
         self.novolumes = self.args.novolumes
 
+        # An empty list must not be taken to mean every volume
+        if self.args.volumes_from and not self.novolumes and not self.has_ids(self.volumes):
+            log.info('No volume ids in %s, so no volumes will be tagged', self.args.volumes_from)
+            self.novolumes = True
+
     def set_nosnapshots(self):
         self.nosnapshots = self.args.nosnapshots
+        if self.args.snapshots_from and not self.nosnapshots and not self.has_ids(self.snapshots):
+            log.info('No snapshot ids in %s, so no snapshots will be tagged', self.args.snapshots_from)
+            self.nosnapshots = True
+
+    def set_amis(self):
+        self.amis = self.args.amis
+
+    def set_enis(self):
+        self.enis = self.args.enis
+
+    def set_batch_size(self):
+        self.batch_size = self.args.batch_size
+
+    def set_workers(self):
+        self.workers = self.args.workers
+
+    def set_rate_limiter(self):
+        self.rate_limiter = RateLimiter(self.args.max_rate)
+
+    def set_page_size(self):
+        self.page_size = self.args.page_size
+        if not MIN_PAGE_SIZE <= self.page_size <= MAX_PAGE_SIZE:
+            self._fail('--page-size must be from %d to %d' % (MIN_PAGE_SIZE, MAX_PAGE_SIZE), 2)
+
+    def set_incremental(self):
+        self.incremental = self.args.incremental
+        self.full = self.args.full
+        if self.incremental:
+            self.state = StateFile(self.args.state_file)
+
+    def set_checkpoint(self):
+        self.resume = self.args.resume
+        self.checkpoint_pages = self.args.checkpoint_every
+        if self.resume and not self.checkpoint_pages:
+            self.checkpoint_pages = DEFAULT_CHECKPOINT_PAGES
+        if self.checkpoint_pages < 0:
+            self._fail('--checkpoint-every must not be negative', 2)
+        if self.checkpoint_pages and self.state is None:
+            self.state = StateFile(self.args.state_file)
+
+    def set_tag_cache(self):
+        if self.args.cache:
+            self.tag_cache = TagCache(self.args.cache, self.args.cache_ttl * 3600, self.args.cache_size,
+                                      self.args.cache_missing_ttl * 3600)
+
+    def set_pipeline(self):
+        self.pipeline = self.args.pipeline
+
+    def set_deadline(self):
+        self.deadline = self.args.deadline
+        if self.deadline is not None and self.deadline <= 0:
+            self._fail('--deadline must be a positive number of seconds', 2)
+
+    def set_shard(self):
+        if not self.args.shard:
+            return
+        try:
+            index, count = [int(part) for part in self.args.shard.split('/')]
+        except ValueError:
+            self._fail('--shard must be given as K/N, e.g. 0/4', 2)
+        if count < 1 or not 0 <= index < count:
+            self._fail('--shard K/N needs N of at least 1 and K from 0 to N-1', 2)
+        self.shard = (index, count)
+
+    def set_metrics(self):
+        self.metrics = Metrics()
+        if self.args.metrics_json or self.args.metrics_prom:
+            atexit.register(self.write_metrics)
+
+    def write_metrics(self):
+        try:
+            if self.args.metrics_json:
+                self.metrics.write_json(self.args.metrics_json)
+            if self.args.metrics_prom:
+                self.metrics.write_prometheus(self.args.metrics_prom)
+        except IOError as e:
+            log.error('Could not write metrics: %s', e)
+
+    def set_progress(self):
+        self.progress_interval = self.args.progress_interval
+        self.progress_every = self.args.progress_every
+
+    def set_rules(self):
+        if not self.args.rules:
+            return
+        try:
+            self.rules = rules.load(self.args.rules)
+        except ImportError:
+            log.error("When the rules parameter is used, you need to have the python PyYAML library.")
+            log.error("It can be installed with pip `pip install PyYAML`.")
+            sys.exit(5)
+        except GraffitiMonkeyException as e:
+            self._fail('Bad rules in %s: %s' % (self.args.rules.name, e.message), 6)
+
+    def set_plan(self):
+        if self.args.plan_out and self.args.apply:
+            self._fail('--plan-out and --apply cannot be used together', 2)
+        if not self.args.plan_out:
+            return
+        if self.dryrun:
+            self._fail('--plan-out makes no changes already, leave out --dryrun', 2)
+        if self.checkpoint_pages:
+            self._fail('A plan cannot be checkpointed or resumed', 2)
+        try:
+            self.plan_out = plan.PlanWriter(self.args.plan_out)
+        except GraffitiMonkeyException as e:
+            self._fail(e.message, 2)
+        atexit.register(self.plan_out.close)
+
+    def set_audit(self):
+        if not self.args.audit:
+            return
+        if self.args.plan_out or self.args.apply:
+            self._fail('--audit cannot be used with --plan-out or --apply', 2)
+        try:
+            self.audit_report = AuditReport(self.args.audit_out)
+        except GraffitiMonkeyException as e:
+            self._fail(e.message, 2)
+
+    def close_audit(self):
+        ''' Writes out the audit, which must be done even when a region
+        failed, for the file to be valid JSON '''
+
+        if self.audit_report is not None:
+            self.audit_report.close()
+
+    def finish_audit(self):
+        ''' Fails if the audit found tags to change '''
+
+        if self.audit_report is None:
+            return
+        drifted = self.audit_report.drifted_total()
+        if drifted:
+            log.warn('%d resource(s) do not have the tags they should', drifted)
+            sys.exit(AUDIT_DRIFT_EXIT_CODE)
+
+    def apply_plan(self):
+        ''' Makes the changes of the plan in each account and region it
+        covers, or only those given with --region and --profile '''
+
+        try:
+            targets = plan.targets(self.args.apply)
+        except GraffitiMonkeyException as e:
+            self._fail(e.message, 2)
+        if self.args.region:
+            targets = [(profile, region) for profile, region in targets if region in self.regions]
+        if self.args.profile:
+            targets = [(profile, region) for profile, region in targets if profile in self.profiles]
+        if not targets:
+            log.info('Nothing to apply')
+
+        failures = 0
+        for target in targets:
+            profile, region = target
+            try:
+                monkey = self.create_monkey(region, profile, RateLimiter(self.args.max_rate))
+                monkey.apply_plan((tags, resource_ids) for change_profile, change_region, tags, resource_ids
+                                  in plan.read(self.args.apply) if (change_profile, change_region) == target)
+            except GraffitiMonkeyException as e:
+                failures += 1
+                log.error('Could not apply the plan in region %s using profile %s: %s', region, profile, e.message)
+        if failures:
+            GraffitiMonkeyCli._fail('%d of %d region(s) failed' % (failures, len(targets)))
 
     def config_default(self, key):
         default_value = list()
         value = self.config.get(key)
         return value if value is not None else default_value
 
+    def targets(self):
+        ''' Every (profile, region) pair to process '''
+
+        return [(profile, region) for profile in self.profiles for region in self.regions]
+
+    def create_monkey(self, region, profile, rate_limiter):
+        return self.monkey_class(region=region,
+                              profile=profile,
+                              instance_tags_to_propagate=self.config["_instance_tags_to_propagate"],
+                              volume_tags_to_propagate=self.config["_volume_tags_to_propagate"],
+                              volume_tags_to_be_set=self.config_default("_volume_tags_to_be_set"),
+                              snapshot_tags_to_be_set=self.config_default("_snapshot_tags_to_be_set"),
+                              dryrun=self.dryrun,
+                              append=self.append,
+                              volumes_to_tag=self.volumes,
+                              snapshots_to_tag=self.snapshots,
+                              instance_filter=self.instancefilter,
+                              novolumes=self.novolumes,
+                              nosnapshots=self.nosnapshots,
+                              batch_size=self.batch_size,
+                              workers=self.workers,
+                              rate_limiter=rate_limiter,
+                              page_size=self.page_size,
+                              state=self.state,
+                              incremental=self.incremental,
+                              full=self.full,
+                              tag_cache=self.tag_cache,
+                              pipeline=self.pipeline,
+                              checkpoint_pages=self.checkpoint_pages,
+                              resume=self.resume,
+                              deadline=self.deadline,
+                              shard=self.shard,
+                              metrics=self.metrics,
+                              progress_interval=self.progress_interval,
+                              progress_every=self.progress_every,
+                              rules=self.rules,
+                              plan_out=self.plan_out,
+                              amis=self.amis,
+                              enis=self.enis
+                              )
+
     def initialize_monkey(self):
-        self.monkey = GraffitiMonkey(self.region,
-                                     self.profile,
-                                     self.config["_instance_tags_to_propagate"],
-                                     self.config["_volume_tags_to_propagate"],
-                                     self.config_default("_volume_tags_to_be_set"),
-                                     self.config_default("_snapshot_tags_to_be_set"),
-                                     self.dryrun,
-                                     self.append,
-                                     self.volumes,
-                                     self.snapshots,
-                                     self.instancefilter,
-                                     self.novolumes,
-                                     self.nosnapshots
-                                     )
+        self.monkey = self.create_monkey(self.region, self.profile, self.rate_limiter)
 
     def start_tags_propagation(self):
-        self.monkey.propagate_tags()
+        self.process(self.monkey)
+
+    def process(self, monkey):
+        ''' Does what was asked in the account and region of monkey '''
+
+        if self.audit_report is not None:
+            monkey.audit(self.audit_report)
+        else:
+            monkey.propagate_tags()
+
+    def propagate_target(self, target):
+        ''' Propagates tags in one account and region, returning an error
+        message, or None when it succeeded '''
+
+        profile, region = target
+        threading.current_thread().name = '%s/%s' % (profile, region)
+        started = time.time()
+        try:
+            # EC2 throttles each account and region separately
+            monkey = self.create_monkey(region, profile, RateLimiter(self.args.max_rate))
+            self.process(monkey)
+        except GraffitiMonkeyException as e:
+            error = e.message
+        except Exception as e:
+            log.exception('Unexpected error in region %s using profile %s', region, profile)
+            error = '%s: %s' % (e.__class__.__name__, e)
+        else:
+            error = None
+        log.info('Region %s using profile %s %s after %.1f seconds', region, profile,
+                 'failed' if error else 'completed', time.time() - started)
+        return error
+
+    def propagate_all_targets(self):
+        ''' Propagates tags in every account and region, several at a time,
+        then logs a summary and fails if any of them failed '''
+
+        targets = self.targets()
+        log.info('Processing %d region(s) in %d account(s), %d at a time',
+                 len(self.regions), len(self.profiles), self.parallel)
+        Logging().show_thread_names()
+
+        pool = ThreadPool(max(1, min(self.parallel, len(targets))))
+        try:
+            errors = pool.map(self.propagate_target, targets)
+        finally:
+            pool.close()
+            pool.join()
+
+        failures = 0
+        log.info('Summary:')
+        for (profile, region), error in zip(targets, errors):
+            if error:
+                failures += 1
+                log.error('  %s/%s: failed - %s', profile, region, error)
+            else:
+                log.info('  %s/%s: completed', profile, region)
+        if failures:
+            GraffitiMonkeyCli._fail('%d of %d region(s) failed' % (failures, len(targets)))
 
     def exit_succesfully(self):
         log.info('Graffiti Monkey completed successfully!')
         sys.exit(0)
 
-    def run(self):
+    def configure(self):
+        ''' Parses the command line and sets everything up from it and the
+        configuration file '''
+
         self.set_cli_args()
 
         Logging().configure(self.args.verbose)
@@ -208,14 +662,46 @@ class GraffitiMonkeyCli(object):
         self.set_instancefilter()
         self.set_novolumes()
         self.set_nosnapshots()
+        self.set_amis()
+        self.set_enis()
+        self.set_batch_size()
+        self.set_workers()
+        self.set_rate_limiter()
+        self.set_page_size()
+        self.set_incremental()
+        self.set_checkpoint()
+        self.set_deadline()
+        self.set_shard()
+        self.set_tag_cache()
+        self.set_parallel()
+        self.set_pipeline()
+        self.set_metrics()
+        self.set_progress()
+        self.set_rules()
+        self.set_plan()
+        self.set_audit()
 
-        try:
-            self.initialize_monkey()
-            self.start_tags_propagation()
+    def run(self):
+        self.configure()
 
-        except GraffitiMonkeyException as e:
-            GraffitiMonkeyCli._fail(e.message)
+        if self.args.apply:
+            self.apply_plan()
+            self.exit_succesfully()
 
+        try:
+            if len(self.targets()) > 1:
+                self.propagate_all_targets()
+            else:
+                try:
+                    self.initialize_monkey()
+                    self.start_tags_propagation()
+
+                except GraffitiMonkeyException as e:
+                    GraffitiMonkeyCli._fail(e.message)
+        finally:
+            self.close_audit()
+
+        self.finish_audit()
         self.exit_succesfully()
 
 
@@ -15,18 +15,72 @@
 import logging
 
 from exceptions import *
+from tagger import TagWriter, DEFAULT_BATCH_SIZE
+from cache import fingerprint
+from metrics import Metrics
+from prefetch import Prefetcher
+from progress import Progress, DEFAULT_INTERVAL as DEFAULT_PROGRESS_INTERVAL
+from records import Record, VolumeRecord, SnapshotRecord, ImageRecord, InterfaceRecord, RecordPage
+from throttle import RateLimiter, is_throttle, is_retryable, backoff
 
 import boto
 from boto import ec2
-
+from boto.ec2.instance import Reservation
+from boto.ec2.networkinterface import NetworkInterface
+from boto.ec2.snapshot import Snapshot
+from boto.ec2.tag import Tag
+from boto.ec2.volume import Volume
+
+import collections
+import datetime
+import itertools
+import threading
 import time
+import zlib
+from multiprocessing.pool import ThreadPool
 
 __all__ = ('GraffitiMonkey', 'Logging')
 log = logging.getLogger(__name__)
 
+# Results per page of a Describe* call (DescribeVolumes and
+# DescribeSnapshots take MaxResults from 5 to 500)
+DEFAULT_PAGE_SIZE = 500
+MIN_PAGE_SIZE = 5
+MAX_PAGE_SIZE = 500
+
+# Snapshot start times are reported like 2013-09-30T19:33:42.000Z
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.000Z'
+
+# How far before the start of a run the next incremental run starts
+# looking, to cover snapshots that took a while to appear in the listing
+INCREMENTAL_OVERLAP = datetime.timedelta(hours=1)
+
+# Pages between checkpoints when resuming without a checkpoint interval
+DEFAULT_CHECKPOINT_PAGES = 10
+
+# What resources are called in metrics, by the prefix of their ids
+RESOURCE_KINDS = {'vol': 'volume', 'snap': 'snapshot', 'ami': 'image', 'eni': 'network interface'}
+
+# Threads looking up the volumes attached to filtered instances
+ATTACHMENT_LOOKUP_THREADS = 4
+
+# A time-budgeted run stops this share of its budget, at most
+# DEADLINE_RESERVE_MAX seconds, early to write the tags already queued
+DEADLINE_RESERVE = 0.1
+DEADLINE_RESERVE_MAX = 30
+
 
 class GraffitiMonkey(object):
-    def __init__(self, region, profile, instance_tags_to_propagate, volume_tags_to_propagate, volume_tags_to_be_set, snapshot_tags_to_be_set, dryrun, append, volumes_to_tag, snapshots_to_tag, instance_filter, novolumes, nosnapshots):
+    # Number of times an API call is tried before giving up
+    _max_attempts = 8
+
+    # Seconds the tags of every instance, fetched by a run, are reused by
+    # the later runs of the same monkey; 0 fetches them on every run
+    instance_cache_ttl = 0
+
+    def __init__(self, region, profile, instance_tags_to_propagate, volume_tags_to_propagate, volume_tags_to_be_set, snapshot_tags_to_be_set, dryrun, append, volumes_to_tag, snapshots_to_tag, instance_filter, novolumes, nosnapshots, batch_size=DEFAULT_BATCH_SIZE, workers=1, rate_limiter=None, page_size=DEFAULT_PAGE_SIZE, state=None, incremental=False, full=False, tag_cache=None, pipeline=False, checkpoint_pages=0, resume=False,
+                 deadline=None, shard=None, metrics=None, progress_interval=DEFAULT_PROGRESS_INTERVAL,
+                 progress_every=0, rules=None, plan_out=None, amis=False, enis=False):
         # This list of tags associated with an EC2 instance to propagate to
         # attached EBS volumes
         self._instance_tags_to_propagate = instance_tags_to_propagate
@@ -68,220 +122,949 @@ class GraffitiMonkey(object):
         # If we process snapshots
         self._nosnapshots = nosnapshots
 
+        # Number of resources sharing the same tags written per CreateTags call
+        self._batch_size = batch_size
+
+        # Number of threads tagging resources concurrently
+        self._workers = workers
+
+        # Paces every API call, and may be shared with other monkeys using
+        # the same account
+        self._rate_limiter = rate_limiter or RateLimiter()
+
+        # Counts API calls and resources and times the phases of the run,
+        # and may also be shared with other monkeys
+        self._metrics = metrics or Metrics()
+
+        # How often to log how far each phase has got: every so many
+        # seconds and/or resources, 0 for never
+        self._progress_interval = progress_interval
+        self._progress_every = progress_every
+
+        # Number of results requested per Describe* call, which bounds how
+        # many resources are held in memory at once
+        self._page_size = page_size
+
+        # Where the high-water mark of incremental runs is kept
+        self._state = state
+
+        # Only look at snapshots started since the last successful run,
+        # unless a full sweep is asked for
+        self._incremental = incremental
+        self._full = full
+
+        # Snapshots started before this time are skipped; None means all
+        self._since = None
+
+        # Remembers what each resource was last tagged from, so resources
+        # whose sources have not changed can be skipped
+        self._tag_cache = tag_cache
+
+        # List snapshots while volumes are being tagged
+        self._pipeline = pipeline
+
+        # Save progress to the state file after this many pages (0 never),
+        # and whether to continue from the last saved progress
+        self._checkpoint_pages = checkpoint_pages
+        self._pages_since_checkpoint = 0
+        self._resume = resume
+        self._resume_from = None
+        self._started = None
+
+        # Seconds the run may take, None for no limit. Such a run lists
+        # everything first and works newest first, counting what it leaves
+        self._deadline = deadline
+        self._stop_at = None
+        self._work_left = {}
+        self._work_left_lock = threading.Lock()
+
+        # (index, count) to only process the volumes and snapshots whose id
+        # hashes to shard index of count, or None for all of them. The
+        # others are still listed, so lookups resolve across shards
+        self._shard = shard
+
+        # Compiled tagging rules replacing the configured tags of volumes
+        # and/or snapshots, None for those the rules leave out
+        self._volume_plan = rules.plan('volume') if rules else None
+        self._snapshot_plan = rules.plan('snapshot') if rules else None
+
+        # Also tag the images (AMIs) the account owns from the snapshot of
+        # their root device, and the network interfaces attached to
+        # instances from the instance
+        self._amis = amis
+        self._enis = enis
+
+        # The snapshots of the images' root devices, by id, kept as the
+        # snapshots are listed so they need not be described again
+        self._image_snapshot_ids = set()
+        self._image_snapshots = {}
+
+        # Only the instance tags that are propagated are fetched
+        if self._volume_plan:
+            self._instance_tag_keys = self._volume_plan.tag_keys('instance')
+            if enis:
+                self._instance_tag_keys = sorted(set(self._instance_tag_keys) | set(instance_tags_to_propagate))
+        else:
+            self._instance_tag_keys = list(instance_tags_to_propagate)
+
+        # Where to write the tag changes instead of making them, or None
+        self._plan_out = plan_out
+
+        # Everything in the configuration that affects the tags set
+        self._config_inputs = (instance_tags_to_propagate, volume_tags_to_propagate,
+                               volume_tags_to_be_set, snapshot_tags_to_be_set, append)
+        if rules:
+            self._config_inputs += (rules.source, )
+
         log.info("Starting Graffiti Monkey")
-        log.info("Options: dryrun %s, append %s, novolumes %s, nosnapshots %s", self._dryrun, self._append, self._novolumes, self._nosnapshots)
+        log.info("Options: dryrun %s, append %s, novolumes %s, nosnapshots %s, workers %d", self._dryrun, self._append, self._novolumes, self._nosnapshots, self._workers)
+        if self._amis or self._enis:
+            log.info("Also tagging: images %s, network interfaces %s", self._amis, self._enis)
+        if self._shard:
+            log.info("Processing shard %d of %d shards", *self._shard)
+
+        # Each thread talks to EC2 over its own connection. Threads that
+        # finish hand theirs back for the next thread to use, so a monkey
+        # kept for further runs does not reconnect
+        self._local = threading.local()
+        self._local.conn = self._connect()
+        self._idle_conns = []
+        self._idle_conns_lock = threading.Lock()
+
+        # Worker and attachment lookup threads, created on first use and
+        # kept for later phases
+        self._pool = None
+        self._lookup_pool = None
+
+        # The tags of every instance, by id, and when they were fetched
+        self._instance_tags = None
+        self._instance_tags_at = 0
+
+        create_tags = plan_out.writer(self._profile, self._region) if plan_out else self._create_tags
+        self._tag_writer = TagWriter(create_tags, self._batch_size, self._tagging_failed, self._tagged)
+
+    def _connect(self):
+        ''' Opens a new connection to EC2 in the configured region '''
+
         log.info("Connecting to region %s using profile %s", self._region, self._profile)
         try:
-            self._conn = ec2.connect_to_region(self._region, profile_name=self._profile)
+            conn = ec2.connect_to_region(self._region, profile_name=self._profile)
         except boto.exception.NoAuthHandlerFound:
             raise GraffitiMonkeyException('No AWS credentials found - check your credentials')
         except boto.provider.ProfileNotFoundError:
             log.info("Connecting to region %s using default credentials", self._region)
             try:
-                self._conn = ec2.connect_to_region(self._region)
+                conn = ec2.connect_to_region(self._region)
             except boto.exception.NoAuthHandlerFound:
                 raise GraffitiMonkeyException('No AWS credentials found - check your credentials')
+        if conn is None:
+            raise GraffitiMonkeyException('Unknown region %s' % self._region)
+        return conn
+
+    @property
+    def _conn(self):
+        ''' The EC2 connection belonging to the calling thread '''
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            with self._idle_conns_lock:
+                conn = self._idle_conns.pop() if self._idle_conns else None
+            if conn is None:
+                conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _release_conn(self):
+        ''' Hands the connection of the calling thread, which is about to
+        finish, to the next thread needing one '''
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            with self._idle_conns_lock:
+                self._idle_conns.append(conn)
+
+    def _prefetch(self, pages, depth=1):
+        ''' Fetches pages on a background thread, which hands its connection
+        back when done '''
+
+        return Prefetcher(pages, depth, self._release_conn)
+
+    def _api(self, operation, function, *args, **kwargs):
+        ''' Makes an EC2 API call once the rate limiter allows it, retrying
+        throttled and transient failures with exponential backoff '''
+
+        for attempt in range(self._max_attempts):
+            self._rate_limiter.acquire()
+            self._metrics.count('api_calls', operation=operation)
+            started = time.time()
+            try:
+                result = function(*args, **kwargs)
+            except boto.exception.BotoServerError, e:
+                self._metrics.observe(operation, time.time() - started)
+                self._metrics.count('api_errors', operation=operation, code=e.error_code)
+                if is_throttle(e):
+                    self._rate_limiter.on_throttle()
+                    self._metrics.count('throttles', operation=operation)
+                if not is_retryable(e) or attempt == self._max_attempts - 1:
+                    raise
+                self._metrics.count('retries', operation=operation)
+                delay = backoff(attempt)
+                log.info("%s failed with %s, waiting %.1f seconds then retrying", operation, e.error_code, delay)
+                time.sleep(delay)
+            else:
+                self._metrics.observe(operation, time.time() - started)
+                self._rate_limiter.on_success()
+                return result
 
+    def _run(self, function, items):
+        ''' Calls function on each item, spreading the calls over the worker
+        threads when more than one worker is configured '''
 
-    def propagate_tags(self):
-        ''' Propagates tags by copying them from EC2 instance to EBS volume, and
-        then to snapshot '''
+        if self._workers <= 1:
+            for item in items:
+                function(item)
+            return
 
-        volumes = []
-        if not self._novolumes:
-            volumes = self.tag_volumes()
+        if self._pool is None:
+            self._pool = ThreadPool(self._workers)
+        for _ in self._pool.imap_unordered(function, items):
+            pass
 
-        volumes = { v.id: v for v in volumes }
+    def propagate_tags(self, deadline=None):
+        ''' Propagates tags by copying them from EC2 instance to EBS volume, and
+        then to snapshot, and optionally on to the images built from the
+        snapshots and to the network interfaces of the instances, reusing
+        what the earlier phases listed. deadline replaces the configured one
+        for this run '''
+
+        # The monkey may be kept for another run, e.g. in a warm Lambda
+        # container, so nothing but its connections and the instance tags
+        # is carried over from the last one
+        self._since = None
+        self._resume_from = None
+        self._pages_since_checkpoint = 0
+        self._work_left = {}
+        self._stop_at = None
+        self._image_snapshot_ids = set()
+        self._image_snapshots = {}
+
+        if deadline is None:
+            deadline = self._deadline
+        if deadline is not None:
+            self._stop_at = time.time() + deadline - min(deadline * DEADLINE_RESERVE, DEADLINE_RESERVE_MAX)
+        started = self._begin_run(datetime.datetime.utcnow())
+
+        # The images are listed first, so the snapshot phase can keep the
+        # snapshots they are built from as it lists them
+        images = []
+        if self._amis:
+            with self._metrics.phase('images'):
+                images = self._image_records()
+            self._image_snapshot_ids = set(image.snapshot_id for image in images if image.snapshot_id)
+        instance_tags = {}
+
+        # Volume tags have all been written when the last run was stopped in
+        # the snapshot phase; tag_snapshots fetches the volumes it needs
+        skip_volumes = self._resume_from is not None and self._resume_from.get('phase') == 'snapshots'
+
+        # A time-budgeted run orders each phase as a whole, so cannot overlap them
+        if self._pipeline and not self._novolumes and not self._nosnapshots and not skip_volumes \
+                and self._stop_at is None:
+            self._propagate_pipelined(instance_tags)
+        else:
+            volumes = {}
+            if not self._novolumes and not skip_volumes:
+                with self._metrics.phase('volumes'):
+                    volumes = self.tag_volumes(instance_tags=instance_tags)
+                self._checkpoint('snapshots', None, True)
+
+            if not self._nosnapshots:
+                with self._metrics.phase('snapshots'):
+                    self.tag_snapshots(volumes)
+
+        if self._enis:
+            with self._metrics.phase('network_interfaces'):
+                self.tag_interfaces(instance_tags)
+        if self._amis:
+            with self._metrics.phase('images'):
+                self.tag_images(images)
+
+        self._end_run(started)
+
+    def audit(self, report):
+        ''' Compares the tags of the volumes and snapshots with those a run
+        would set, adding each resource to report without tagging anything.
+        Snapshots are compared with the tags their volume should have '''
+
+        volumes = {}
+        instance_tags = {}
+        if not self._novolumes:
+            with self._metrics.phase('volumes'):
+                for page in self._volume_pages(instance_tags):
+                    for volume in page:
+                        volumes[volume.id] = volume
+                        if volume.status == 'in-use' and self._in_shard(volume.id):
+                            self._audit_resource(report, volume, self._volume_tags(volume, instance_tags))
 
         if not self._nosnapshots:
-            self.tag_snapshots(volumes)
+            missing_volume_ids = set()
+            with self._metrics.phase('snapshots'):
+                for page in self._snapshot_pages():
+                    snapshots = [snapshot for snapshot in page if self._in_shard(snapshot.id)]
+                    self._fetch_extra_volumes(snapshots, volumes, missing_volume_ids)
+                    for snapshot in snapshots:
+                        if snapshot.volume_id in volumes:
+                            self._audit_resource(report, snapshot, self._snapshot_tags(snapshot, volumes))
+
+    def _audit_resource(self, report, resource, tags):
+        delta_tags = self._delta(resource, tags)
+        report.add(self._profile, self._region, resource, delta_tags)
+        self._metrics.count('audited', kind=resource.kind, outcome='drifted' if delta_tags else 'ok')
+
+        # As if it had been tagged
+        resource.tags.update(delta_tags)
+
+    def apply_plan(self, changes):
+        ''' Makes the tag changes of a plan, given as (tags, resource ids)
+        pairs, without listing anything '''
+
+        total = 0
+        for tags, resource_ids in changes:
+            if self._dryrun:
+                log.info('DRYRUN: %d resource(s) would have been tagged %s', len(resource_ids), tags)
+            for resource_id in resource_ids:
+                if self._dryrun:
+                    self._metrics.count('resources', kind=self._kind(resource_id), outcome='tagged')
+                else:
+                    self._tag_writer.add(resource_id, tags)
+            total += len(resource_ids)
+        self._flush_tags()
+        log.info('Applied the plan to %d resource(s)', total)
+
+    def _propagate_pipelined(self, instance_tags):
+        ''' Tags volumes while the snapshots are listed in the background.
+        A snapshot is tagged as soon as the volume it was taken from has been
+        processed, the others once all volumes are done, so the tags set are
+        the same as when one phase runs after the other. The tags of the
+        instances are added to instance_tags '''
+
+        log.info('Listing snapshots while processing volumes')
+        snapshot_pages = self._prefetch(self._snapshot_pages(), 0)
+
+        # Snapshots listed before their volume was processed, by volume id
+        waiting = {}
+        early = [0]
+
+        def tag_ready_snapshots(volume_page, volumes):
+            ready = []
+            for volume in volume_page:
+                ready += waiting.pop(volume.id, [])
+            for page in snapshot_pages.available():
+                for snapshot in page:
+                    if not self._in_shard(snapshot.id):
+                        continue
+                    if snapshot.volume_id in volumes:
+                        ready.append(snapshot)
+                    else:
+                        waiting.setdefault(snapshot.volume_id, []).append(snapshot)
+            if ready:
+                self._run(lambda snapshot: self._tag_resource('snapshot', snapshot, self.tag_snapshot, volumes), ready)
+                early[0] += len(ready)
 
-    def tag_volumes(self):
-        ''' Gets a list of volumes, and then loops through them tagging
-        them '''
+        try:
+            with self._metrics.phase('volumes'):
+                volumes = self.tag_volumes(tag_ready_snapshots, instance_tags)
+        except:
+            snapshot_pages.close()
+            raise
+        self._checkpoint('snapshots', None, True)
+        log.info('Tagged %d snapshot(s) while processing volumes', early[0])
+
+        remaining = [snapshot for snapshots in waiting.itervalues() for snapshot in snapshots]
+        with self._metrics.phase('snapshots'):
+            self.tag_snapshots(volumes, itertools.chain([remaining], snapshot_pages))
+
+    @property
+    def _state_key(self):
+        if self._shard:
+            return '%s/%s#%d/%d' % ((self._profile, self._region) + self._shard)
+        return '%s/%s' % (self._profile, self._region)
+
+    def _begin_run(self, started):
+        ''' Works out which snapshots this run looks at, and marks the run as
+        started in the state file. Returns when the run started, which is
+        when the interrupted run started if this one carries it on '''
+
+        if not self._state:
+            return started
+
+        section = self._state.get(self._state_key)
+        if self._incremental and not self._full and not self._snapshots_to_tag:
+            self._since = section.get('snapshots_since')
+            if self._since:
+                log.info('Incremental run, only processing snapshots started since %s', self._since)
+            else:
+                log.info('No previous successful run recorded, processing all snapshots')
+        if section.get('last_run_status') == 'running':
+            log.info('The previous run did not complete')
+        if self._resume and section.get('checkpoint'):
+            self._resume_from = section['checkpoint']
+            self._since = self._resume_from.get('since')
+            started = datetime.datetime.strptime(self._resume_from['started'], TIME_FORMAT)
+            log.info('Resuming from the %s phase after %s', self._resume_from['phase'],
+                     self._resume_from.get('last_resource_id') or 'its start')
+        self._started = started
+
+        # Nothing is tagged while planning, so the state is left as it is
+        if not self._plan_out:
+            self._state.update(self._state_key, last_run_status='running')
+        return started
+
+    def _end_run(self, started):
+        ''' Records a successful run, moving the high-water mark up to when it
+        started if every snapshot since the old mark was looked at. A run
+        that stopped at its deadline is recorded as partial, with the work
+        it left '''
+
+        if self._work_left:
+            log.warn('Stopped before the deadline with %s left for the next run',
+                     ', '.join('%d %s' % (count, kind) for kind, count in sorted(self._work_left.iteritems())))
+        if not self._state or self._plan_out:
+            return
 
-        storage_counter = 0
-        volumes   = []
-        instances = {}
+        values = {
+            'last_run_status': 'completed',
+            'last_run_started': started.strftime(TIME_FORMAT),
+            'checkpoint': None,
+            'work_left': None,
+        }
+        if self._work_left:
+            # The high-water mark stays put so the next run looks at the
+            # snapshots left over again
+            values['last_run_status'] = 'partial'
+            values['work_left'] = self._work_left
+        elif not self._nosnapshots and not self._snapshots_to_tag:
+            values['snapshots_since'] = (started - INCREMENTAL_OVERLAP).strftime(TIME_FORMAT)
+            if self._since is None:
+                values['last_full_sweep'] = started.strftime(TIME_FORMAT)
+        self._state.update(self._state_key, **values)
+
+    @property
+    def work_left(self):
+        ''' What the last run left at its deadline, by kind '''
+
+        return dict(self._work_left)
+
+    def _resumable(self, phase):
+        ''' Whether the listing of the phase is a single paged call, whose
+        NextToken can be used to carry on where a run stopped '''
+
+        if phase == 'volumes':
+            return not self._volumes_to_tag and not self._instance_filter
+        return not self._snapshots_to_tag and (not self._since or len(self._since_days()) <= 200)
+
+    def _resume_token(self, phase):
+        ''' The token to start the listing of the phase from when resuming,
+        handed out once '''
+
+        if self._resume_from is None or self._resume_from.get('phase') != phase or not self._resumable(phase):
+            return None
+        token, self._resume_from = self._resume_from.get('next_token'), None
+        return token
+
+    def _checkpoint(self, phase, page, force=False):
+        ''' Saves progress to the state file every few pages, once all tags
+        queued so far have been written '''
+
+        if not self._state or not self._checkpoint_pages:
+            return
+        self._pages_since_checkpoint += 1
+        if not force and self._pages_since_checkpoint < self._checkpoint_pages:
+            return
+
+        self._tag_writer.flush()
+        checkpoint = {'phase': phase, 'since': self._since, 'started': self._started.strftime(TIME_FORMAT)}
+        if page:
+            checkpoint['last_resource_id'] = page[-1].id
+            if self._resumable(phase):
+                checkpoint['next_token'] = getattr(page, 'next_token', None)
+        log.debug('Checkpoint %s', checkpoint)
+        self._state.update(self._state_key, checkpoint=checkpoint)
+        self._pages_since_checkpoint = 0
+
+    def _in_shard(self, resource_id):
+        ''' Whether this monkey processes resource_id. crc32 is used as it is
+        the same on every node and Python version '''
+
+        if self._shard is None:
+            return True
+        index, count = self._shard
+        return (zlib.crc32(resource_id) & 0xffffffff) % count == index
+
+    def _out_of_time(self):
+        ''' Whether a time-budgeted run must stop taking on work, leaving time
+        to write the tags already queued at the rate they have been written '''
+
+        return self._stop_at is not None and time.time() + self._tag_writer.pending_seconds() >= self._stop_at
+
+    def _page_done(self):
+        ''' In a time-budgeted run, writes the tags queued for a page before
+        the next one is started, so they are written within the budget '''
+
+        if self._stop_at is not None:
+            self._tag_writer.flush()
+
+    def _leave(self, kind, count=1):
+        ''' Counts resources not processed because the run ran out of time '''
+
+        self._metrics.count('work_left', count, kind=kind)
+        with self._work_left_lock:
+            self._work_left[kind] = self._work_left.get(kind, 0) + count
+
+    def _progress(self, name, pages):
+        ''' A progress reporter for a phase. The total is known, so the time
+        left can be estimated, when the whole listing is at hand '''
+
+        progress = Progress(name, self._progress_interval, self._progress_every)
+        if isinstance(pages, list):
+            progress.set_total(sum(1 for page in pages for resource in page if self._in_shard(resource.id)))
+        return progress
+
+    def _newest_first(self, pages, key):
+        ''' In a time-budgeted run, lists every resource before any is
+        processed and hands them out in pages, newest first by key. Other
+        runs get the pages as they are listed '''
+
+        if self._stop_at is None:
+            return pages
+
+        records = []
+        for page in pages:
+            records.extend(page)
+            if self._out_of_time():
+                log.warn('Ran out of time while listing, after %d resource(s)', len(records))
+                self._leave('listings cut short')
+                pages.close()
+                break
+        records.sort(key=key, reverse=True)
+        return [records[n:n+self._page_size] for n in xrange(0, len(records), self._page_size)]
+
+    def _since_days(self):
+        ''' start-time filter values matching every day from the high-water
+        mark until tomorrow (UTC), as EC2 cannot filter on a time range '''
+
+        day = datetime.datetime.strptime(self._since, TIME_FORMAT).date()
+        last = datetime.datetime.utcnow().date() + datetime.timedelta(days=1)
+        days = []
+        while day <= last:
+            days.append(day.strftime('%Y-%m-%d*'))
+            day += datetime.timedelta(days=1)
+        return days
+
+    def _pages(self, operation, markers, filters=None, next_token=None, **lists):
+        ''' Yields the result of a Describe* call one page at a time,
+        following NextToken until the last page. next_token starts the
+        listing part way through '''
+
+        params = {'MaxResults': self._page_size}
+        if next_token:
+            params['NextToken'] = next_token
+        if filters:
+            self._conn.build_filter_params(params, filters)
+        for label, values in lists.iteritems():
+            self._conn.build_list_params(params, values, label)
+
+        while True:
+            page = self._api(operation, self._conn.get_list, operation, dict(params), markers, verb='POST')
+            yield page
+            if not page.next_token:
+                return
+            params['NextToken'] = page.next_token
+
+    def _reservation_instances(self, filters=None):
+        ''' Yields the instances of all reservations matching the filters '''
+
+        for page in self._pages('DescribeInstances', [('item', Reservation)], filters):
+            for reservation in page:
+                for instance in reservation.instances:
+                    yield instance
+
+    def _volume_records(self, filters=None, next_token=None):
+        ''' Yields pages of volumes, as records '''
+
+        for page in self._pages('DescribeVolumes', [('item', Volume)], filters, next_token):
+            yield RecordPage([VolumeRecord.from_volume(volume) for volume in page], page.next_token)
+
+    def _snapshot_records(self, filters=None, next_token=None, **lists):
+        ''' Yields pages of snapshots, as records, keeping those images are
+        built from '''
+
+        for page in self._pages('DescribeSnapshots', [('item', Snapshot)], filters, next_token, **lists):
+            records = RecordPage([SnapshotRecord.from_snapshot(snapshot) for snapshot in page], page.next_token)
+            if self._image_snapshot_ids:
+                for snapshot in records:
+                    if snapshot.id in self._image_snapshot_ids:
+                        self._image_snapshots[snapshot.id] = snapshot
+            yield records
+
+    def _image_records(self):
+        ''' The images the account owns, as records. DescribeImages is not
+        paged; an account owns few enough images to list them at once '''
+
+        images = self._api('DescribeImages', self._conn.get_all_images, owners=['self'])
+        return [ImageRecord.from_image(image) for image in images]
+
+    def _interface_records(self):
+        ''' Yields pages of network interfaces, as records '''
+
+        for page in self._pages('DescribeNetworkInterfaces', [('item', NetworkInterface)]):
+            yield RecordPage([InterfaceRecord.from_interface(interface) for interface in page], page.next_token)
+
+    def _resource_tags(self, resource_type, resource_ids=None, keys=None):
+        ''' Returns the tags of every resource of the given type that has any,
+        or only of the given resource ids, by resource id. DescribeTags
+        returns far less than the Describe call of the resource itself.
+        keys limits the tags fetched to those keys '''
+
+        if keys is not None and not keys:
+            return {}
+        filters = {'resource-type': resource_type}
+        if resource_ids is not None:
+            filters['resource-id'] = resource_ids
+        if keys is not None:
+            filters['key'] = keys
+
+        resource_tags = {}
+        for page in self._pages('DescribeTags', [('item', Tag)], filters):
+            for tag in page:
+                resource_tags.setdefault(tag.res_id, {})[tag.name] = tag.value
+        return resource_tags
+
+    @staticmethod
+    def _id_chunks(resource_ids, requested, size=200):
+        ''' Yields the distinct ids of the iterable resource_ids in lists of
+        up to size (a request takes at most 200 filter values), adding each
+        to the set requested. The ids are read as they are needed, so they
+        may be streamed from a file '''
+
+        chunk = []
+        for resource_id in resource_ids:
+            if resource_id in requested:
+                continue
+            requested.add(resource_id)
+            chunk.append(resource_id)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _attached_volumes(self, instance_ids):
+        ''' The volumes attached to any of instance_ids '''
+
+        volumes = []
+        for page in self._volume_records({'attachment.instance-id': instance_ids}):
+            volumes += page
+        return volumes
+
+    def _filtered_volume_pages(self, instance_tags):
+        ''' Yields the volumes attached to the instances matching the filter,
+        one page per 200 instances. The volumes of each 200 are looked up on
+        a few threads while further instances are being listed '''
+
+        if self._lookup_pool is None:
+            self._lookup_pool = ThreadPool(ATTACHMENT_LOOKUP_THREADS)
+        pending = collections.deque()
+
+        # Max of 200 filters in a request
+        chunk = []
+        for instance in self._reservation_instances(self._instance_filter):
+            instance_tags[instance.id] = dict(instance.tags)
+            chunk.append(instance.id)
+            if len(chunk) == 200:
+                pending.append(self._lookup_pool.apply_async(self._attached_volumes, (chunk, )))
+                chunk = []
+            while pending and pending[0].ready():
+                yield pending.popleft().get()
+        if chunk:
+            pending.append(self._lookup_pool.apply_async(self._attached_volumes, (chunk, )))
+        while pending:
+            yield pending.popleft().get()
+
+    def _all_instance_tags(self):
+        ''' The tags of every instance that has any, by id. Those an earlier
+        run fetched are reused for instance_cache_ttl seconds '''
+
+        now = time.time()
+        if self._instance_tags is None or now - self._instance_tags_at >= self.instance_cache_ttl:
+            self._instance_tags = self._resource_tags('instance', keys=self._instance_tag_keys)
+            self._instance_tags_at = now
+            self._metrics.count('instance_tag_lookups', len(self._instance_tags), source='api')
+        else:
+            log.info('Reusing the tags of %d instance(s) fetched %ds ago', len(self._instance_tags),
+                     now - self._instance_tags_at)
+            self._metrics.count('instance_tag_lookups', len(self._instance_tags), source='cache')
+        return self._instance_tags
+
+    def _volume_pages(self, instance_tags):
+        ''' Yields pages of the volumes to tag, adding the tags of the
+        instances they are attached to into instance_tags before each page
+        is yielded '''
 
         if self._volumes_to_tag:
             log.info('Using volume list from cli/config file')
 
-            # Max of 200 filters in a request
-            for chunk in (self._volumes_to_tag[n:n+200] for n in xrange(0, len(self._volumes_to_tag), 200)):
-                chunk_volumes = self._conn.get_all_volumes(
-                        filters = { 'volume-id': chunk }
-                        )
-                volumes += chunk_volumes
-
-                chunk_instance_ids = set(v.attach_data.instance_id for v in chunk_volumes)
-                reservations = self._conn.get_all_instances(
-                        filters = {'instance-id': [id for id in chunk_instance_ids]}
-                        )
-                for reservation in reservations:
-                    for instance in reservation.instances:
-                        instances[instance.id] = instance
-
-            volume_ids = [v.id for v in volumes]
+            requested = set()
+            found = set()
+
+            for chunk in self._id_chunks(self._volumes_to_tag, requested):
+                chunk_volumes = []
+                for page in self._volume_records({ 'volume-id': chunk }):
+                    chunk_volumes += page
+                found.update(v.id for v in chunk_volumes)
+
+                chunk_instance_ids = set(v.instance_id for v in chunk_volumes if v.instance_id)
+                if chunk_instance_ids:
+                    instance_tags.update(self._resource_tags('instance', list(chunk_instance_ids),
+                                                             self._instance_tag_keys))
+                yield chunk_volumes
 
             ''' We can't trust the volume list from the config file so we
-            test the status of each volume and remove any that raise an exception '''
-            for volume_id in self._volumes_to_tag:
-                if volume_id not in volume_ids:
-                    log.info('Volume %s does not exist and will not be tagged', volume_id)
-                    self._volumes_to_tag.remove(volume_id)
+            report any that were not found '''
+            for volume_id in sorted(requested - found):
+                log.info('Volume %s does not exist and will not be tagged', volume_id)
 
         elif self._instance_filter:
             log.info('Filter instances and retrieve volume ids')
-            instances = dict((instance.id, instance) for instance in self._conn.get_only_instances(filters=self._instance_filter))
-            volumes = self._conn.get_all_volumes(filters={'attachment.instance-id': list(instances.keys())})
+            # The filter may be on any instance attribute, so this needs the
+            # full instances
+            for page in self._filtered_volume_pages(instance_tags):
+                yield page
 
         else:
             log.info('Getting list of all volumes')
-            volumes = self._conn.get_all_volumes()
-            reservations = self._conn.get_all_instances()
-            for reservation in reservations:
-                for instance in reservation.instances:
-                    instances[instance.id] = instance
+            instance_tags.update(self._all_instance_tags())
+            for page in self._volume_records(next_token=self._resume_token('volumes')):
+                yield page
 
-        if not volumes:
-            log.info('No volumes found')
-            return True
+    def tag_volumes(self, after_page=None, instance_tags=None):
+        ''' Gets the volumes a page at a time, and loops through each page
+        tagging them. Returns the volumes seen, by id. after_page is called
+        with each page and the volumes seen so far once the page is done.
+        The tags of the instances are added to instance_tags, if given '''
 
-        log.debug('Volume list >%s<', volumes)
-        total_vols = len(volumes)
-        log.info('Found %d volume(s)', total_vols)
-        this_vol = 0
-        for volume in volumes:
-            this_vol += 1
-            storage_counter += volume.size
-            log.info ('Processing volume %d of %d total volumes', this_vol, total_vols)
+        storage_counter = 0
+        volumes   = {}
+        if instance_tags is None:
+            instance_tags = {}
+
+        def process(item):
+            this_vol, volume = item
+            if not self._in_shard(volume.id):
+                return
+            if self._out_of_time():
+                self._leave('volumes')
+                return
+            log.debug('Processing volume %d: %s', this_vol, volume.id)
+            progress.add()
 
             if volume.status != 'in-use':
                 log.debug('Skipping %s as it is not attached to an EC2 instance, so there is nothing to propagate', volume.id)
-                continue
+                self._metrics.count('resources', kind='volume', outcome='skipped')
+                return
+
+            self._tag_resource('volume', volume, self.tag_volume, instance_tags)
+
+        pages = self._newest_first(self._prefetch(self._volume_pages(instance_tags)), lambda v: v.create_time)
+        progress = self._progress('volumes', pages)
+        for page in pages:
+            log.debug('Volume page >%s<', page)
+            first = len(volumes) + 1
+            for volume in page:
+                volumes[volume.id] = volume
+                storage_counter += volume.size
+            self._run(process, enumerate(page, first))
+            self._page_done()
+            if after_page:
+                after_page(page, volumes)
+            self._checkpoint('volumes', page)
 
-            for attempt in range(5):
-                try:
-                    self.tag_volume(volume, instances)
-                except boto.exception.EC2ResponseError, e:
-                    log.error("Encountered Error %s on volume %s", e.error_code, volume.id)
-                    break
-                except boto.exception.BotoServerError, e:
-                    log.error("Encountered Error %s on volume %s, waiting %d seconds then retrying", e.error_code, volume.id, attempt)
-                    time.sleep(attempt)
-                else:
-                    break
-            else:
-                log.error("Encountered Error %s on volume %s, %d retries failed, continuing", e.error_code, volume.id, attempt)
-                continue
+        if not volumes:
+            log.info('No volumes found')
+            return volumes
 
+        self._flush_tags()
+        progress.finish()
+        log.info('Found %d volume(s)', len(volumes))
         log.info('Processed a total of {0} GB of AWS Volumes'.format(storage_counter))
         log.info('Completed processing all volumes')
 
         return volumes
 
 
-    def tag_volume(self, volume, instances):
-        ''' Tags a specific volume '''
+    def tag_volume(self, volume, instance_tags):
+        ''' Tags a specific volume, given the tags of all instances by id '''
+
+        if self._volume_plan is not None:
+            return self._apply_tags(volume, self._volume_tags(volume, instance_tags))
+
+        instance_id = volume.instance_id
+        device = volume.device
 
-        instance_id = None
-        if volume.attach_data.instance_id:
-            instance_id = volume.attach_data.instance_id
-        device = None
-        if volume.attach_data.device:
-            device = volume.attach_data.device
+        # Instances without any tags have no entry
+        source_tags = instance_tags.get(instance_id, {})
 
-        instance_tags = instances[instance_id].tags
+        inputs = self._fingerprint(instance_id, device, self._propagated(source_tags, self._instance_tags_to_propagate))
+        if self._is_unchanged(volume, inputs):
+            log.debug('Skipping %s as it was already tagged from the same instance tags', volume.id)
+            return True
 
         tags_to_set = {}
         if self._append:
-            tags_to_set = volume.tags
+            tags_to_set = dict(volume.tags)
+        tags_to_set.update(self._volume_tags(volume, instance_tags))
+
+        if self._dryrun:
+            log.info('DRYRUN: Volume %s would have been tagged %s', volume.id, tags_to_set)
+        else:
+            self._set_resource_tags(volume, tags_to_set, inputs)
+        return True
+
+    def _volume_tags(self, volume, instance_tags):
+        ''' The tags volume should have, leaving aside --append '''
+
+        if self._volume_plan is not None:
+            return self._volume_plan.tags(volume, {'instance': instance_tags})
+
+        # Instances without any tags have no entry
+        source_tags = instance_tags.get(volume.instance_id, {})
+
+        tags = {}
         for tag_name in self._instance_tags_to_propagate:
             log.debug('Trying to propagate instance tag: %s', tag_name)
-            if tag_name in instance_tags:
-                value = instance_tags[tag_name]
-                tags_to_set[tag_name] = value
+            if tag_name in source_tags:
+                tags[tag_name] = source_tags[tag_name]
 
         # Additional tags
-        tags_to_set['instance_id'] = instance_id
-        tags_to_set['device'] = device
+        tags['instance_id'] = volume.instance_id
+        tags['device'] = volume.device
 
         # Set default tags for volume
         for tag in self._volume_tags_to_be_set:
             log.debug('Trying to set default tag: %s=%s', tag['key'], tag['value'])
-            tags_to_set[tag['key']] = tag['value']
-
-        if self._dryrun:
-            log.info('DRYRUN: Volume %s would have been tagged %s', volume.id, tags_to_set)
-        else:
-            self._set_resource_tags(volume, tags_to_set)
-        return True
+            tags[tag['key']] = tag['value']
+        return tags
 
 
-    def tag_snapshots(self, volumes):
-        ''' Gets a list of snapshots, and then loops through them tagging
-        them '''
+    def _snapshot_pages(self):
+        ''' Yields pages of the snapshots to tag '''
 
-        snapshots = []
         if self._snapshots_to_tag:
             log.info('Using snapshot list from cli/config file')
 
-            # Max of 200 filters in a request
-            for chunk in (self._snapshots_to_tag[n:n+200] for n in xrange(0, len(self._snapshots_to_tag), 200)):
-                chunk_snapshots = self._conn.get_all_snapshots(
-                        filters = { 'snapshot-id': chunk }
-                        )
-                snapshots += chunk_snapshots
-            snapshot_ids = [s.id for s in snapshots]
+            requested = set()
+            found = set()
+
+            for chunk in self._id_chunks(self._snapshots_to_tag, requested):
+                for page in self._snapshot_records({ 'snapshot-id': chunk }):
+                    found.update(s.id for s in page)
+                    yield page
 
             ''' We can't trust the snapshot list from the config file so we
-            test the status of each and remove any that raise an exception '''
-            for snapshot_id in self._snapshots_to_tag:
-                if snapshot_id not in snapshot_ids:
-                    log.info('Snapshot %s does not exist and will not be tagged', snapshot_id)
-                    self._snapshots_to_tag.remove(snapshot)
+            report any that were not found '''
+            for snapshot_id in sorted(requested - found):
+                log.info('Snapshot %s does not exist and will not be tagged', snapshot_id)
+        elif self._since:
+            log.info('Getting list of snapshots started since %s', self._since)
+            days = self._since_days()
+            next_token = self._resume_token('snapshots')
+
+            # Max of 200 filters in a request
+            for chunk in (days[n:n+200] for n in xrange(0, len(days), 200)):
+                for page in self._snapshot_records({ 'start-time': chunk }, next_token, Owner=['self']):
+                    yield RecordPage([s for s in page if s.start_time >= self._since], page.next_token)
         else:
             log.info('Getting list of all snapshots')
-            snapshots = self._conn.get_all_snapshots(owner='self')
+            for page in self._snapshot_records(next_token=self._resume_token('snapshots'), Owner=['self']):
+                yield page
+
+    def _fetch_extra_volumes(self, snapshots, volumes, missing_volume_ids):
+        ''' Fetch any extra volumes that weren't carried over from tag_volumes()
+        (if any), remembering those that no longer exist. Volumes the tag
+        cache knows to be deleted are not asked for again '''
+
+        extra_volume_ids = set(s.volume_id for s in snapshots
+                               if s.volume_id not in volumes and s.volume_id not in missing_volume_ids)
+        if extra_volume_ids and self._tag_cache is not None:
+            known = self._tag_cache.missing(extra_volume_ids)
+            missing_volume_ids.update(known)
+            extra_volume_ids -= known
+        extra_volume_ids = list(extra_volume_ids)
+
+        for chunk in (extra_volume_ids[n:n+200] for n in xrange(0, len(extra_volume_ids), 200)):
+            for page in self._volume_records({ 'volume-id': chunk }):
+                for vol in page:
+                    volumes[vol.id] = vol
+            deleted = [id for id in chunk if id not in volumes]
+            missing_volume_ids.update(deleted)
+            if deleted and self._tag_cache is not None:
+                self._tag_cache.put_missing(deleted)
+
+    def tag_snapshots(self, volumes, pages=None):
+        ''' Gets the snapshots a page at a time, and loops through each page
+        tagging them. pages may give snapshot pages that are already being
+        fetched '''
+
+        total_snaps = 0
+        orphans = 0
+        missing_volume_ids = set()
+
+        if pages is None and self._out_of_time():
+            log.warn('No time left to list snapshots')
+            self._leave('listings cut short')
+            return
 
-        if not snapshots:
+        def process(item):
+            this_snap, snapshot = item
+            if self._out_of_time():
+                self._leave('snapshots')
+                return
+            log.debug('Processing snapshot %d: %s', this_snap, snapshot.id)
+            progress.add()
+            self._tag_resource('snapshot', snapshot, self.tag_snapshot, volumes)
+
+        pages = pages or self._newest_first(self._prefetch(self._snapshot_pages()), lambda s: s.start_time)
+        progress = self._progress('snapshots', pages)
+        for page in pages:
+            log.debug('Snapshot page >%s<', page)
+            snapshots = [snapshot for snapshot in page if self._in_shard(snapshot.id)]
+            if self._out_of_time():
+                self._leave('snapshots', len(snapshots))
+                total_snaps += len(snapshots)
+                continue
+            self._fetch_extra_volumes(snapshots, volumes, missing_volume_ids)
+
+            # Snapshots of deleted volumes have nothing to propagate
+            tagged = [snapshot for snapshot in snapshots if snapshot.volume_id not in missing_volume_ids]
+            self._run(process, enumerate(tagged, total_snaps - orphans + 1))
+            self._page_done()
+            if len(tagged) < len(snapshots):
+                progress.add(len(snapshots) - len(tagged))
+                orphans += len(snapshots) - len(tagged)
+                self._metrics.count('resources', len(snapshots) - len(tagged), kind='snapshot', outcome='skipped')
+            total_snaps += len(snapshots)
+            self._checkpoint('snapshots', page)
+
+        self._flush_tags()
+        progress.finish()
+        if not total_snaps:
             log.info('No snapshots found')
             return True
 
-        all_volume_ids = set(s.volume_id for s in snapshots)
-        extra_volume_ids = [id for id in all_volume_ids if id not in volumes]
-
-        ''' Fetch any extra volumes that weren't carried over from tag_volumes() (if any) '''
-        for chunk in (extra_volume_ids[n:n+200] for n in xrange(0, len(extra_volume_ids), 200)):
-            extra_volumes = self._conn.get_all_volumes(
-                    filters = { 'volume-id': chunk }
-                    )
-            for vol in extra_volumes:
-                volumes[vol.id] = vol
-
-        log.debug('Snapshot list >%s<', snapshots)
-        total_snaps = len(snapshots)
         log.info('Found %d snapshot(s)', total_snaps)
-        this_snap = 0
-
-        for snapshot in snapshots:
-            this_snap += 1
-            log.info ('Processing snapshot %d of %d total snapshots', this_snap, total_snaps)
-            for attempt in range(5):
-                try:
-                    self.tag_snapshot(snapshot, volumes)
-                except boto.exception.EC2ResponseError, e:
-                    log.error("Encountered Error %s on snapshot %s", e.error_code, snapshot.id)
-                    break
-                except boto.exception.BotoServerError, e:
-                    log.error("Encountered Error %s on snapshot %s, waiting %d seconds then retrying", e.error_code, snapshot.id, attempt)
-                    time.sleep(attempt)
-                else:
-                    break
-            else:
-                log.error("Encountered Error %s on snapshot %s, %d retries failed, continuing", e.error_code, snapshot.id, attempt)
-                continue
+        if orphans:
+            log.info('Skipped %d snapshot(s) of %d deleted volume(s)', orphans, len(missing_volume_ids))
         log.info('Completed processing all snapshots')
 
     def tag_snapshot(self, snapshot, volumes):
@@ -290,49 +1073,260 @@ class GraffitiMonkey(object):
         volume_id = snapshot.volume_id
 
         if volume_id not in volumes:
-            log.info("Snapshot %s volume %s not found. Snapshot will not be tagged", snapshot.id, volume_id)
+            log.debug("Snapshot %s volume %s not found. Snapshot will not be tagged", snapshot.id, volume_id)
+            self._metrics.count('resources', kind='snapshot', outcome='skipped')
             return
 
+        if self._snapshot_plan is not None:
+            return self._apply_tags(snapshot, self._snapshot_tags(snapshot, volumes))
+
         volume_tags = volumes[volume_id].tags
 
+        inputs = self._fingerprint(volume_id, self._propagated(volume_tags, self._volume_tags_to_propagate))
+        if self._is_unchanged(snapshot, inputs):
+            log.debug('Skipping %s as it was already tagged from the same volume tags', snapshot.id)
+            return True
+
         tags_to_set = {}
         if self._append:
-            tags_to_set = snapshot.tags
+            tags_to_set = dict(snapshot.tags)
+        tags_to_set.update(self._snapshot_tags(snapshot, volumes))
+
+        if self._dryrun:
+            log.info('DRYRUN: Snapshot %s would have been tagged %s', snapshot.id, tags_to_set)
+        else:
+            self._set_resource_tags(snapshot, tags_to_set, inputs)
+        return True
+
+    def _snapshot_tags(self, snapshot, volumes):
+        ''' The tags snapshot should have, given the volumes by id, leaving
+        aside --append '''
+
+        if self._snapshot_plan is not None:
+            return self._snapshot_plan.tags(snapshot, {'volume': volumes})
+
+        volume_tags = volumes[snapshot.volume_id].tags
+
+        tags = {}
         for tag_name in self._volume_tags_to_propagate:
             log.debug('Trying to propagate volume tag: %s', tag_name)
             if tag_name in volume_tags:
-                tags_to_set[tag_name] = volume_tags[tag_name]
+                tags[tag_name] = volume_tags[tag_name]
 
         # Set default tags for snapshot
         for tag in self._snapshot_tags_to_be_set:
             log.debug('Trying to set default tag: %s=%s', tag['key'], tag['value'])
-            tags_to_set[tag['key']] = tag['value']
+            tags[tag['key']] = tag['value']
+        return tags
+
+    def tag_interfaces(self, instance_tags):
+        ''' Gets the network interfaces a page at a time, and tags those
+        attached to instances. instance_tags holds the instance tags already
+        fetched by the volume phase, by instance id; those of any other
+        instance are fetched as they are needed, and added to it '''
+
+        total = 0
+
+        def process(interface):
+            if self._out_of_time():
+                self._leave('network interfaces')
+                return
+            progress.add()
+            self._tag_resource('network interface', interface, self.tag_interface, instance_tags)
+
+        pages = self._interface_records()
+        progress = self._progress('network interfaces', pages)
+        for page in pages:
+            # Interfaces of NAT gateways, load balancers and the like have
+            # no instance to propagate from
+            interfaces = [interface for interface in page if interface.instance_id and self._in_shard(interface.id)]
+            if self._out_of_time():
+                self._leave('network interfaces', len(interfaces))
+                continue
 
+            unknown = [interface.instance_id for interface in interfaces if interface.instance_id not in instance_tags]
+            for chunk in self._id_chunks(unknown, set()):
+                fetched = self._resource_tags('instance', chunk, self._instance_tag_keys)
+                for instance_id in chunk:
+                    # Untagged instances too, so they are only asked for once
+                    instance_tags[instance_id] = fetched.get(instance_id, {})
+
+            self._run(process, interfaces)
+            self._page_done()
+            total += len(interfaces)
+
+        self._flush_tags()
+        progress.finish()
+        log.info('Found %d network interface(s) attached to instances', total)
+
+    def tag_interface(self, interface, instance_tags):
+        ''' Tags a network interface with the tags of its instance '''
+
+        # Instances without any tags have no entry
+        tags = self._propagated(instance_tags.get(interface.instance_id, {}), self._instance_tags_to_propagate)
+        tags['instance_id'] = interface.instance_id
+        return self._apply_tags(interface, tags)
+
+    def tag_images(self, images):
+        ''' Tags the images with the tags of the snapshot of their root
+        device. The snapshots the snapshot phase listed are used as they
+        are, with the tags it gave them; the others are fetched '''
+
+        snapshots = self._image_snapshots
+        missing = [snapshot_id for snapshot_id in self._image_snapshot_ids if snapshot_id not in snapshots]
+        for chunk in self._id_chunks(missing, set()):
+            for page in self._snapshot_records({'snapshot-id': chunk}):
+                snapshots.update((snapshot.id, snapshot) for snapshot in page)
+
+        def process(image):
+            if self._out_of_time():
+                self._leave('images')
+                return
+            progress.add()
+            if image.snapshot_id not in snapshots:
+                log.debug('Skipping image %s as it has no EBS snapshot to propagate from', image.id)
+                self._metrics.count('resources', kind='image', outcome='skipped')
+                return
+            self._tag_resource('image', image, self.tag_image, snapshots)
+
+        images = [image for image in images if self._in_shard(image.id)]
+        progress = self._progress('images', [images])
+        self._run(process, images)
+
+        self._flush_tags()
+        progress.finish()
+        log.info('Found %d image(s)', len(images))
+
+    def tag_image(self, image, snapshots):
+        ''' Tags an image with the tags of its root device's snapshot, which
+        carries those of the volume it was taken from '''
+
+        snapshot = snapshots[image.snapshot_id]
+        return self._apply_tags(image, self._propagated(snapshot.tags, self._volume_tags_to_propagate))
+
+    def _apply_tags(self, resource, tags):
+        ''' Tags resource with tags worked out in full, by the compiled rules
+        or for an image or network interface '''
+
+        inputs = self._fingerprint(tags)
+        if self._is_unchanged(resource, inputs):
+            log.debug('Skipping %s as it was already tagged with the same tags', resource.id)
+            return True
+
+        if self._append:
+            tags_to_set = dict(resource.tags)
+            tags_to_set.update(tags)
+            tags = tags_to_set
         if self._dryrun:
-            log.info('DRYRUN: Snapshot %s would have been tagged %s', snapshot.id, tags_to_set)
+            log.info('DRYRUN: %s %s would have been tagged %s', resource.kind.capitalize(), resource.id, tags)
         else:
-            self._set_resource_tags(snapshot, tags_to_set)
+            self._set_resource_tags(resource, tags, inputs)
         return True
 
+    @staticmethod
+    def _propagated(tags, tag_names):
+        ''' The subset of tags that would be propagated '''
 
-    def _set_resource_tags(self, resource, tags):
-        ''' Sets the tags on the given AWS resource '''
+        return dict((name, tags[name]) for name in tag_names if name in tags)
 
-        if not isinstance(resource, ec2.ec2object.TaggedEC2Object):
-            msg = 'Resource %s is not an instance of TaggedEC2Object' % resource
-            raise GraffitiMonkeyException(msg)
+    def _fingerprint(self, *inputs):
+        ''' Fingerprint of the configuration and the given inputs, or None
+        when no tag cache is used '''
+
+        if self._tag_cache is None:
+            return None
+        return fingerprint(self._config_inputs, *inputs)
+
+    def _is_unchanged(self, resource, inputs):
+        if inputs is None or not self._tag_cache.unchanged(resource.id, inputs):
+            return False
+        self._metrics.count('resources', kind=resource.kind, outcome='cached')
+        return True
+
+    def _remember(self, resource_id, inputs):
+        if inputs is not None and not self._plan_out:
+            self._tag_cache.put(resource_id, inputs)
+
+    @staticmethod
+    def _kind(resource_id):
+        ''' What a resource is called in metrics '''
+
+        return RESOURCE_KINDS.get(resource_id.split('-')[0], 'resource')
+
+    def _tagged(self, entries):
+        ''' Counts the resources just tagged and remembers what they were
+        tagged from, given (resource id, fingerprint) pairs '''
+
+        for resource_id, inputs in entries:
+            self._metrics.count('resources', kind=self._kind(resource_id), outcome='tagged')
+            self._remember(resource_id, inputs)
+
+    def _tagging_failed(self, resource_ids):
+        ''' Makes sure resources whose tags could not be written are looked
+        at again next time '''
+
+        for resource_id in resource_ids:
+            self._metrics.count('resources', kind=self._kind(resource_id), outcome='failed')
+        if self._tag_cache is not None:
+            self._tag_cache.forget(resource_ids)
 
-        delta_tags = {}
 
+    def _tag_resource(self, kind, resource, tag_function, *args):
+        ''' Calls tag_function on the resource, logging any API error that
+        is left once the call's own retries have been used up '''
+
+        try:
+            tag_function(resource, *args)
+        except boto.exception.BotoServerError, e:
+            log.error("Encountered Error %s on %s %s, continuing", e.error_code, kind, resource.id)
+
+    @staticmethod
+    def _delta(resource, tags):
+        ''' The tags resource does not have yet '''
+
+        delta_tags = {}
         for tag_key, tag_value in tags.iteritems():
             if not tag_key in resource.tags or resource.tags[tag_key] != tag_value:
                 delta_tags[tag_key] = tag_value
+        return delta_tags
+
+    def _set_resource_tags(self, resource, tags, inputs=None):
+        ''' Sets the tags on the given AWS resource. The fingerprint of the
+        inputs is remembered once the tags have been written '''
+
+        if not isinstance(resource, Record):
+            msg = 'Resource %s is not an instance of Record' % resource
+            raise GraffitiMonkeyException(msg)
+
+        delta_tags = self._delta(resource, tags)
 
         if len(delta_tags) == 0:
+            self._metrics.count('resources', kind=resource.kind, outcome='unchanged')
+            self._remember(resource.id, inputs)
             return
 
-        log.info('Tagging %s with [%s]', resource.id, delta_tags)
-        resource.add_tags(delta_tags)
+        log.debug('Queueing %s to be tagged with [%s]', resource.id, delta_tags)
+        self._tag_writer.add(resource.id, delta_tags, inputs)
+
+        # Keep the local copy current so that tags propagated to a volume are
+        # seen when its snapshots are tagged, before the batch is written
+        resource.tags.update(delta_tags)
+
+    def _flush_tags(self):
+        ''' Writes the tags still queued at the end of a phase, and logs how
+        many resources the phase tagged '''
+
+        self._tag_writer.flush()
+        written, calls, failed = self._tag_writer.take_counts()
+        if written:
+            log.info('Tagged %d resource(s) with %d CreateTags call(s)', written, calls)
+        if failed:
+            log.warn('Could not tag %d resource(s)', failed)
+
+    def _create_tags(self, resource_ids, tags):
+        ''' Sets the tags on all of the given resource ids in one call '''
+
+        self._api('CreateTags', self._conn.create_tags, resource_ids, tags)
 
 
 
@@ -341,6 +1335,16 @@ class Logging(object):
     _log_simple_format = '%(asctime)s [%(levelname)s] %(message)s'
     _log_detailed_format = '%(asctime)s [%(levelname)s] [%(name)s(%(lineno)s):%(funcName)s] %(message)s'
 
+    def show_thread_names(self):
+        ''' Adds the thread name to every log line, for when several regions
+        are processed at once '''
+
+        for handler in logging.getLogger().handlers:
+            format = handler.formatter._fmt if handler.formatter else self._log_simple_format
+            if '%(threadName)s' not in format:
+                format = format.replace('[%(levelname)s]', '[%(levelname)s] [%(threadName)s]', 1)
+                handler.setFormatter(logging.Formatter(format, datefmt='%Y-%m-%d %H:%M:%S'))
+
     def configure(self, verbosity = None):
         ''' Configure the logging format and verbosity '''
 
@@ -0,0 +1,396 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+''' Long-running mode: instead of sweeping the account, tag only the volumes
+and snapshots named by EC2 lifecycle events as they arrive, from an SQS
+queue or from a file of JSON events, one per line '''
+
+import json
+import logging
+import signal
+import sys
+import time
+
+import boto
+
+from graffiti_monkey.cli import GraffitiMonkeyCli, read_ids
+from graffiti_monkey.core import GraffitiMonkey
+from graffiti_monkey.exceptions import GraffitiMonkeyException
+
+
+__all__ = ('run', 'parse_event', 'EventMonkey', 'Daemon', 'SqsSource', 'FileSource')
+log = logging.getLogger(__name__)
+
+# Seconds the tags of an instance are reused before being fetched again
+DEFAULT_INSTANCE_CACHE_TTL = 300
+
+# Most messages SQS returns per receive, and the longest it may wait for one
+SQS_BATCH = 10
+SQS_WAIT = 20
+
+# Seconds between looks at a followed file that has nothing new
+FOLLOW_POLL = 1.0
+
+# CloudTrail events, by name, and where in the event the resource id is
+CLOUDTRAIL_EVENTS = {
+    'CreateVolume': 'volumeId',
+    'AttachVolume': 'volumeId',
+    'CreateSnapshot': 'snapshotId',
+    'CopySnapshot': 'snapshotId',
+}
+
+
+def _ids_from_arns(arns):
+    ''' The volume and snapshot ids in a list of ARNs (or plain ids) '''
+
+    ids = []
+    for arn in arns:
+        resource_id = arn.rsplit('/', 1)[-1]
+        if resource_id.startswith(('vol-', 'snap-')):
+            ids.append(resource_id)
+    return ids
+
+
+def parse_event(body):
+    ''' The volume and snapshot ids an event is about. body is one of:
+
+    - a CloudWatch Events / EventBridge event for a CloudTrail API call
+      (CreateVolume, AttachVolume, CreateSnapshot or CopySnapshot)
+    - an EBS volume or snapshot notification, naming its resources by ARN
+    - any JSON object with a list of ids or ARNs as "resources"
+    - any of the above wrapped in an SNS notification
+    - plain resource ids, separated by whitespace or commas
+
+    or any of the JSON forms already decoded. Failed calls, deletions and
+    anything else give no ids '''
+
+    if isinstance(body, dict):
+        event = body
+    else:
+        try:
+            event = json.loads(body)
+        except ValueError:
+            return [resource_id for resource_id in read_ids([body]) if resource_id.startswith(('vol-', 'snap-'))]
+    if not isinstance(event, dict):
+        return []
+
+    # Delivered through SNS
+    if 'Message' in event and 'TopicArn' in event:
+        return parse_event(event['Message'])
+
+    detail = event.get('detail') or {}
+    if 'eventName' in detail:
+        name = CLOUDTRAIL_EVENTS.get(detail['eventName'])
+        if name is None or detail.get('errorCode'):
+            return []
+        for section in ('responseElements', 'requestParameters'):
+            resource_id = (detail.get(section) or {}).get(name)
+            if resource_id:
+                return [resource_id]
+        return []
+
+    if detail.get('result') == 'failed' or detail.get('event', '').startswith('delete'):
+        return []
+    return _ids_from_arns(event.get('resources') or [])
+
+
+class SqsSource(object):
+    ''' Receives events from an SQS queue, given by name or URL. Messages are
+    only deleted once handled, so any not handled are delivered again after
+    the queue's visibility timeout '''
+
+    def __init__(self, queue, region, profile=None):
+        from boto import sqs
+        from boto.sqs.message import RawMessage
+
+        try:
+            conn = sqs.connect_to_region(region, profile_name=profile)
+        except boto.provider.ProfileNotFoundError:
+            conn = sqs.connect_to_region(region)
+        if conn is None:
+            raise GraffitiMonkeyException('Unknown region %s' % region)
+
+        if queue.startswith(('https://', 'http://')):
+            owner, name = queue.rstrip('/').split('/')[-2:]
+            self._queue = conn.get_queue(name, owner)
+        else:
+            self._queue = conn.get_queue(queue)
+        if self._queue is None:
+            raise GraffitiMonkeyException('Queue %s does not exist' % queue)
+        self._queue.set_message_class(RawMessage)
+        log.info('Receiving events from queue %s', self._queue.name)
+
+    def receive(self):
+        ''' A list of (message, body) pairs, waiting a while for any '''
+
+        return [(message, message.get_body())
+                for message in self._queue.get_messages(SQS_BATCH, wait_time_seconds=SQS_WAIT)]
+
+    def delete(self, messages):
+        for chunk in (messages[n:n+SQS_BATCH] for n in xrange(0, len(messages), SQS_BATCH)):
+            self._queue.delete_message_batch(chunk)
+
+
+class FileSource(object):
+    ''' Reads events from a file, one per line, or from standard input
+    given -. When followed, lines added to the file later are read as well,
+    like tail -f; otherwise the source is used up at the end of the file '''
+
+    def __init__(self, path, follow=False, batch=SQS_BATCH):
+        if path == '-':
+            # Read one line at a time, so an event is not held back waiting
+            # for the rest of a batch
+            self._fh = sys.stdin
+            self._batch = 1
+        else:
+            try:
+                self._fh = open(path)
+            except IOError as e:
+                raise GraffitiMonkeyException('Cannot read %s: %s' % (path, e.strerror))
+            self._batch = batch
+        self._follow = follow
+        self._partial = ''
+
+    def receive(self):
+        ''' A list of (None, body) pairs, or None once the file is used up '''
+
+        bodies = []
+        while len(bodies) < self._batch:
+            line = self._fh.readline()
+            if not line:
+                break
+            # A followed file may end in a line that is still being written
+            self._partial += line
+            if line.endswith('\n'):
+                if self._partial.strip():
+                    bodies.append((None, self._partial.strip()))
+                self._partial = ''
+        if bodies:
+            return bodies
+
+        if not self._follow:
+            if self._partial.strip():
+                bodies.append((None, self._partial.strip()))
+                self._partial = ''
+                return bodies
+            return None
+        time.sleep(FOLLOW_POLL)
+        return []
+
+    def delete(self, messages):
+        pass
+
+
+class EventMonkey(GraffitiMonkey):
+    ''' A monkey that stays connected between events and tags only the
+    volumes and snapshots they name. Instance tags are kept for
+    instance_cache_ttl seconds, as events usually come in bursts about the
+    same few instances '''
+
+    instance_cache_ttl = DEFAULT_INSTANCE_CACHE_TTL
+
+    def __init__(self, *args, **kwargs):
+        GraffitiMonkey.__init__(self, *args, **kwargs)
+
+        # (time fetched, tags) of each instance looked up, by id
+        self._instance_tag_cache = {}
+
+    def _cached_instance_tags(self, instance_ids):
+        ''' The tags of instance_ids, by id, fetching those not cached or
+        cached too long ago '''
+
+        now = time.time()
+        stale = [instance_id for instance_id in instance_ids
+                 if now - self._instance_tag_cache.get(instance_id, (0, None))[0] >= self.instance_cache_ttl]
+        for chunk in self._id_chunks(stale, set()):
+            fetched = self._resource_tags('instance', chunk, self._instance_tag_keys)
+            for instance_id in chunk:
+                # Instances without any tags have no entry
+                self._instance_tag_cache[instance_id] = (now, fetched.get(instance_id, {}))
+        if len(stale) < len(instance_ids):
+            self._metrics.count('instance_tag_lookups', len(instance_ids) - len(stale), source='cache')
+        if stale:
+            self._metrics.count('instance_tag_lookups', len(stale), source='api')
+
+        return dict((instance_id, self._instance_tag_cache[instance_id][1]) for instance_id in instance_ids)
+
+    def tag_events(self, resource_ids):
+        ''' Tags the volumes and snapshots among resource_ids, the volumes
+        first so their snapshots get their new tags. Returns the ids that
+        were not found, which may not be visible to the API just yet '''
+
+        volume_ids = [i for i in resource_ids if i.startswith('vol-')]
+        snapshot_ids = [i for i in resource_ids if i.startswith('snap-')]
+        if self._novolumes:
+            volume_ids = []
+        if self._nosnapshots:
+            snapshot_ids = []
+
+        requested = set()
+        volumes = {}
+        for chunk in self._id_chunks(volume_ids, requested):
+            for page in self._volume_records({'volume-id': chunk}):
+                for volume in page:
+                    volumes[volume.id] = volume
+
+        attached = [volume for volume in volumes.itervalues() if volume.status == 'in-use']
+        if len(attached) < len(volumes):
+            self._metrics.count('resources', len(volumes) - len(attached), kind='volume', outcome='skipped')
+        if attached:
+            instance_tags = self._cached_instance_tags(set(volume.instance_id for volume in attached))
+            for volume in attached:
+                self._tag_resource('volume', volume, self.tag_volume, instance_tags)
+
+        snapshots = []
+        for chunk in self._id_chunks(snapshot_ids, requested):
+            for page in self._snapshot_records({'snapshot-id': chunk}):
+                snapshots += page
+
+        # Volumes not named by the events are fetched afresh, as their tags
+        # may have changed since the last batch
+        missing_volume_ids = set()
+        self._fetch_extra_volumes(snapshots, volumes, missing_volume_ids)
+        for snapshot in snapshots:
+            if snapshot.volume_id in missing_volume_ids:
+                log.debug('Skipping %s as its volume %s no longer exists', snapshot.id, snapshot.volume_id)
+                self._metrics.count('resources', kind='snapshot', outcome='skipped')
+                continue
+            self._tag_resource('snapshot', snapshot, self.tag_snapshot, volumes)
+
+        self._flush_tags()
+
+        not_found = requested - set(volumes) - set(snapshot.id for snapshot in snapshots)
+        log.info('Processed %d volume(s) and %d snapshot(s) from events', len(attached), len(snapshots))
+        for resource_id in sorted(not_found):
+            log.info('%s was not found', resource_id)
+        return not_found
+
+
+class Daemon(object):
+    ''' Feeds the events from a source to an EventMonkey until the source
+    is used up or the process is told to stop. after_batch is called after
+    each batch of events '''
+
+    def __init__(self, monkey, source, after_batch=None):
+        self._monkey = monkey
+        self._source = source
+        self._after_batch = after_batch
+        self._running = False
+
+    def stop(self, signum=None, frame=None):
+        ''' Stops once the batch being handled is done '''
+
+        if self._running:
+            log.info('Stopping after the current batch')
+        self._running = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self._running = True
+        while self._running:
+            messages = self._source.receive()
+            if messages is None:
+                break
+            if messages:
+                self.handle(messages)
+                if self._after_batch:
+                    self._after_batch()
+
+    def handle(self, messages):
+        ''' Tags what a batch of messages is about, deleting the messages
+        that are done with. Messages are kept for another try when the batch
+        fails, or when none of their resources could be found yet '''
+
+        parsed = []
+        resource_ids = []
+        for message, body in messages:
+            ids = parse_event(body)
+            if not ids:
+                log.debug('Ignoring event %s', body)
+            parsed.append((message, ids))
+            resource_ids += ids
+
+        try:
+            not_found = self._monkey.tag_events(resource_ids) if resource_ids else set()
+        except (GraffitiMonkeyException, boto.exception.BotoServerError) as e:
+            log.error('Could not process %d event(s), they will be retried: %s', len(messages), e)
+            return
+
+        self._source.delete([message for message, message_ids in parsed
+                             if message is not None and not (message_ids and not_found.issuperset(message_ids))])
+
+
+class GraffitiMonkeyDaemonCli(GraffitiMonkeyCli):
+    monkey_class = EventMonkey
+
+    def __init__(self, argv=None):
+        GraffitiMonkeyCli.__init__(self, argv)
+        self.instance_cache_ttl = DEFAULT_INSTANCE_CACHE_TTL
+
+    def create_parser(self):
+        parser = GraffitiMonkeyCli.create_parser(self)
+        parser.description = ('Tags EBS volumes and snapshots as EC2 lifecycle events about them arrive, '
+                              'propagating tags from EC2 instances to volumes and from volumes to snapshots.')
+        group = parser.add_argument_group('daemon')
+        group.add_argument('--queue', metavar='NAME',
+                           help='name or URL of the SQS queue receiving the events, in the region given')
+        group.add_argument('--events-file', metavar='FILE',
+                           help='read JSON events from FILE, one per line, - for stdin, instead of a queue')
+        group.add_argument('--follow', action='store_true',
+                           help='with --events-file, keep reading events appended to the file')
+        group.add_argument('--instance-cache-ttl', type=float, default=DEFAULT_INSTANCE_CACHE_TTL, metavar='SECONDS',
+                           help='seconds the tags of an instance are reused before being looked up again (default %d)'
+                                % DEFAULT_INSTANCE_CACHE_TTL)
+        return parser
+
+    def set_instance_cache_ttl(self):
+        self.instance_cache_ttl = self.args.instance_cache_ttl
+
+    def create_monkey(self, region, profile, rate_limiter):
+        monkey = GraffitiMonkeyCli.create_monkey(self, region, profile, rate_limiter)
+        monkey.instance_cache_ttl = self.instance_cache_ttl
+        return monkey
+
+    def create_source(self):
+        if self.args.queue:
+            return SqsSource(self.args.queue, self.region, self.profile)
+        return FileSource(self.args.events_file, self.args.follow)
+
+    def write_metrics_now(self):
+        if self.args.metrics_json or self.args.metrics_prom:
+            self.write_metrics()
+
+    def run(self):
+        self.configure()
+        self.set_instance_cache_ttl()
+
+        if bool(self.args.queue) == bool(self.args.events_file):
+            self._fail('Give either --queue or --events-file', 2)
+        if len(self.targets()) > 1:
+            self._fail('The daemon works in one region with one profile; run one daemon for each', 2)
+
+        try:
+            self.initialize_monkey()
+            Daemon(self.monkey, self.create_source(), self.write_metrics_now).run()
+        except GraffitiMonkeyException as e:
+            self._fail(e.message)
+
+        self.exit_succesfully()
+
+
+def run():
+    cli = GraffitiMonkeyDaemonCli()
+    cli.run()
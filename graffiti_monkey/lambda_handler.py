@@ -0,0 +1,112 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+''' AWS Lambda entry point, graffiti_monkey.lambda_handler.handler.
+
+The options are given as a command line in the GRAFFITI_MONKEY_ARGS
+environment variable, e.g. "--config conf/example_config.yml", and the region
+is the one the function runs in. They are read, and the monkey connected, on
+the first invocation only; later invocations in the same container reuse the
+monkey, its connections and its cached instance tags.
+
+An invocation with a scheduled event (or no event) propagates tags through
+the whole region, stopping cleanly before the function times out. Any other
+event, e.g. CloudTrail calls from CloudWatch Events or messages from SQS or
+SNS, only tags the volumes and snapshots it names, as the daemon does. '''
+
+import logging
+import os
+import shlex
+
+__all__ = ('handler', )
+log = logging.getLogger(__name__)
+
+# Where the options are taken from
+ARGS_VARIABLE = 'GRAFFITI_MONKEY_ARGS'
+
+# The monkey and the options it was made with, kept while the container is
+_cli = None
+_monkey = None
+
+
+def _warm_monkey():
+    ''' The monkey of this container, made on first use. boto (and yaml, if
+    a configuration file is used) are only imported then '''
+
+    global _cli, _monkey
+    if _monkey is None:
+        from graffiti_monkey.daemon import GraffitiMonkeyDaemonCli
+        from graffiti_monkey.exceptions import GraffitiMonkeyException
+
+        argv = shlex.split(os.environ.get(ARGS_VARIABLE, ''))
+        if not [arg for arg in argv if arg == '--region' or arg.startswith('--region=')]:
+            # Looking the region up in the instance metadata would only time out
+            region = os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION')
+            if not region:
+                raise GraffitiMonkeyException('No region: AWS_REGION is not set and %s has no --region' % ARGS_VARIABLE)
+            argv = ['--region', region] + argv
+
+        cli = GraffitiMonkeyDaemonCli(argv)
+        cli.configure()
+        cli.set_instance_cache_ttl()
+        if len(cli.targets()) > 1:
+            raise GraffitiMonkeyException('One function works in one region with one profile')
+
+        # Lambda has set up logging already, so only the level is set
+        logging.getLogger().setLevel(logging.DEBUG if (cli.args.verbose or 0) >= 2 else logging.INFO)
+
+        cli.initialize_monkey()
+        _cli, _monkey = cli, cli.monkey
+    return _monkey
+
+
+def resource_ids(event):
+    ''' The volume and snapshot ids event names, or None if it asks for a
+    sweep of the whole region '''
+
+    from graffiti_monkey.daemon import parse_event
+
+    if not event or event.get('detail-type') == 'Scheduled Event':
+        return None
+
+    # Batches from SQS or SNS
+    if 'Records' in event:
+        ids = []
+        for record in event['Records']:
+            if 'Sns' in record:
+                ids += parse_event(record['Sns']['Message'])
+            elif 'body' in record:
+                ids += parse_event(record['body'])
+        return ids
+    return parse_event(event)
+
+
+def handler(event, context=None):
+    ''' Tags what event asks for, within the time left to the function '''
+
+    monkey = _warm_monkey()
+
+    ids = resource_ids(event)
+    if ids is None:
+        deadline = None
+        if context is not None:
+            deadline = context.get_remaining_time_in_millis() / 1000.0
+        monkey.propagate_tags(deadline)
+        result = {'sweep': True, 'work_left': monkey.work_left}
+    else:
+        not_found = monkey.tag_events(ids) if ids else set()
+        result = {'sweep': False, 'resources': len(set(ids)), 'not_found': sorted(not_found)}
+
+    _cli.write_metrics_now()
+    return result
@@ -0,0 +1,153 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+__all__ = ('Metrics', )
+
+# Upper bounds, in seconds, of the API latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prefix of every metric name in the Prometheus output
+PROMETHEUS_PREFIX = 'graffiti_monkey_'
+
+# Help text of each metric in the Prometheus output
+DESCRIPTIONS = {
+    'api_calls': 'EC2 API calls made, including retries',
+    'api_errors': 'EC2 API calls which failed',
+    'throttles': 'EC2 API calls rejected for exceeding the request rate',
+    'retries': 'EC2 API calls retried after a throttle or transient failure',
+    'resources': 'Resources looked at, by what was done with them',
+    'work_left': 'Work not done because the run reached its deadline',
+    'audited': 'Resources audited, by whether their tags differ from those they should have',
+    'instance_tag_lookups': 'Instance tags looked up, by whether they were cached',
+    'api_latency_seconds': 'Time taken by EC2 API calls',
+    'phase_seconds': 'Time spent in each phase of the run',
+}
+
+
+def _labels(labels):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in labels)
+
+
+def _write(path, text):
+    ''' Writes text to path through a temporary file, so that a collector
+    reading the file never sees it half written '''
+
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as fh:
+        fh.write(text)
+    os.rename(temporary, path)
+
+
+class Metrics(object):
+    ''' Counters, API latency histograms and phase timings of a run. Updated
+    from any thread, and may be shared by monkeys running side by side '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._latencies = {}
+        self._phases = {}
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.iteritems())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, operation, seconds):
+        ''' Records the latency of one call of operation '''
+
+        with self._lock:
+            histogram = self._latencies.get(operation)
+            if histogram is None:
+                histogram = self._latencies[operation] = {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0}
+            for n, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][n] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        ''' Adds the time spent in the with block to the phase name '''
+
+        started = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - started
+            with self._lock:
+                self._phases[name] = self._phases.get(name, 0.0) + elapsed
+
+    def summary(self):
+        ''' Everything recorded, as a JSON serializable dict '''
+
+        with self._lock:
+            counters = {}
+            for (name, labels), value in sorted(self._counters.iteritems()):
+                counters.setdefault(name, []).append(dict(labels, value=value))
+            latencies = {}
+            for operation, histogram in sorted(self._latencies.iteritems()):
+                latencies[operation] = {
+                    'count': histogram['count'],
+                    'sum': histogram['sum'],
+                    'buckets': dict(('%g' % bound, count) for bound, count in zip(LATENCY_BUCKETS, histogram['buckets'])),
+                }
+            return {'counters': counters, 'api_latency_seconds': latencies, 'phase_seconds': dict(self._phases)}
+
+    def prometheus(self):
+        ''' Everything recorded, in the Prometheus text exposition format '''
+
+        lines = []
+
+        def header(name, kind, suffix=''):
+            lines.append('# HELP %s%s%s %s' % (PROMETHEUS_PREFIX, name, suffix, DESCRIPTIONS.get(name, name)))
+            lines.append('# TYPE %s%s%s %s' % (PROMETHEUS_PREFIX, name, suffix, kind))
+
+        with self._lock:
+            last = None
+            for (name, labels), value in sorted(self._counters.iteritems()):
+                if name != last:
+                    header(name, 'counter', '_total')
+                    last = name
+                lines.append('%s%s_total{%s} %s' % (PROMETHEUS_PREFIX, name, _labels(labels), value))
+
+            if self._latencies:
+                header('api_latency_seconds', 'histogram')
+            for operation, histogram in sorted(self._latencies.iteritems()):
+                name = PROMETHEUS_PREFIX + 'api_latency_seconds'
+                for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+                    lines.append('%s_bucket{operation="%s",le="%g"} %d' % (name, operation, bound, count))
+                lines.append('%s_bucket{operation="%s",le="+Inf"} %d' % (name, operation, histogram['count']))
+                lines.append('%s_sum{operation="%s"} %f' % (name, operation, histogram['sum']))
+                lines.append('%s_count{operation="%s"} %d' % (name, operation, histogram['count']))
+
+            if self._phases:
+                header('phase_seconds', 'gauge')
+            for phase, seconds in sorted(self._phases.iteritems()):
+                lines.append('%sphase_seconds{phase="%s"} %f' % (PROMETHEUS_PREFIX, phase, seconds))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path):
+        _write(path, json.dumps(self.summary(), indent=2, sort_keys=True) + '\n')
+
+    def write_prometheus(self, path):
+        _write(path, self.prometheus())
@@ -0,0 +1,92 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+''' Plan files: the tag changes a run would make, written instead of being
+made so they can be reviewed and then applied without listing the account
+again. Each line is a JSON object giving the tags to add to a group of
+resources, as one CreateTags call would:
+
+    {"profile":"default","region":"us-east-1","resources":["vol-1","vol-2"],"tags":{"Name":"web"}}
+'''
+
+import json
+import logging
+import threading
+
+from graffiti_monkey.exceptions import GraffitiMonkeyException
+
+__all__ = ('PlanWriter', 'read', 'targets')
+log = logging.getLogger(__name__)
+
+
+class PlanWriter(object):
+    ''' Writes a plan file. Shared by the monkeys of every account and
+    region being processed '''
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self._fh = open(path, 'w')
+        except IOError as e:
+            raise GraffitiMonkeyException('Cannot write the plan to %s: %s' % (path, e.strerror))
+        self._lock = threading.Lock()
+        self.changes = 0
+        self.resources = 0
+
+    def writer(self, profile, region):
+        ''' A callable taking (resource_ids, tags), as TagWriter calls
+        CreateTags, which adds them to the plan for profile and region '''
+
+        def write(resource_ids, tags):
+            line = json.dumps({'profile': profile, 'region': region, 'resources': resource_ids, 'tags': tags},
+                              sort_keys=True, separators=(',', ':'))
+            with self._lock:
+                self._fh.write(line + '\n')
+                self.changes += 1
+                self.resources += len(resource_ids)
+        return write
+
+    def close(self):
+        with self._lock:
+            self._fh.close()
+        log.info('Wrote a plan of %d change(s) to %d resource(s) to %s', self.changes, self.resources, self.path)
+
+
+def read(path):
+    ''' Yields (profile, region, tags, resource_ids) for each line of a plan '''
+
+    try:
+        fh = open(path)
+    except IOError as e:
+        raise GraffitiMonkeyException('Cannot read the plan %s: %s' % (path, e.strerror))
+    with fh:
+        for number, line in enumerate(fh, 1):
+            if not line.strip():
+                continue
+            try:
+                change = json.loads(line)
+                yield change['profile'], change['region'], change['tags'], change['resources']
+            except (ValueError, KeyError, TypeError):
+                raise GraffitiMonkeyException('Line %d of the plan %s is not a tag change' % (number, path))
+
+
+def targets(path):
+    ''' Every (profile, region) pair a plan changes, in the order they
+    first appear '''
+
+    found = []
+    for profile, region, _, _ in read(path):
+        if (profile, region) not in found:
+            found.append((profile, region))
+    return found
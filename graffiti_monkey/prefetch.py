@@ -0,0 +1,103 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import Queue
+import sys
+import threading
+
+__all__ = ('Prefetcher', )
+
+
+class Prefetcher(object):
+    ''' Runs a page generator on a background thread so the next pages are
+    being fetched while the caller works on the current one. At most depth
+    pages wait to be picked up; a depth of 0 lets the generator run freely.
+    on_exit is called on the background thread once the generator is done,
+    before the end of the pages is signalled '''
+
+    def __init__(self, pages, depth=1, on_exit=None):
+        self._queue = Queue.Queue(depth)
+        self._stopped = threading.Event()
+        self._done = False
+        self._on_exit = on_exit
+
+        self._thread = threading.Thread(target=self._produce, args=(pages, ),
+                                        name=threading.current_thread().name + '-prefetch')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _produce(self, pages):
+        end = ('done', None)
+        try:
+            for page in pages:
+                if not self._put(('page', page)):
+                    end = None
+                    break
+        except Exception:
+            end = ('error', sys.exc_info())
+        if self._on_exit:
+            self._on_exit()
+        if end:
+            self._put(end)
+
+    def _take(self, block):
+        ''' Returns the next page, or None once there are no more or, when
+        not blocking, none has arrived yet '''
+
+        if self._done:
+            return None
+        try:
+            kind, value = self._queue.get(block)
+        except Queue.Empty:
+            return None
+        if kind == 'page':
+            return value
+        self._done = True
+        if kind == 'error':
+            raise value[0], value[1], value[2]
+        return None
+
+    def __iter__(self):
+        try:
+            while True:
+                page = self._take(True)
+                if page is None:
+                    return
+                yield page
+        finally:
+            self.close()
+
+    def available(self):
+        ''' Yields the pages that have already been fetched, without waiting
+        for more '''
+
+        while True:
+            page = self._take(False)
+            if page is None:
+                return
+            yield page
+
+    def close(self):
+        ''' Stops the background thread once it next has a page to hand over '''
+
+        self._stopped.set()
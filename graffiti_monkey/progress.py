@@ -0,0 +1,82 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+
+__all__ = ('Progress', )
+log = logging.getLogger(__name__)
+
+# Seconds between progress lines
+DEFAULT_INTERVAL = 30.0
+
+
+def duration(seconds):
+    ''' seconds as e.g. 1h02m, 3m05s or 12s '''
+
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return '%dh%02dm' % (seconds / 3600, seconds % 3600 / 60)
+    if seconds >= 60:
+        return '%dm%02ds' % (seconds / 60, seconds % 60)
+    return '%ds' % seconds
+
+
+class Progress(object):
+    ''' Counts the resources a phase has processed and logs one line every
+    interval seconds, or every `every` resources, with the rate and, once the
+    total is known, the time left. Safe to update from any thread '''
+
+    def __init__(self, name, interval=DEFAULT_INTERVAL, every=0, total=None):
+        self._name = name
+        self._interval = interval
+        self._every = every
+        self._total = total
+
+        self._lock = threading.Lock()
+        self._started = self._reported_at = time.time()
+        self._done = 0
+        self._reported = 0
+
+    def set_total(self, total):
+        with self._lock:
+            self._total = total
+
+    def add(self, count=1):
+        with self._lock:
+            self._done += count
+            now = time.time()
+            if (self._interval and now - self._reported_at >= self._interval) or \
+                    (self._every and self._done - self._reported >= self._every):
+                self._report(now)
+
+    def finish(self):
+        ''' Logs the final count, if there was anything to count '''
+
+        with self._lock:
+            if self._done:
+                self._report(time.time(), 'Processed')
+
+    def _report(self, now, verb='Processing'):
+        elapsed = now - self._started
+        rate = self._done / elapsed if elapsed > 0 else 0.0
+        if self._total and verb == 'Processing':
+            left = max(self._total - self._done, 0)
+            log.info('%s %s: %d of %d (%d%%), %.1f/s, about %s left', verb, self._name, self._done, self._total,
+                     100 * self._done / max(self._total, 1), rate, duration(left / rate) if rate else '?')
+        else:
+            log.info('%s %s: %d in %s, %.1f/s', verb, self._name, self._done, duration(elapsed), rate)
+        self._reported_at = now
+        self._reported = self._done
@@ -0,0 +1,118 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__all__ = ('Record', 'VolumeRecord', 'SnapshotRecord', 'ImageRecord', 'InterfaceRecord', 'RecordPage')
+
+
+class Record(object):
+    ''' The few attributes of an EC2 resource Graffiti Monkey needs. Boto
+    objects keep the connection, the parser state and every attribute of the
+    response; a record keeps only what is read, without a __dict__ '''
+
+    __slots__ = ('id', 'tags')
+
+    # What the resource is called in logs and metrics
+    kind = 'resource'
+
+    def __init__(self, id, tags=None):
+        self.id = id
+        self.tags = dict(tags) if tags else {}
+
+    def __repr__(self):
+        return '%s:%s' % (self.__class__.__name__, self.id)
+
+
+class VolumeRecord(Record):
+    __slots__ = ('size', 'status', 'instance_id', 'device', 'create_time')
+    kind = 'volume'
+
+    def __init__(self, id, tags=None, size=0, status=None, instance_id=None, device=None, create_time=None):
+        Record.__init__(self, id, tags)
+        self.size = size
+        self.status = status
+        self.instance_id = instance_id
+        self.device = device
+        self.create_time = create_time
+
+    @classmethod
+    def from_volume(cls, volume):
+        ''' Makes a record of a boto Volume '''
+
+        attach_data = volume.attach_data
+        return cls(volume.id, volume.tags, volume.size, volume.status,
+                   attach_data.instance_id if attach_data else None,
+                   attach_data.device if attach_data else None,
+                   volume.create_time)
+
+
+class SnapshotRecord(Record):
+    __slots__ = ('volume_id', 'start_time')
+    kind = 'snapshot'
+
+    def __init__(self, id, tags=None, volume_id=None, start_time=None):
+        Record.__init__(self, id, tags)
+        self.volume_id = volume_id
+        self.start_time = start_time
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        ''' Makes a record of a boto Snapshot '''
+
+        return cls(snapshot.id, snapshot.tags, snapshot.volume_id, snapshot.start_time)
+
+
+class ImageRecord(Record):
+    __slots__ = ('snapshot_id', )
+    kind = 'image'
+
+    def __init__(self, id, tags=None, snapshot_id=None):
+        Record.__init__(self, id, tags)
+        self.snapshot_id = snapshot_id
+
+    @classmethod
+    def from_image(cls, image):
+        ''' Makes a record of a boto Image. snapshot_id is the snapshot of
+        its root device or, failing that, of its first EBS device '''
+
+        mapping = image.block_device_mapping or {}
+        root = mapping.get(image.root_device_name)
+        snapshot_id = root.snapshot_id if root is not None else None
+        if snapshot_id is None:
+            snapshot_ids = [mapping[device].snapshot_id for device in sorted(mapping) if mapping[device].snapshot_id]
+            snapshot_id = snapshot_ids[0] if snapshot_ids else None
+        return cls(image.id, image.tags, snapshot_id)
+
+
+class InterfaceRecord(Record):
+    __slots__ = ('instance_id', )
+    kind = 'network interface'
+
+    def __init__(self, id, tags=None, instance_id=None):
+        Record.__init__(self, id, tags)
+        self.instance_id = instance_id
+
+    @classmethod
+    def from_interface(cls, interface):
+        ''' Makes a record of a boto NetworkInterface '''
+
+        attachment = interface.attachment
+        return cls(interface.id, interface.tags, attachment.instance_id if attachment else None)
+
+
+class RecordPage(list):
+    ''' One page of records, with the token that fetches the page after it '''
+
+    def __init__(self, records, next_token=None):
+        list.__init__(self, records)
+        self.next_token = next_token
@@ -0,0 +1,260 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+''' The declarative tagging rules of conf/graffiti_monkey.yml, compiled once
+into a plan per resource type. For each resource type:
+
+- collect names values read from the resource itself
+- inspect looks up a related resource by one of the collected values and
+  collects values from it
+- tag maps tag keys to collected values, or to fixed {value: ...}
+
+e.g.
+
+    volume:
+      collect:
+        instance_id: attach_data.instance_id
+      inspect:
+        instance:
+          type: instance
+          id: instance_id
+          collect:
+            name: tags.Name
+      tag:
+        Name: name
+        instance_id: instance_id
+        role: {value: ebs}
+'''
+
+import operator
+
+from graffiti_monkey.exceptions import GraffitiMonkeyException
+from graffiti_monkey.records import Record
+
+
+__all__ = ('Rules', 'Plan', 'load')
+
+# The attributes each kind of resource has, by the names used in rules.
+# Volumes are described the way boto describes them
+ATTRIBUTES = {
+    'volume': {
+        'id': 'id',
+        'size': 'size',
+        'status': 'status',
+        'create_time': 'create_time',
+        'attach_data.instance_id': 'instance_id',
+        'attach_data.device': 'device',
+    },
+    'snapshot': {
+        'id': 'id',
+        'volume_id': 'volume_id',
+        'start_time': 'start_time',
+    },
+    # Only the tags of instances are fetched
+    'instance': {
+        'id': 'id',
+    },
+}
+
+# The resource types whose rules can be compiled, and the types of the
+# resources their rules may inspect, which are already in memory when they
+# are tagged
+INSPECTABLE = {
+    'volume': ('instance', ),
+    'snapshot': ('volume', ),
+}
+
+
+def _accessor(resource_type, path):
+    ''' A function reading path from a resource of resource_type, and the
+    tag key it reads or None '''
+
+    if path.startswith('tags.') and len(path) > len('tags.'):
+        key = path[len('tags.'):]
+        return (lambda resource: resource.tags.get(key)), key
+    attribute = ATTRIBUTES[resource_type].get(path)
+    if attribute is None:
+        raise GraffitiMonkeyException('Cannot collect %s from a %s; use tags.KEY or one of %s'
+                                      % (path, resource_type, ', '.join(sorted(ATTRIBUTES[resource_type]))))
+    return operator.attrgetter(attribute), None
+
+
+def _section(rules, name, where):
+    ''' The mapping rules[name], which may be left empty '''
+
+    section = rules.get(name) or {}
+    if not isinstance(section, dict):
+        raise GraffitiMonkeyException('%s.%s must be a mapping' % (where, name))
+    return section
+
+
+class Inspect(object):
+    ''' The values collected from the resource of inspected_type whose id is
+    the value named id_name. Each resource is only looked at once for as
+    long as the same resources (e.g. the instance tags of one run) are
+    given '''
+
+    def __init__(self, inspected_type, id_name, collect):
+        self.inspected_type = inspected_type
+        self.id_name = id_name
+        self._collect = collect
+        self._resources = None
+        self._memo = {}
+
+    def collect(self, resource_id, resources):
+        if resources is not self._resources:
+            # Holding on to resources keeps its id from being reused
+            self._resources = resources
+            self._memo = {}
+
+        values = self._memo.get(resource_id)
+        if values is None:
+            resource = resources.get(resource_id) if resource_id is not None else None
+            if resource is not None and not isinstance(resource, Record):
+                # Instances are only known by their tags
+                resource = Record(resource_id, resource)
+            elif resource is None and resource_id is not None and self.inspected_type == 'instance':
+                # Instances without any tags have no entry
+                resource = Record(resource_id)
+            if resource is None:
+                values = {}
+            else:
+                values = dict((name, get(resource)) for name, get in self._collect)
+            self._memo[resource_id] = values
+        return values
+
+
+class Plan(object):
+    ''' The compiled rules of one resource type '''
+
+    def __init__(self, resource_type, collect, inspects, propagated, fixed, inspected_keys):
+        self.resource_type = resource_type
+        self._collect = collect
+        self._inspects = inspects
+        self._propagated = propagated
+        self._fixed = fixed
+        self._inspected_keys = inspected_keys
+
+    @classmethod
+    def compile(cls, resource_type, rules):
+        where = resource_type
+        names = set()
+
+        def define(name):
+            if name in names:
+                raise GraffitiMonkeyException('%s collects %s more than once' % (where, name))
+            names.add(name)
+
+        collect = []
+        for name, path in sorted(_section(rules, 'collect', where).iteritems()):
+            define(name)
+            collect.append((name, _accessor(resource_type, str(path))[0]))
+        collected = set(names)
+
+        inspects = []
+        inspected_keys = {}
+        for label, inspect in sorted(_section(rules, 'inspect', where).iteritems()):
+            if not isinstance(inspect, dict):
+                raise GraffitiMonkeyException('%s.inspect.%s must be a mapping' % (where, label))
+            inspected_type = inspect.get('type')
+            if inspected_type not in INSPECTABLE[resource_type]:
+                raise GraffitiMonkeyException('%s.inspect.%s: a %s can only inspect %s' % (
+                    where, label, resource_type, ', '.join(INSPECTABLE[resource_type])))
+            id_name = inspect.get('id')
+            if id_name not in collected:
+                raise GraffitiMonkeyException('%s.inspect.%s: id must name a value collected from the %s'
+                                              % (where, label, resource_type))
+            inspect_collect = []
+            keys = inspected_keys.setdefault(inspected_type, set())
+            for name, path in sorted(_section(inspect, 'collect', '%s.inspect.%s' % (where, label)).iteritems()):
+                define(name)
+                get, key = _accessor(inspected_type, str(path))
+                inspect_collect.append((name, get))
+                if key is not None:
+                    keys.add(key)
+            inspects.append(Inspect(inspected_type, id_name, inspect_collect))
+
+        propagated = []
+        fixed = {}
+        for key, value in sorted(_section(rules, 'tag', where).iteritems()):
+            if isinstance(value, dict) and 'value' in value:
+                fixed[str(key)] = str(value['value'])
+            elif not isinstance(value, basestring):
+                raise GraffitiMonkeyException('%s.tag.%s must name a collected value or be {value: ...}'
+                                              % (where, key))
+            elif value in names:
+                propagated.append((str(key), value))
+            else:
+                raise GraffitiMonkeyException('%s.tag.%s: %s is not collected; give fixed values as {value: ...}'
+                                              % (where, key, value))
+
+        return cls(resource_type, collect, inspects, propagated, fixed, inspected_keys)
+
+    def tag_keys(self, inspected_type):
+        ''' The tag keys read from the resources of inspected_type, so only
+        those need be fetched '''
+
+        return sorted(self._inspected_keys.get(inspected_type, ()))
+
+    def tags(self, resource, resources):
+        ''' The tags to set on resource. resources holds the resources
+        that may be inspected, by type and then by id '''
+
+        values = dict((name, get(resource)) for name, get in self._collect)
+        for inspect in self._inspects:
+            values.update(inspect.collect(values[inspect.id_name], resources[inspect.inspected_type]))
+
+        tags = dict(self._fixed)
+        for key, name in self._propagated:
+            # Nothing is propagated from a tag the source does not have
+            value = values.get(name)
+            if value is not None:
+                tags[key] = value
+        return tags
+
+
+class Rules(object):
+    ''' The plans of every resource type the rules cover '''
+
+    def __init__(self, rules):
+        if not isinstance(rules, dict):
+            raise GraffitiMonkeyException('The rules must be a mapping of resource types')
+        unknown = set(rules) - set(INSPECTABLE)
+        if unknown:
+            raise GraffitiMonkeyException('No rules can be given for %s' % ', '.join(sorted(unknown)))
+
+        # What the plans were compiled from, for the tag cache
+        self.source = repr(sorted(rules.iteritems()))
+
+        self._plans = {}
+        for resource_type, section in rules.iteritems():
+            # A resource type left out keeps the tags of the configuration
+            if section is not None:
+                self._plans[resource_type] = Plan.compile(resource_type, section)
+
+    def plan(self, resource_type):
+        ''' The plan for resource_type, or None to use the configuration '''
+
+        return self._plans.get(resource_type)
+
+
+def load(fh):
+    ''' Compiles the rules in a YAML file '''
+
+    import yaml
+    try:
+        rules = yaml.safe_load(fh)
+    except yaml.YAMLError as e:
+        raise GraffitiMonkeyException('Cannot read the rules: %s' % e)
+    return Rules(rules or {})
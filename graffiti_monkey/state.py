@@ -0,0 +1,104 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import json
+import logging
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from exceptions import GraffitiMonkeyException
+
+__all__ = ('StateFile', )
+log = logging.getLogger(__name__)
+
+DEFAULT_STATE_FILE = os.path.expanduser('~/.graffiti_monkey_state.json')
+
+
+class StateFile(object):
+    ''' A JSON file which keeps what Graffiti Monkey needs to remember between
+    runs. It holds one section per account and region so that several
+    monkeys can share it, in one process or several: each update reads the
+    file again under a lock and only changes its own section '''
+
+    def __init__(self, path=DEFAULT_STATE_FILE):
+        self._path = path
+        self._lock = threading.Lock()
+        self._sections = None
+
+    @property
+    def path(self):
+        return self._path
+
+    def _load(self):
+        if self._sections is not None:
+            return
+        try:
+            with open(self._path) as fh:
+                self._sections = json.load(fh)
+        except IOError:
+            log.debug('No state file at %s, starting afresh', self._path)
+            self._sections = {}
+        except ValueError:
+            raise GraffitiMonkeyException('State file %s is not valid JSON - fix or remove it' % self._path)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        ''' Holds an exclusive lock on a file beside the state file, so that
+        processes sharing it update it one at a time '''
+
+        if fcntl is None:
+            yield
+            return
+        with open(self._path + '.lock', 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def get(self, key):
+        ''' Returns a copy of the section stored under key '''
+
+        with self._lock:
+            self._load()
+            return dict(self._sections.get(key, {}))
+
+    def update(self, key, **values):
+        ''' Sets values in the section stored under key and writes the file.
+        Values set to None are removed from the section '''
+
+        with self._lock, self._file_lock():
+            # Another process may have written its sections since the file
+            # was read
+            self._sections = None
+            self._load()
+            section = self._sections.setdefault(key, {})
+            for name, value in values.iteritems():
+                if value is None:
+                    section.pop(name, None)
+                else:
+                    section[name] = value
+
+            # Write to a temporary file first so a run killed part way
+            # through never leaves a truncated state file behind
+            temporary = self._path + '.tmp'
+            with open(temporary, 'w') as fh:
+                json.dump(self._sections, fh, indent=2, sort_keys=True)
+            os.rename(temporary, self._path)
@@ -0,0 +1,153 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+
+import boto
+
+from throttle import is_retryable
+
+__all__ = ('TagWriter', )
+log = logging.getLogger(__name__)
+
+# CreateTags accepts up to 1000 resource ids per request
+DEFAULT_BATCH_SIZE = 500
+MAX_BATCH_SIZE = 1000
+
+# Resources queued at most before every pending batch is written, which
+# bounds what the writer holds however large the account is
+DEFAULT_MAX_PENDING = 20 * DEFAULT_BATCH_SIZE
+
+
+class TagWriter(object):
+    ''' Collects tag deltas and writes them using as few CreateTags calls as
+    possible, by grouping the resources that receive identical tags '''
+
+    def __init__(self, create_tags, batch_size=DEFAULT_BATCH_SIZE, on_failure=None, on_success=None,
+                 max_pending=DEFAULT_MAX_PENDING):
+        # Callable taking (resource_ids, tags) which performs the CreateTags call
+        self._create_tags = create_tags
+
+        # Callable taking the resource ids that could not be tagged
+        self._on_failure = on_failure
+
+        # Callable taking the (resource id, fingerprint) pairs of the
+        # resources tagged, once the call has succeeded
+        self._on_success = on_success
+
+        # Number of resources sent in a single CreateTags call
+        self._batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+
+        # Maps a frozen set of (key, value) pairs to the (resource id,
+        # fingerprint) pairs waiting to receive exactly those tags
+        self._pending = {}
+
+        # Number of resources in _pending, and how many there may be
+        self._queued = 0
+        self._max_pending = max(1, max_pending)
+
+        # Seconds a CreateTags call has been taking, averaged over the
+        # recent calls
+        self._call_seconds = 0.0
+
+        # Resources tagged, CreateTags calls made and resources that could
+        # not be tagged, since the counts were last taken
+        self._written = 0
+        self._calls = 0
+        self._failed = 0
+
+        # Worker threads share one writer
+        self._lock = threading.Lock()
+
+    def add(self, resource_id, tags, fingerprint=None):
+        ''' Queues tags to be set on the given resource id, writing the batch
+        once it is full, or every batch once max_pending resources are
+        queued. fingerprint is handed to on_success once the tags have been
+        written '''
+
+        key = frozenset(tags.iteritems())
+        with self._lock:
+            entries = self._pending.setdefault(key, [])
+            entries.append((resource_id, fingerprint))
+            self._queued += 1
+            if len(entries) >= self._batch_size:
+                del self._pending[key]
+                self._queued -= len(entries)
+                pending = {key: entries}
+            elif self._queued >= self._max_pending:
+                pending, self._pending, self._queued = self._pending, {}, 0
+            else:
+                return
+        for key, entries in pending.iteritems():
+            self._write(dict(key), entries)
+
+    def flush(self):
+        ''' Writes all pending batches '''
+
+        with self._lock:
+            pending, self._pending, self._queued = self._pending, {}, 0
+        for key, entries in pending.iteritems():
+            self._write(dict(key), entries)
+
+    def pending_seconds(self):
+        ''' About how long writing the pending batches would take, at the
+        rate of the calls made so far '''
+
+        with self._lock:
+            calls = len(self._pending)
+        return calls * self._call_seconds
+
+    def take_counts(self):
+        ''' Returns the number of resources tagged, of CreateTags calls made
+        and of resources that could not be tagged, since the last time the
+        counts were taken '''
+
+        with self._lock:
+            counts = self._written, self._calls, self._failed
+            self._written = self._calls = self._failed = 0
+        return counts
+
+    def _count(self, written=0, failed=0):
+        with self._lock:
+            self._written += written
+            self._failed += failed
+            self._calls += 1
+
+    def _write(self, tags, entries):
+        resource_ids = [resource_id for resource_id, _ in entries]
+        log.debug('Tagging %d resource(s) with [%s]: %s', len(resource_ids), tags, resource_ids)
+        started = time.time()
+        try:
+            self._create_tags(resource_ids, tags)
+        except boto.exception.BotoServerError, e:
+            if len(resource_ids) > 1 and not is_retryable(e):
+                self._count()
+                # One bad id (e.g. a snapshot deleted since it was listed)
+                # fails the whole request, so retry them one at a time
+                log.info("Encountered Error %s on batch of %d resources, tagging them individually", e.error_code, len(resource_ids))
+                for entry in entries:
+                    self._write(tags, [entry])
+            else:
+                log.error("Encountered Error %s tagging %d resource(s), continuing", e.error_code, len(resource_ids))
+                self._count(failed=len(resource_ids))
+                if self._on_failure:
+                    self._on_failure(resource_ids)
+        else:
+            seconds = time.time() - started
+            self._count(written=len(resource_ids))
+            self._call_seconds = seconds if not self._call_seconds else 0.8 * self._call_seconds + 0.2 * seconds
+            if self._on_success:
+                self._on_success(entries)
@@ -0,0 +1,106 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import threading
+import time
+
+__all__ = ('RateLimiter', 'is_throttle', 'is_retryable', 'backoff')
+
+# Calls per second allowed before any throttling has been seen
+DEFAULT_MAX_RATE = 50.0
+
+# Error codes EC2 uses when the account's request rate is exceeded
+THROTTLING_ERRORS = frozenset([
+    'RequestLimitExceeded',
+    'Throttling',
+    'ThrottlingException',
+    'RequestThrottled',
+])
+
+# Error codes for failures on the AWS side which are worth retrying
+TRANSIENT_ERRORS = frozenset([
+    'InternalError',
+    'InternalFailure',
+    'ServiceUnavailable',
+    'Unavailable',
+])
+
+
+def is_throttle(error):
+    ''' Whether the error means we are calling the API too quickly '''
+
+    return getattr(error, 'error_code', None) in THROTTLING_ERRORS
+
+
+def is_retryable(error):
+    ''' Whether the call that raised error may succeed if tried again '''
+
+    if is_throttle(error) or getattr(error, 'error_code', None) in TRANSIENT_ERRORS:
+        return True
+    return (getattr(error, 'status', None) or 0) >= 500
+
+
+def backoff(attempt, base=0.5, cap=20.0):
+    ''' Seconds to wait before the given retry, using exponential backoff with
+    full jitter so that concurrent callers do not retry in lockstep '''
+
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RateLimiter(object):
+    ''' Token bucket shared by every API call, whose refill rate adapts to
+    throttling: it is halved on each throttle and grows back additively by
+    about one call per second for every second without one '''
+
+    def __init__(self, max_rate=DEFAULT_MAX_RATE, min_rate=1.0, burst=None, decrease=0.5, increase=1.0):
+        self._max_rate = float(max_rate)
+        self._min_rate = min(float(min_rate), self._max_rate)
+        self._burst = float(burst or max_rate)
+        self._decrease = decrease
+        self._increase = increase
+
+        self._rate = self._max_rate
+        self._tokens = self._burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def _refill(self, now):
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def acquire(self):
+        ''' Blocks until a call may be made '''
+
+        while True:
+            with self._lock:
+                self._refill(time.time())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self._rate = min(self._max_rate, self._rate + self._increase / self._rate)
+
+    def on_throttle(self):
+        with self._lock:
+            self._rate = max(self._min_rate, self._rate * self._decrease)
+            self._tokens = min(self._tokens, 0)
@@ -33,6 +33,7 @@ with open('requirements.txt') as fh:
 entry_points = {
     'console_scripts': [
         'graffiti-monkey = graffiti_monkey.cli:run',
+        'graffiti-monkey-daemon = graffiti_monkey.daemon:run',
     ]
 }
 
@@ -0,0 +1,56 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from graffiti_monkey.audit import AuditReport
+from graffiti_monkey.records import VolumeRecord, SnapshotRecord
+
+
+class AuditReportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'audit.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_drifted_resources_are_listed(self):
+        report = AuditReport(self.path)
+        report.add('prod', 'us-east-1', VolumeRecord('vol-1', {'Name': 'old'}), {'Name': 'web'})
+        report.add('prod', 'us-east-1', VolumeRecord('vol-2', {'Name': 'web'}), {})
+        report.add('prod', 'us-east-1', SnapshotRecord('snap-1'), {'Name': 'web'})
+        report.close()
+
+        with open(self.path) as fh:
+            entries = json.load(fh)
+        self.assertEquals(entries, [
+            {'profile': 'prod', 'region': 'us-east-1', 'kind': 'volume', 'id': 'vol-1',
+             'expected': {'Name': 'web'}, 'current': {'Name': 'old'}},
+            {'profile': 'prod', 'region': 'us-east-1', 'kind': 'snapshot', 'id': 'snap-1',
+             'expected': {'Name': 'web'}, 'current': {'Name': None}},
+        ])
+        self.assertEquals(report.audited, {'volume': 2, 'snapshot': 1})
+        self.assertEquals(report.drifted_total(), 2)
+
+    def test_empty_audit_is_an_empty_list(self):
+        report = AuditReport(self.path)
+        report.close()
+        with open(self.path) as fh:
+            self.assertEquals(json.load(fh), [])
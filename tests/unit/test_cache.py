@@ -0,0 +1,75 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import mock
+
+from graffiti_monkey.cache import TagCache, fingerprint
+
+
+class FingerprintTests(unittest.TestCase):
+
+    def test_same_inputs_same_fingerprint(self):
+        self.assertEquals(fingerprint({'Name': 'a', 'Owner': 'b'}), fingerprint({'Owner': 'b', 'Name': 'a'}))
+
+    def test_different_inputs_different_fingerprint(self):
+        self.assertNotEquals(fingerprint({'Name': 'a'}), fingerprint({'Name': 'b'}))
+
+
+class TagCacheTests(unittest.TestCase):
+
+    def test_unchanged_after_put(self):
+        cache = TagCache(':memory:')
+        cache.put('vol-1', 'abc')
+        self.assertTrue(cache.unchanged('vol-1', 'abc'))
+        self.assertFalse(cache.unchanged('vol-1', 'def'))
+        self.assertFalse(cache.unchanged('vol-2', 'abc'))
+
+    def test_forget(self):
+        cache = TagCache(':memory:')
+        cache.put('vol-1', 'abc')
+        cache.forget(['vol-1'])
+        self.assertFalse(cache.unchanged('vol-1', 'abc'))
+
+    @mock.patch('graffiti_monkey.cache.time.time')
+    def test_expired_entries_are_not_trusted(self, now):
+        now.return_value = 1000
+        cache = TagCache(':memory:', ttl=10)
+        cache.put('vol-1', 'abc')
+        now.return_value = 1011
+        self.assertFalse(cache.unchanged('vol-1', 'abc'))
+
+    @mock.patch('graffiti_monkey.cache.time.time')
+    def test_oldest_entries_are_evicted_beyond_size(self, now):
+        now.return_value = 1000
+        cache = TagCache(':memory:', max_entries=2)
+        for n, resource_id in enumerate(['vol-1', 'vol-2', 'vol-3']):
+            now.return_value = 1000 + n
+            cache.put(resource_id, 'abc')
+        cache.evict()
+        self.assertFalse(cache.unchanged('vol-1', 'abc'))
+        self.assertTrue(cache.unchanged('vol-3', 'abc'))
+
+    def test_missing_volumes_are_remembered(self):
+        cache = TagCache(':memory:')
+        cache.put_missing(['vol-1', 'vol-2'])
+        self.assertEquals(cache.missing(['vol-1', 'vol-3']), set(['vol-1']))
+
+    @mock.patch('graffiti_monkey.cache.time.time')
+    def test_missing_volumes_expire(self, now):
+        now.return_value = 1000
+        cache = TagCache(':memory:', missing_ttl=10)
+        cache.put_missing(['vol-1'])
+        now.return_value = 1011
+        self.assertEquals(cache.missing(['vol-1']), set())
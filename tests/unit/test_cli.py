@@ -0,0 +1,105 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import StringIO
+import tempfile
+import unittest
+import mock
+
+from graffiti_monkey.cli import GraffitiMonkeyCli, read_ids
+
+
+class FanOutTests(unittest.TestCase):
+
+    @staticmethod
+    def cli_with_arguments(*arguments):
+        cli = GraffitiMonkeyCli()
+        cli.get_argv = mock.Mock(return_value=list(arguments))
+        cli.set_cli_args()
+        cli.set_region()
+        cli.set_profile()
+        return cli
+
+    def test_regions_can_be_repeated_or_comma_separated(self):
+        cli = self.cli_with_arguments('--region', 'us-east-1,eu-west-1', '--region', 'us-west-2', '--region', 'us-east-1')
+        self.assertEquals(cli.regions, ['us-east-1', 'eu-west-1', 'us-west-2'])
+        self.assertEquals(cli.region, 'us-east-1')
+
+    def test_all_regions_leaves_out_isolated_regions(self):
+        cli = self.cli_with_arguments('--region', 'all')
+        self.assertIn('us-east-1', cli.regions)
+        self.assertFalse([r for r in cli.regions if r.startswith(('us-gov-', 'cn-'))])
+
+    def test_every_profile_is_paired_with_every_region(self):
+        cli = self.cli_with_arguments('--region', 'us-east-1,eu-west-1', '--profile', 'prod,dev')
+        self.assertEquals(cli.targets(), [('prod', 'us-east-1'), ('prod', 'eu-west-1'),
+                                          ('dev', 'us-east-1'), ('dev', 'eu-west-1')])
+
+    def test_any_failed_target_fails_the_run(self):
+        cli = self.cli_with_arguments('--region', 'us-east-1,eu-west-1')
+        cli.set_parallel()
+        cli.propagate_target = mock.Mock(side_effect=[None, 'No AWS credentials found'])
+        self.assertRaises(SystemExit, cli.propagate_all_targets)
+        self.assertEquals(cli.propagate_target.call_count, 2)
+
+    def test_audit_is_closed_when_a_region_fails(self):
+        cli = self.cli_with_arguments('--region', 'us-east-1,eu-west-1', '--audit')
+        cli.configure = mock.Mock()
+        cli.audit_report = mock.Mock()
+        cli.propagate_all_targets = mock.Mock(side_effect=SystemExit(1))
+        self.assertRaises(SystemExit, cli.run)
+        cli.audit_report.close.assert_called_once_with()
+
+    def test_shard_is_parsed(self):
+        cli = self.cli_with_arguments('--region', 'us-east-1', '--shard', '2/4')
+        cli.set_shard()
+        self.assertEquals(cli.shard, (2, 4))
+
+    def test_shard_out_of_range_fails(self):
+        cli = self.cli_with_arguments('--region', 'us-east-1', '--shard', '4/4')
+        self.assertRaises(SystemExit, cli.set_shard)
+
+    def test_page_size_out_of_range_fails(self):
+        for page_size in ('2', '1000'):
+            cli = self.cli_with_arguments('--region', 'us-east-1', '--page-size', page_size)
+            self.assertRaises(SystemExit, cli.set_page_size)
+
+    def test_empty_id_lists_tag_nothing(self):
+        with tempfile.NamedTemporaryFile() as empty:
+            cli = self.cli_with_arguments('--region', 'us-east-1', '--volumes-from', '-', '--snapshots-from', empty.name)
+            with mock.patch('graffiti_monkey.cli.sys.stdin', StringIO.StringIO('# nothing today\n')):
+                cli.set_volumes()
+            cli.set_snapshots()
+            cli.set_novolumes()
+            cli.set_nosnapshots()
+        self.assertTrue(cli.novolumes)
+        self.assertTrue(cli.nosnapshots)
+
+    def test_plan_out_cannot_be_a_dryrun(self):
+        cli = self.cli_with_arguments('--region', 'us-east-1', '--plan-out', '/dev/null', '--dryrun')
+        cli.set_dryrun()
+        self.assertRaises(SystemExit, cli.set_plan)
+
+    @mock.patch('graffiti_monkey.cli.get_instance_metadata')
+    def test_apply_takes_the_regions_from_the_plan(self, get_instance_metadata):
+        cli = self.cli_with_arguments('--apply', 'plan.jsonl')
+        self.assertEquals(cli.regions, [])
+        self.assertFalse(get_instance_metadata.called)
+
+
+class IdFileTests(unittest.TestCase):
+
+    def test_ids_may_share_lines_and_have_comments(self):
+        lines = ['snap-1\n', 'snap-2, snap-3  # from the nightly backup\n', '\n', '# snap-4\n']
+        self.assertEquals(list(read_ids(lines)), ['snap-1', 'snap-2', 'snap-3'])
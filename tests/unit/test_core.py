@@ -0,0 +1,536 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import threading
+import time
+import unittest
+import mock
+
+from boto.ec2.snapshot import Snapshot
+from boto.exception import EC2ResponseError
+
+from graffiti_monkey.cache import TagCache
+from graffiti_monkey.core import GraffitiMonkey
+from graffiti_monkey.records import VolumeRecord, SnapshotRecord, ImageRecord, InterfaceRecord
+from graffiti_monkey.rules import Rules
+
+
+def ec2_error(status, code):
+    e = EC2ResponseError(status, 'reason')
+    e.error_code = code
+    return e
+
+
+def make_monkey(novolumes=False, **kwargs):
+    kwargs.setdefault('rate_limiter', mock.Mock())
+    with mock.patch.object(GraffitiMonkey, '_connect', return_value=mock.Mock()):
+        return GraffitiMonkey('us-east-1', 'default', ['Name'], ['Name', 'instance_id', 'device'],
+                              [], [], False, False, None, None, None, novolumes, False, **kwargs)
+
+
+@mock.patch('graffiti_monkey.core.time.sleep')
+class ApiCallTests(unittest.TestCase):
+
+    def test_throttled_call_is_retried(self, sleep):
+        monkey = make_monkey()
+        function = mock.Mock(side_effect=[ec2_error(503, 'RequestLimitExceeded'), 'result'])
+        self.assertEquals(monkey._api('DescribeVolumes', function), 'result')
+        self.assertEquals(function.call_count, 2)
+        self.assertEquals(sleep.call_count, 1)
+        monkey._rate_limiter.on_throttle.assert_called_once_with()
+
+    def test_permanent_error_is_not_retried(self, sleep):
+        monkey = make_monkey()
+        function = mock.Mock(side_effect=ec2_error(400, 'InvalidVolume.NotFound'))
+        self.assertRaises(EC2ResponseError, monkey._api, 'DescribeVolumes', function)
+        self.assertEquals(function.call_count, 1)
+
+    def test_calls_and_throttles_are_counted(self, sleep):
+        monkey = make_monkey()
+        function = mock.Mock(side_effect=[ec2_error(503, 'RequestLimitExceeded'), 'result'])
+        monkey._api('DescribeVolumes', function)
+        counters = monkey._metrics.summary()['counters']
+        self.assertEquals(counters['api_calls'], [{'operation': 'DescribeVolumes', 'value': 2}])
+        self.assertEquals(counters['throttles'], [{'operation': 'DescribeVolumes', 'value': 1}])
+        self.assertEquals(counters['retries'], [{'operation': 'DescribeVolumes', 'value': 1}])
+
+    def test_gives_up_after_max_attempts(self, sleep):
+        monkey = make_monkey()
+        function = mock.Mock(side_effect=ec2_error(503, 'RequestLimitExceeded'))
+        self.assertRaises(EC2ResponseError, monkey._api, 'CreateTags', function)
+        self.assertEquals(function.call_count, GraffitiMonkey._max_attempts)
+
+
+class WorkerTests(unittest.TestCase):
+
+    def test_items_are_spread_over_threads_with_their_own_connections(self):
+        monkey = make_monkey(workers=3)
+        processed = []
+        connections = {}
+        lock = threading.Lock()
+
+        def process(item):
+            conn = monkey._conn
+            with lock:
+                processed.append(item)
+                connections.setdefault(threading.current_thread().name, set()).add(conn)
+            time.sleep(0.01)
+
+        with mock.patch.object(GraffitiMonkey, '_connect', side_effect=lambda: mock.Mock()) as connect:
+            monkey._run(process, range(30))
+        self.assertEquals(sorted(processed), range(30))
+        self.assertTrue(len(connections) > 1)
+        self.assertTrue(all(len(conns) == 1 for conns in connections.itervalues()))
+        distinct = set(conn for conns in connections.itervalues() for conn in conns)
+        self.assertEquals(len(distinct), len(connections))
+        self.assertFalse(monkey._local.conn in distinct)
+        self.assertEquals(connect.call_count, len(connections))
+
+
+class WarmMonkeyTests(unittest.TestCase):
+
+    def test_connections_of_finished_threads_are_reused(self):
+        monkey = make_monkey()
+
+        def pages():
+            yield [monkey._conn]
+        with mock.patch.object(GraffitiMonkey, '_connect', side_effect=lambda: mock.Mock()) as connect:
+            seen = [list(monkey._prefetch(pages()))[0][0] for _ in range(3)]
+        self.assertEquals(connect.call_count, 1)
+        self.assertEquals(len(set(seen)), 1)
+
+    @mock.patch('graffiti_monkey.core.time.time')
+    def test_instance_tags_are_reused_between_runs(self, now):
+        monkey = make_monkey()
+        monkey.instance_cache_ttl = 300
+        monkey._resource_tags = mock.Mock(return_value={'i-1': {'Name': 'web'}})
+        monkey._volume_records = mock.Mock(side_effect=lambda **kwargs: iter([]))
+        for at in (1000, 1200, 1400):
+            now.return_value = at
+            instance_tags = {}
+            list(monkey._volume_pages(instance_tags))
+            self.assertEquals(instance_tags, {'i-1': {'Name': 'web'}})
+        self.assertEquals(monkey._resource_tags.call_count, 2)
+
+
+class Page(list):
+    def __init__(self, items, next_token=None):
+        list.__init__(self, items)
+        self.next_token = next_token
+
+
+class PaginationTests(unittest.TestCase):
+
+    def test_pages_follow_next_token(self):
+        monkey = make_monkey(page_size=2)
+        monkey._conn.get_list.side_effect = [Page(['vol-1', 'vol-2'], 'token'), Page(['vol-3'])]
+        pages = list(monkey._pages('DescribeVolumes', []))
+        self.assertEquals(pages, [['vol-1', 'vol-2'], ['vol-3']])
+        second_params = monkey._conn.get_list.call_args_list[1][0][1]
+        self.assertEquals(second_params['NextToken'], 'token')
+        self.assertEquals(second_params['MaxResults'], 2)
+
+
+class IncrementalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.state = mock.Mock()
+        self.state.get.return_value = {'snapshots_since': '2013-09-30T19:33:42.000Z'}
+
+    def test_incremental_run_uses_high_water_mark(self):
+        monkey = make_monkey(state=self.state, incremental=True, novolumes=True)
+        monkey._begin_run(datetime.datetime.utcnow())
+        self.assertEquals(monkey._since, '2013-09-30T19:33:42.000Z')
+        self.assertEquals(monkey._since_days()[:2], ['2013-09-30*', '2013-10-01*'])
+
+    def test_full_run_ignores_high_water_mark(self):
+        monkey = make_monkey(state=self.state, incremental=True, full=True)
+        monkey._begin_run(datetime.datetime.utcnow())
+        self.assertEquals(monkey._since, None)
+
+    def test_snapshots_before_high_water_mark_are_dropped(self):
+        monkey = make_monkey(state=self.state, incremental=True)
+        monkey._begin_run(datetime.datetime.utcnow())
+        old = mock.Mock(id='snap-1', tags={}, start_time='2013-09-30T10:00:00.000Z')
+        new = mock.Mock(id='snap-2', tags={}, start_time='2013-09-30T20:00:00.000Z')
+        monkey._conn.get_list.return_value = Page([old, new])
+        self.assertEquals([s.id for s in next(monkey._snapshot_pages())], ['snap-2'])
+
+
+class CheckpointTests(unittest.TestCase):
+
+    def setUp(self):
+        self.state = mock.Mock()
+        self.state.get.return_value = {}
+
+    def test_checkpoint_flushes_and_records_next_token(self):
+        monkey = make_monkey(state=self.state, checkpoint_pages=2)
+        monkey._begin_run(datetime.datetime(2013, 10, 1))
+        monkey._tag_writer = mock.Mock()
+        monkey._checkpoint('volumes', Page([VolumeRecord('vol-1')], 'token-1'))
+        self.assertFalse(monkey._tag_writer.flush.called)
+        monkey._checkpoint('volumes', Page([VolumeRecord('vol-2')], 'token-2'))
+        monkey._tag_writer.flush.assert_called_once_with()
+        self.state.update.assert_called_with('default/us-east-1', checkpoint={
+            'phase': 'volumes', 'since': None, 'started': '2013-10-01T00:00:00.000Z',
+            'next_token': 'token-2', 'last_resource_id': 'vol-2'})
+
+    def test_resume_continues_listing_from_token(self):
+        self.state.get.return_value = {'checkpoint': {
+            'phase': 'snapshots', 'since': None, 'started': '2013-10-01T00:00:00.000Z', 'next_token': 'token-2'}}
+        monkey = make_monkey(state=self.state, resume=True)
+        started = monkey._begin_run(datetime.datetime(2013, 10, 2))
+        self.assertEquals(started, datetime.datetime(2013, 10, 1))
+        monkey._conn.get_list.return_value = Page([])
+        list(monkey._snapshot_pages())
+        self.assertEquals(monkey._conn.get_list.call_args[0][1]['NextToken'], 'token-2')
+
+    def test_filtered_listing_restarts_on_resume(self):
+        self.state.get.return_value = {'checkpoint': {
+            'phase': 'volumes', 'since': None, 'started': '2013-10-01T00:00:00.000Z', 'next_token': 'token-2'}}
+        monkey = make_monkey(state=self.state, resume=True)
+        monkey._instance_filter = {'tag:Name': 'web'}
+        monkey._begin_run(datetime.datetime(2013, 10, 2))
+        self.assertEquals(monkey._resume_token('volumes'), None)
+
+
+@mock.patch('graffiti_monkey.core.time.time')
+class DeadlineTests(unittest.TestCase):
+
+    def test_work_is_ordered_newest_first(self, now):
+        now.return_value = 1000
+        monkey = make_monkey(deadline=60, page_size=2)
+        monkey._stop_at = 1054
+        old = SnapshotRecord('snap-1', start_time='2013-09-01T00:00:00.000Z')
+        new = SnapshotRecord('snap-2', start_time='2013-10-01T00:00:00.000Z')
+        mid = SnapshotRecord('snap-3', start_time='2013-09-15T00:00:00.000Z')
+        pages = monkey._newest_first(iter([[old, new], [mid]]), lambda s: s.start_time)
+        self.assertEquals([[s.id for s in page] for page in pages], [['snap-2', 'snap-3'], ['snap-1']])
+
+    def test_work_left_after_deadline_is_counted(self, now):
+        now.return_value = 1000
+        monkey = make_monkey(deadline=60)
+        monkey._nosnapshots = True
+        monkey._conn.get_list.return_value = Page([])
+        volumes = [VolumeRecord('vol-%d' % n, status='in-use', create_time='2013-10-0%dT00:00:00.000Z' % n)
+                   for n in range(1, 4)]
+
+        def tag_volume(volume, instance_tags):
+            now.return_value += 30
+        with mock.patch.object(monkey, '_volume_pages', return_value=iter([volumes])), \
+                mock.patch.object(monkey, 'tag_volume', side_effect=tag_volume) as tag:
+            monkey.propagate_tags()
+        self.assertEquals([c[0][0].id for c in tag.call_args_list], ['vol-3', 'vol-2'])
+        self.assertEquals(monkey._work_left, {'volumes': 1})
+
+    def test_queued_writes_count_against_the_deadline(self, now):
+        now.return_value = 1000
+        monkey = make_monkey()
+        monkey._stop_at = 1010
+        self.assertFalse(monkey._out_of_time())
+        monkey._tag_writer._call_seconds = 5
+        monkey._tag_writer.add('vol-1', {'Name': 'a'})
+        monkey._tag_writer.add('vol-2', {'Name': 'b'})
+        self.assertTrue(monkey._out_of_time())
+
+    def test_tags_are_written_after_each_page(self, now):
+        now.return_value = 1000
+        monkey = make_monkey(deadline=60, page_size=1)
+        monkey._nosnapshots = True
+        volumes = [VolumeRecord('vol-%d' % n, status='in-use', instance_id='i-%d' % n, device='/dev/sdf',
+                                create_time='2013-10-0%dT00:00:00.000Z' % n) for n in range(1, 3)]
+        written = []
+        monkey._conn.create_tags.side_effect = lambda resource_ids, tags: written.extend(resource_ids)
+
+        def tag_volume(volume, instance_tags):
+            # The volumes of earlier pages have been written by now
+            self.assertEquals(len(written), 2 - int(volume.id[-1]))
+            GraffitiMonkey.tag_volume(monkey, volume, instance_tags)
+        with mock.patch.object(monkey, '_volume_pages', return_value=iter([volumes])), \
+                mock.patch.object(monkey, 'tag_volume', side_effect=tag_volume):
+            monkey.propagate_tags()
+        self.assertEquals(written, ['vol-2', 'vol-1'])
+
+    def test_partial_run_keeps_high_water_mark(self, now):
+        now.return_value = 1000
+        state = mock.Mock()
+        state.get.return_value = {}
+        monkey = make_monkey(state=state, deadline=60)
+        monkey._leave('snapshots', 5)
+        monkey._end_run(datetime.datetime(2013, 10, 1))
+        values = state.update.call_args[1]
+        self.assertEquals(values['last_run_status'], 'partial')
+        self.assertEquals(values['work_left'], {'snapshots': 5})
+        self.assertFalse('snapshots_since' in values)
+
+
+class ShardTests(unittest.TestCase):
+
+    def test_every_resource_is_in_exactly_one_shard(self):
+        monkeys = [make_monkey(shard=(index, 3)) for index in range(3)]
+        for n in range(100):
+            resource_id = 'snap-%08x' % n
+            self.assertEquals(sum(monkey._in_shard(resource_id) for monkey in monkeys), 1)
+
+    def test_snapshot_of_other_shards_volume_is_tagged(self):
+        monkey = make_monkey(shard=(0, 2))
+        volume = VolumeRecord('vol-1', {'Name': 'web'})
+        snapshot = SnapshotRecord('snap-1', volume_id='vol-1')
+        with mock.patch.object(monkey, '_in_shard', side_effect=lambda resource_id: resource_id == 'snap-1'), \
+                mock.patch.object(monkey, 'tag_snapshot') as tag_snapshot:
+            monkey.tag_snapshots({'vol-1': volume}, [[snapshot, SnapshotRecord('snap-2', volume_id='vol-1')]])
+        tag_snapshot.assert_called_once_with(snapshot, {'vol-1': volume})
+
+    def test_shards_keep_separate_state(self):
+        self.assertEquals(make_monkey(shard=(1, 4))._state_key, 'default/us-east-1#1/4')
+
+
+class ExplicitIdTests(unittest.TestCase):
+
+    def test_ids_are_chunked_without_duplicates(self):
+        requested = set()
+        ids = ('snap-%d' % (n % 450) for n in xrange(900))
+        chunks = list(GraffitiMonkey._id_chunks(ids, requested))
+        self.assertEquals([len(chunk) for chunk in chunks], [200, 200, 50])
+        self.assertEquals(len(requested), 450)
+
+    def test_listed_snapshots_are_fetched_and_missing_ones_reported(self):
+        monkey = make_monkey()
+        monkey._snapshots_to_tag = iter(['snap-1', 'snap-2', 'snap-1'])
+        monkey._conn.get_list.return_value = Page([SnapshotRecord('snap-1')])
+        with mock.patch('graffiti_monkey.core.log') as log:
+            pages = list(monkey._snapshot_pages())
+        self.assertEquals([s.id for page in pages for s in page], ['snap-1'])
+        self.assertEquals(monkey._conn.build_filter_params.call_args[0][1], {'snapshot-id': ['snap-1', 'snap-2']})
+        log.info.assert_called_with('Snapshot %s does not exist and will not be tagged', 'snap-2')
+
+
+class InstanceFilterTests(unittest.TestCase):
+
+    def test_attachment_lookups_are_chunked(self):
+        monkey = make_monkey()
+        monkey._instance_filter = {'tag:Env': 'prod'}
+        instances = [mock.Mock(id='i-%d' % n, tags={'Name': 'web'}) for n in range(450)]
+        instance_tags = {}
+        with mock.patch.object(monkey, '_reservation_instances', return_value=iter(instances)), \
+                mock.patch.object(monkey, '_attached_volumes', side_effect=lambda ids: [VolumeRecord('vol-' + ids[0])]) \
+                as attached_volumes:
+            pages = list(monkey._volume_pages(instance_tags))
+        self.assertEquals(sorted(len(c[0][0]) for c in attached_volumes.call_args_list), [50, 200, 200])
+        self.assertEquals([page[0].id for page in pages], ['vol-i-0', 'vol-i-200', 'vol-i-400'])
+        self.assertEquals(len(instance_tags), 450)
+
+
+class InventoryTests(unittest.TestCase):
+
+    def test_resource_tags_are_grouped_by_resource(self):
+        monkey = make_monkey()
+        tags = [mock.Mock(res_id='i-1', value='web'), mock.Mock(res_id='i-2', value='db'), mock.Mock(res_id='i-1', value='me')]
+        tags[0].name, tags[1].name, tags[2].name = 'Name', 'Name', 'Owner'
+        monkey._conn.get_list.return_value = Page(tags)
+        self.assertEquals(monkey._resource_tags('instance'),
+                          {'i-1': {'Name': 'web', 'Owner': 'me'}, 'i-2': {'Name': 'db'}})
+
+    def test_volume_of_untagged_instance_gets_instance_id_and_device(self):
+        monkey = make_monkey()
+        volume = VolumeRecord('vol-1', status='in-use', instance_id='i-1', device='/dev/sda1')
+        with mock.patch.object(monkey, '_set_resource_tags') as set_resource_tags:
+            monkey.tag_volume(volume, {})
+        set_resource_tags.assert_called_once_with(volume, {'instance_id': 'i-1', 'device': '/dev/sda1'}, None)
+
+    def test_volume_whose_tags_were_not_written_is_not_cached(self):
+        monkey = make_monkey(tag_cache=TagCache(':memory:'), batch_size=1)
+        monkey._conn.create_tags.side_effect = ec2_error(400, 'UnauthorizedOperation')
+        monkey.tag_volume(VolumeRecord('vol-1', status='in-use', instance_id='i-1', device='/dev/sdf'), {})
+        monkey._conn.create_tags.side_effect = None
+        monkey.tag_volume(VolumeRecord('vol-1', status='in-use', instance_id='i-1', device='/dev/sdf'), {})
+        monkey._tag_writer.flush()
+        self.assertEquals(monkey._conn.create_tags.call_count, 2)
+
+        # Now that the tags are written the volume is skipped
+        monkey.tag_volume(VolumeRecord('vol-1', status='in-use', instance_id='i-1', device='/dev/sdf'), {})
+        monkey._tag_writer.flush()
+        self.assertEquals(monkey._conn.create_tags.call_count, 2)
+
+    def test_failed_writes_are_not_counted_as_tagged(self):
+        monkey = make_monkey(batch_size=1)
+        monkey._conn.create_tags.side_effect = [ec2_error(400, 'UnauthorizedOperation'), None]
+        for volume_id in ('vol-1', 'vol-2'):
+            monkey.tag_volume(VolumeRecord(volume_id, status='in-use', instance_id='i-1', device='/dev/sdf'), {})
+        self.assertEquals(monkey._metrics.summary()['counters']['resources'],
+                          [{'kind': 'volume', 'outcome': 'failed', 'value': 1},
+                           {'kind': 'volume', 'outcome': 'tagged', 'value': 1}])
+
+    def test_appended_tags_are_written(self):
+        monkey = make_monkey()
+        monkey._append = True
+        volume = VolumeRecord('vol-1', {'Owner': 'me'}, status='in-use', instance_id='i-1', device='/dev/sdf')
+        monkey.tag_volume(volume, {'i-1': {'Name': 'web'}})
+        monkey.tag_snapshot(SnapshotRecord('snap-1', {'Backup': 'daily'}, volume_id='vol-1'), {'vol-1': volume})
+        monkey._tag_writer.flush()
+        monkey._conn.create_tags.assert_called_once_with(['vol-1', 'snap-1'],
+                                                         {'Name': 'web', 'instance_id': 'i-1', 'device': '/dev/sdf'})
+        self.assertEquals(volume.tags, {'Owner': 'me', 'Name': 'web', 'instance_id': 'i-1', 'device': '/dev/sdf'})
+
+    def test_known_deleted_volumes_are_not_looked_up(self):
+        tag_cache = mock.Mock()
+        tag_cache.missing.return_value = set(['vol-gone'])
+        monkey = make_monkey(tag_cache=tag_cache)
+        monkey._conn.get_list.return_value = Page([])
+        missing = set()
+        snapshots = [SnapshotRecord('snap-1', volume_id='vol-gone'), SnapshotRecord('snap-2', volume_id='vol-new')]
+        monkey._fetch_extra_volumes(snapshots, {}, missing)
+        self.assertEquals(monkey._conn.build_filter_params.call_args[0][1], {'volume-id': ['vol-new']})
+        tag_cache.put_missing.assert_called_once_with(['vol-new'])
+        self.assertEquals(missing, set(['vol-gone', 'vol-new']))
+
+
+class RulesTests(unittest.TestCase):
+
+    def make_rules_monkey(self, **kwargs):
+        return make_monkey(rules=Rules({'volume': {
+            'collect': {'instance_id': 'attach_data.instance_id'},
+            'inspect': {'instance': {'type': 'instance', 'id': 'instance_id', 'collect': {'team': 'tags.team'}}},
+            'tag': {'team': 'team', 'role': {'value': 'ebs'}}}}), **kwargs)
+
+    def test_volumes_are_tagged_by_the_rules(self):
+        monkey = self.make_rules_monkey()
+        volume = VolumeRecord('vol-1', status='in-use', instance_id='i-1', device='/dev/sda1')
+        with mock.patch.object(monkey, '_set_resource_tags') as set_resource_tags:
+            monkey.tag_volume(volume, {'i-1': {'Name': 'web', 'team': 'a'}})
+        set_resource_tags.assert_called_once_with(volume, {'team': 'a', 'role': 'ebs'}, None)
+
+    def test_only_the_instance_tags_the_rules_read_are_fetched(self):
+        monkey = self.make_rules_monkey()
+        monkey._conn.get_list.return_value = Page([])
+        monkey._resource_tags('instance', keys=monkey._instance_tag_keys)
+        self.assertEquals(monkey._conn.build_filter_params.call_args[0][1],
+                          {'resource-type': 'instance', 'key': ['team']})
+
+
+class PlanTests(unittest.TestCase):
+
+    def test_planned_changes_are_written_to_the_plan_only(self):
+        plan_out = mock.Mock()
+        state = mock.Mock()
+        tag_cache = mock.Mock()
+        tag_cache.unchanged.return_value = False
+        monkey = make_monkey(plan_out=plan_out, state=state, tag_cache=tag_cache)
+        monkey.tag_volume(VolumeRecord('vol-1', status='in-use', instance_id='i-1', device='/dev/sdf'), {})
+        monkey._tag_writer.flush()
+        plan_out.writer.return_value.assert_called_once_with(['vol-1'], {'instance_id': 'i-1', 'device': '/dev/sdf'})
+        self.assertFalse(monkey._conn.create_tags.called)
+        self.assertFalse(tag_cache.put.called)
+        monkey._end_run(datetime.datetime(2014, 1, 1))
+        self.assertFalse(state.update.called)
+
+    def test_plan_is_applied_in_batches(self):
+        monkey = make_monkey(batch_size=2)
+        monkey.apply_plan([({'Name': 'web'}, ['vol-1', 'vol-2', 'vol-3']), ({'Name': 'web'}, ['snap-1'])])
+        self.assertEquals(monkey._conn.create_tags.call_args_list,
+                          [mock.call(['vol-1', 'vol-2'], {'Name': 'web'}), mock.call(['vol-3', 'snap-1'], {'Name': 'web'})])
+
+
+class AuditTests(unittest.TestCase):
+
+    def test_snapshots_are_compared_with_the_tags_their_volume_should_have(self):
+        monkey = make_monkey()
+        volume = VolumeRecord('vol-1', {'Name': 'old', 'instance_id': 'i-1', 'device': '/dev/sdf'},
+                              status='in-use', instance_id='i-1', device='/dev/sdf')
+        snapshot = SnapshotRecord('snap-1', {'Name': 'old', 'instance_id': 'i-1', 'device': '/dev/sdf'}, volume_id='vol-1')
+        monkey._volume_pages = mock.Mock(side_effect=lambda instance_tags: instance_tags.update({'i-1': {'Name': 'web'}})
+                                         or [[volume]])
+        monkey._snapshot_pages = mock.Mock(return_value=[[snapshot]])
+        report = mock.Mock()
+
+        monkey.audit(report)
+        self.assertEquals(report.add.call_args_list, [
+            mock.call('default', 'us-east-1', volume, {'Name': 'web'}),
+            mock.call('default', 'us-east-1', snapshot, {'Name': 'web'}),
+        ])
+        self.assertFalse(monkey._conn.create_tags.called)
+
+
+class ImageAndInterfaceTests(unittest.TestCase):
+
+    def test_images_reuse_the_snapshots_the_snapshot_phase_listed(self):
+        monkey = make_monkey(novolumes=True, amis=True)
+        monkey._image_records = mock.Mock(return_value=[ImageRecord('ami-1', snapshot_id='snap-1'),
+                                                        ImageRecord('ami-2', snapshot_id='snap-2')])
+        snapshot = Snapshot()
+        snapshot.id, snapshot.volume_id, snapshot.tags['Name'] = 'snap-1', 'vol-1', 'web'
+        # The snapshot phase lists snap-1, whose volume is gone; snap-2 is
+        # looked for and no longer exists
+        monkey._pages = mock.Mock(side_effect=[[Page([snapshot])], [Page([])], [Page([])]])
+        monkey.propagate_tags()
+
+        self.assertEquals(monkey._pages.call_args[0][2], {'snapshot-id': ['snap-2']})
+        monkey._conn.create_tags.assert_called_once_with(['ami-1'], {'Name': 'web'})
+
+    def test_interfaces_get_the_tags_fetched_for_the_volumes(self):
+        monkey = make_monkey(enis=True)
+        instance_tags = {'i-1': {'Name': 'web'}}
+        monkey._interface_records = mock.Mock(return_value=[Page([
+            InterfaceRecord('eni-1', instance_id='i-1'),
+            InterfaceRecord('eni-2', instance_id='i-2'),
+            InterfaceRecord('eni-3', instance_id='i-2'),
+            InterfaceRecord('eni-nat')])])
+        monkey._resource_tags = mock.Mock(return_value={})
+        monkey.tag_interfaces(instance_tags)
+
+        # Only the instance the volume phase did not see is looked up, once
+        monkey._resource_tags.assert_called_once_with('instance', ['i-2'], ['Name'])
+        self.assertEquals(sorted(monkey._conn.create_tags.call_args_list), [
+            mock.call(['eni-1'], {'Name': 'web', 'instance_id': 'i-1'}),
+            mock.call(['eni-2', 'eni-3'], {'instance_id': 'i-2'}),
+        ])
+
+
+class PipelineTests(unittest.TestCase):
+
+    @staticmethod
+    def run_account(**kwargs):
+        ''' Propagates tags through a small fake account, returning the
+        tags each CreateTags call set on each resource '''
+
+        conn = mock.Mock()
+        with mock.patch.object(GraffitiMonkey, '_connect', return_value=conn):
+            monkey = GraffitiMonkey('us-east-1', 'default', ['Name'], ['Name', 'instance_id', 'device'],
+                                    [], [], False, False, None, None, None, False, False,
+                                    rate_limiter=mock.Mock(), **kwargs)
+            volumes = [VolumeRecord('vol-%d' % n, status='in-use', instance_id='i-%d' % (n % 3), device='/dev/sdf')
+                       for n in range(6)]
+            snapshots = [SnapshotRecord('snap-%d' % n, volume_id='vol-%d' % (5 - n % 6)) for n in range(12)]
+            monkey._volume_pages = mock.Mock(side_effect=lambda instance_tags: instance_tags.update(
+                {'i-0': {'Name': 'web'}, 'i-1': {'Name': 'db'}}) or iter([Page(volumes[n:n+2], 'v%d' % n)
+                                                                          for n in range(0, 6, 2)]))
+            monkey._snapshot_pages = mock.Mock(side_effect=lambda: iter([Page(snapshots[n:n+4], 's%d' % n)
+                                                                         for n in range(0, 12, 4)]))
+            monkey.propagate_tags()
+        return monkey, sorted((resource_id, sorted(c[0][1].items()))
+                              for c in conn.create_tags.call_args_list for resource_id in c[0][0])
+
+    def test_pipelined_run_sets_the_same_tags(self):
+        monkey, sequential = self.run_account()
+        self.assertEquals(len(sequential), 18)
+        self.assertEquals(self.run_account(pipeline=True)[1], sequential)
+        self.assertEquals(self.run_account(pipeline=True, workers=3)[1], sequential)
+
+    def test_volume_phase_is_checkpointed(self):
+        state = mock.Mock()
+        state.get.return_value = {}
+        self.run_account(pipeline=True, state=state, checkpoint_pages=1)
+        phases = [c[1]['checkpoint']['phase'] for c in state.update.call_args_list if c[1].get('checkpoint')]
+        self.assertTrue('volumes' in phases)
@@ -0,0 +1,118 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+
+from graffiti_monkey.daemon import parse_event, EventMonkey, Daemon, FileSource
+from graffiti_monkey.records import VolumeRecord, SnapshotRecord, RecordPage
+
+
+def make_monkey(**kwargs):
+    kwargs.setdefault('rate_limiter', mock.Mock())
+    with mock.patch.object(EventMonkey, '_connect', return_value=mock.Mock()):
+        return EventMonkey('us-east-1', 'default', ['Name'], ['Name', 'instance_id', 'device'],
+                           [], [], False, False, None, None, None, False, False, **kwargs)
+
+
+def cloudtrail(name, **elements):
+    return json.dumps({'detail-type': 'AWS API Call via CloudTrail',
+                       'detail': {'eventName': name, 'responseElements': elements}})
+
+
+class ParseEventTests(unittest.TestCase):
+
+    def test_cloudtrail_calls(self):
+        self.assertEquals(parse_event(cloudtrail('CreateVolume', volumeId='vol-1')), ['vol-1'])
+        self.assertEquals(parse_event(cloudtrail('AttachVolume', volumeId='vol-1', instanceId='i-1')), ['vol-1'])
+        self.assertEquals(parse_event(cloudtrail('CreateSnapshot', snapshotId='snap-1', volumeId='vol-1')), ['snap-1'])
+
+    def test_failed_and_other_calls_are_ignored(self):
+        failed = json.dumps({'detail': {'eventName': 'CreateVolume', 'errorCode': 'VolumeLimitExceeded'}})
+        self.assertEquals(parse_event(failed), [])
+        self.assertEquals(parse_event(cloudtrail('DeleteVolume', volumeId='vol-1')), [])
+
+    def test_ebs_notifications(self):
+        event = json.dumps({'detail-type': 'EBS Snapshot Notification', 'detail': {'event': 'createSnapshot', 'result': 'succeeded'},
+                            'resources': ['arn:aws:ec2::us-east-1:snapshot/snap-1']})
+        self.assertEquals(parse_event(event), ['snap-1'])
+        deleted = json.dumps({'detail': {'event': 'deleteVolume', 'result': 'deleted'},
+                              'resources': ['arn:aws:ec2:us-east-1:0:volume/vol-1']})
+        self.assertEquals(parse_event(deleted), [])
+
+    def test_sns_wrapped_event(self):
+        event = json.dumps({'Type': 'Notification', 'TopicArn': 'arn:aws:sns:us-east-1:0:events',
+                            'Message': cloudtrail('CreateVolume', volumeId='vol-1')})
+        self.assertEquals(parse_event(event), ['vol-1'])
+
+    def test_plain_ids(self):
+        self.assertEquals(parse_event('vol-1, snap-2 i-3'), ['vol-1', 'snap-2'])
+
+
+class EventMonkeyTests(unittest.TestCase):
+
+    def test_instance_tags_are_cached(self):
+        monkey = make_monkey()
+        monkey._resource_tags = mock.Mock(return_value={'i-1': {'Name': 'web'}})
+        volume = lambda: VolumeRecord('vol-1', status='in-use', instance_id='i-1', device='/dev/sdf')
+        monkey._volume_records = mock.Mock(side_effect=lambda filters: [RecordPage([volume()])])
+
+        monkey.tag_events(['vol-1'])
+        monkey.tag_events(['vol-1'])
+        self.assertEquals(monkey._resource_tags.call_count, 1)
+        monkey._conn.create_tags.assert_called_with(['vol-1'], {'Name': 'web', 'instance_id': 'i-1', 'device': '/dev/sdf'})
+
+        monkey.instance_cache_ttl = 0
+        monkey.tag_events(['vol-1'])
+        self.assertEquals(monkey._resource_tags.call_count, 2)
+
+    def test_snapshot_gets_tags_of_volume_tagged_in_the_same_batch(self):
+        monkey = make_monkey()
+        monkey._resource_tags = mock.Mock(return_value={'i-1': {'Name': 'web'}})
+        monkey._volume_records = mock.Mock(return_value=[RecordPage([
+            VolumeRecord('vol-1', status='in-use', instance_id='i-1', device='/dev/sdf')])])
+        monkey._snapshot_records = mock.Mock(return_value=[RecordPage([SnapshotRecord('snap-1', volume_id='vol-1')])])
+
+        self.assertEquals(monkey.tag_events(['snap-1', 'vol-1', 'snap-2']), set(['snap-2']))
+        self.assertEquals(monkey._volume_records.call_count, 1)
+        monkey._conn.create_tags.assert_called_once_with(['vol-1', 'snap-1'], {'Name': 'web', 'instance_id': 'i-1', 'device': '/dev/sdf'})
+
+
+class DaemonTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_file_events_are_tagged_in_batches(self):
+        path = os.path.join(self.directory, 'events')
+        with open(path, 'w') as fh:
+            fh.write(cloudtrail('CreateVolume', volumeId='vol-1') + '\n\nnot an event\nsnap-1')
+        monkey = mock.Mock()
+        monkey.tag_events.return_value = set()
+        Daemon(monkey, FileSource(path, batch=2)).run()
+        self.assertEquals(monkey.tag_events.call_args_list, [mock.call(['vol-1']), mock.call(['snap-1'])])
+
+    def test_messages_are_kept_until_their_resources_are_found(self):
+        source = mock.Mock()
+        monkey = mock.Mock()
+        monkey.tag_events.return_value = set(['vol-2'])
+        Daemon(monkey, source).handle([('m1', 'vol-1'), ('m2', 'vol-2'), ('m3', '{}')])
+        source.delete.assert_called_once_with(['m1', 'm3'])
@@ -0,0 +1,72 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import unittest
+import mock
+
+from graffiti_monkey import lambda_handler
+
+
+class ResourceIdTests(unittest.TestCase):
+
+    def test_scheduled_and_empty_events_sweep(self):
+        self.assertEquals(lambda_handler.resource_ids({}), None)
+        self.assertEquals(lambda_handler.resource_ids({'detail-type': 'Scheduled Event', 'resources': []}), None)
+
+    def test_events_name_resources(self):
+        event = {'detail': {'eventName': 'CreateVolume', 'responseElements': {'volumeId': 'vol-1'}}}
+        self.assertEquals(lambda_handler.resource_ids(event), ['vol-1'])
+        self.assertEquals(lambda_handler.resource_ids({'detail': {'eventName': 'DeleteVolume'}}), [])
+
+    def test_sqs_and_sns_batches(self):
+        event = {'Records': [{'eventSource': 'aws:sqs', 'body': 'vol-1'},
+                             {'EventSource': 'aws:sns', 'Sns': {'Message': json.dumps({'resources': ['snap-1']})}}]}
+        self.assertEquals(lambda_handler.resource_ids(event), ['vol-1', 'snap-1'])
+
+
+@mock.patch.dict(os.environ, {'AWS_REGION': 'eu-west-1', 'GRAFFITI_MONKEY_ARGS': '--nosnapshots'})
+@mock.patch('graffiti_monkey.daemon.GraffitiMonkeyDaemonCli')
+class HandlerTests(unittest.TestCase):
+
+    def setUp(self):
+        lambda_handler._cli = lambda_handler._monkey = None
+
+    def tearDown(self):
+        lambda_handler._cli = lambda_handler._monkey = None
+
+    def test_monkey_is_kept_between_invocations(self, cli_class):
+        cli = cli_class.return_value
+        cli.targets.return_value = [('default', 'eu-west-1')]
+        cli.args.verbose = None
+        cli.monkey.tag_events.return_value = set()
+        context = mock.Mock()
+        context.get_remaining_time_in_millis.return_value = 60000
+
+        lambda_handler.handler({}, context)
+        lambda_handler.handler({'resources': ['arn:aws:ec2:eu-west-1:0:volume/vol-1']}, context)
+
+        cli_class.assert_called_once_with(['--region', 'eu-west-1', '--nosnapshots'])
+        self.assertEquals(cli.initialize_monkey.call_count, 1)
+        cli.monkey.propagate_tags.assert_called_once_with(60.0)
+        cli.monkey.tag_events.assert_called_once_with(['vol-1'])
+
+    @mock.patch.dict(os.environ, {'GRAFFITI_MONKEY_ARGS': '--region=us-west-2'})
+    def test_region_given_in_the_arguments_is_used(self, cli_class):
+        cli = cli_class.return_value
+        cli.targets.return_value = [('default', 'us-west-2')]
+        cli.args.verbose = None
+        lambda_handler.handler({})
+        cli_class.assert_called_once_with(['--region=us-west-2'])
@@ -0,0 +1,49 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from graffiti_monkey.metrics import Metrics
+
+
+class MetricsTests(unittest.TestCase):
+
+    def test_counters_are_kept_per_label(self):
+        metrics = Metrics()
+        metrics.count('api_calls', operation='CreateTags')
+        metrics.count('api_calls', 2, operation='CreateTags')
+        metrics.count('api_calls', operation='DescribeVolumes')
+        self.assertEquals(metrics.summary()['counters']['api_calls'],
+                          [{'operation': 'CreateTags', 'value': 3}, {'operation': 'DescribeVolumes', 'value': 1}])
+
+    def test_latency_buckets_are_cumulative(self):
+        metrics = Metrics()
+        metrics.observe('CreateTags', 0.2)
+        metrics.observe('CreateTags', 3)
+        histogram = metrics.summary()['api_latency_seconds']['CreateTags']
+        self.assertEquals(histogram['count'], 2)
+        self.assertEquals(histogram['buckets']['0.1'], 0)
+        self.assertEquals(histogram['buckets']['0.25'], 1)
+        self.assertEquals(histogram['buckets']['10'], 2)
+
+    def test_prometheus_output(self):
+        metrics = Metrics()
+        metrics.count('resources', kind='volume', outcome='tagged')
+        metrics.observe('CreateTags', 0.2)
+        with metrics.phase('volumes'):
+            pass
+        text = metrics.prometheus()
+        self.assertIn('graffiti_monkey_resources_total{kind="volume",outcome="tagged"} 1\n', text)
+        self.assertIn('graffiti_monkey_api_latency_seconds_bucket{operation="CreateTags",le="+Inf"} 1\n', text)
+        self.assertIn('graffiti_monkey_phase_seconds{phase="volumes"}', text)
@@ -0,0 +1,51 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from graffiti_monkey import plan
+from graffiti_monkey.exceptions import GraffitiMonkeyException
+
+
+class PlanTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'plan.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_changes_are_read_back_as_written(self):
+        writer = plan.PlanWriter(self.path)
+        writer.writer('prod', 'us-east-1')(['vol-1', 'vol-2'], {'Name': 'web'})
+        writer.writer('prod', 'eu-west-1')(['snap-1'], {'Name': 'db'})
+        writer.writer('prod', 'us-east-1')(['snap-2'], {'Name': 'web'})
+        writer.close()
+
+        self.assertEquals(list(plan.read(self.path)), [
+            ('prod', 'us-east-1', {'Name': 'web'}, ['vol-1', 'vol-2']),
+            ('prod', 'eu-west-1', {'Name': 'db'}, ['snap-1']),
+            ('prod', 'us-east-1', {'Name': 'web'}, ['snap-2']),
+        ])
+        self.assertEquals(plan.targets(self.path), [('prod', 'us-east-1'), ('prod', 'eu-west-1')])
+        self.assertEquals((writer.changes, writer.resources), (3, 4))
+
+    def test_bad_line_is_reported(self):
+        with open(self.path, 'w') as fh:
+            fh.write('{"profile":"prod","region":"us-east-1","resources":[],"tags":{}}\n\n["not", "a", "change"]\n')
+        self.assertRaises(GraffitiMonkeyException, list, plan.read(self.path))
@@ -0,0 +1,53 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import unittest
+
+from graffiti_monkey.prefetch import Prefetcher
+
+
+class PrefetcherTests(unittest.TestCase):
+
+    def test_yields_pages_in_order(self):
+        self.assertEquals(list(Prefetcher(iter([[1], [2], [3]]))), [[1], [2], [3]])
+
+    def test_raises_producer_errors(self):
+        def pages():
+            yield [1]
+            raise ValueError('boom')
+        self.assertRaises(ValueError, list, Prefetcher(pages()))
+
+    def test_available_does_not_wait(self):
+        release = threading.Event()
+
+        def pages():
+            yield [1]
+            release.wait()
+            yield [2]
+        prefetcher = Prefetcher(pages(), 0)
+        fetched = []
+        while not fetched:
+            fetched = list(prefetcher.available())
+        self.assertEquals(fetched, [[1]])
+        self.assertEquals(list(prefetcher.available()), [])
+        release.set()
+        self.assertEquals(list(prefetcher), [[2]])
+
+    def test_on_exit_runs_on_the_thread_before_the_end(self):
+        threads = []
+        prefetcher = Prefetcher(iter([[1]]), on_exit=lambda: threads.append(threading.current_thread()))
+        self.assertEquals(list(prefetcher), [[1]])
+        self.assertEquals(len(threads), 1)
+        self.assertNotEquals(threads[0], threading.current_thread())
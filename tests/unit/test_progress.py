@@ -0,0 +1,50 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import mock
+
+from graffiti_monkey.progress import Progress, duration
+
+
+@mock.patch('graffiti_monkey.progress.log')
+@mock.patch('graffiti_monkey.progress.time.time')
+class ProgressTests(unittest.TestCase):
+
+    def test_reports_every_interval(self, now, log):
+        now.return_value = 1000
+        progress = Progress('snapshots', interval=30)
+        progress.add(10)
+        self.assertFalse(log.info.called)
+        now.return_value = 1030
+        progress.add(50)
+        log.info.assert_called_once_with('%s %s: %d in %s, %.1f/s', 'Processing', 'snapshots', 60, '30s', 2.0)
+
+    def test_reports_every_n_resources_with_time_left(self, now, log):
+        now.return_value = 1000
+        progress = Progress('volumes', interval=0, every=100, total=400)
+        now.return_value = 1010
+        progress.add(99)
+        self.assertFalse(log.info.called)
+        progress.add()
+        log.info.assert_called_once_with('%s %s: %d of %d (%d%%), %.1f/s, about %s left', 'Processing', 'volumes',
+                                         100, 400, 25, 10.0, '30s')
+
+    def test_nothing_is_reported_for_an_empty_phase(self, now, log):
+        now.return_value = 1000
+        Progress('volumes').finish()
+        self.assertFalse(log.info.called)
+
+    def test_duration(self, now, log):
+        self.assertEquals([duration(12), duration(185), duration(3720)], ['12s', '3m05s', '1h02m'])
@@ -0,0 +1,66 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from boto.ec2.blockdevicemapping import BlockDeviceMapping, BlockDeviceType
+from boto.ec2.image import Image
+from boto.ec2.networkinterface import NetworkInterface, Attachment
+from boto.ec2.snapshot import Snapshot
+from boto.ec2.volume import Volume, AttachmentSet
+
+from graffiti_monkey.records import VolumeRecord, SnapshotRecord, ImageRecord, InterfaceRecord
+
+
+class RecordTests(unittest.TestCase):
+
+    def test_volume_record_keeps_attachment(self):
+        volume = Volume()
+        volume.id, volume.size, volume.status = 'vol-1', 8, 'in-use'
+        volume.attach_data = AttachmentSet()
+        volume.attach_data.instance_id, volume.attach_data.device = 'i-1', '/dev/sda1'
+        volume.tags['Name'] = 'web'
+        record = VolumeRecord.from_volume(volume)
+        self.assertEquals((record.id, record.size, record.status, record.instance_id, record.device),
+                          ('vol-1', 8, 'in-use', 'i-1', '/dev/sda1'))
+        self.assertEquals(record.tags, {'Name': 'web'})
+
+    def test_snapshot_record(self):
+        snapshot = Snapshot()
+        snapshot.id, snapshot.volume_id = 'snap-1', 'vol-1'
+        record = SnapshotRecord.from_snapshot(snapshot)
+        self.assertEquals((record.id, record.volume_id, record.tags), ('snap-1', 'vol-1', {}))
+
+    def test_image_record_keeps_root_snapshot(self):
+        image = Image()
+        image.id, image.root_device_name = 'ami-1', '/dev/sda1'
+        image.block_device_mapping = BlockDeviceMapping()
+        image.block_device_mapping['/dev/sdb'] = BlockDeviceType(snapshot_id='snap-data')
+        image.block_device_mapping['/dev/sda1'] = BlockDeviceType(snapshot_id='snap-root')
+        self.assertEquals(ImageRecord.from_image(image).snapshot_id, 'snap-root')
+
+        del image.block_device_mapping['/dev/sda1']
+        self.assertEquals(ImageRecord.from_image(image).snapshot_id, 'snap-data')
+
+    def test_interface_record_keeps_instance(self):
+        interface = NetworkInterface()
+        interface.id = 'eni-1'
+        self.assertEquals(InterfaceRecord.from_interface(interface).instance_id, None)
+        interface.attachment = Attachment()
+        interface.attachment.instance_id = 'i-1'
+        self.assertEquals(InterfaceRecord.from_interface(interface).instance_id, 'i-1')
+
+    def test_records_have_no_dict(self):
+        self.assertFalse(hasattr(SnapshotRecord('snap-1'), '__dict__'))
+        self.assertFalse(hasattr(VolumeRecord('vol-1'), '__dict__'))
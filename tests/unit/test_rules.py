@@ -0,0 +1,73 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import StringIO
+import unittest
+import mock
+
+from graffiti_monkey import rules
+from graffiti_monkey.exceptions import GraffitiMonkeyException
+from graffiti_monkey.records import VolumeRecord, SnapshotRecord
+
+
+class RulesTests(unittest.TestCase):
+
+    def setUp(self):
+        with open('conf/graffiti_monkey.yml') as fh:
+            self.rules = rules.load(fh)
+
+    def test_shipped_rules_give_the_default_volume_tags(self):
+        plan = self.rules.plan('volume')
+        volume = VolumeRecord('vol-1', status='in-use', instance_id='i-1', device='/dev/sdf')
+        self.assertEquals(plan.tags(volume, {'instance': {'i-1': {'Name': 'web', 'team': 'a'}}}),
+                          {'Name': 'web', 'instance_id': 'i-1', 'device': '/dev/sdf'})
+        self.assertEquals(plan.tag_keys('instance'), ['Name'])
+
+    def test_tags_missing_from_the_source_are_not_set(self):
+        plan = self.rules.plan('volume')
+        volume = VolumeRecord('vol-1', status='in-use', instance_id='i-2', device='/dev/sdf')
+        self.assertEquals(plan.tags(volume, {'instance': {}}), {'instance_id': 'i-2', 'device': '/dev/sdf'})
+
+    def test_snapshot_inspects_its_volume(self):
+        plan = self.rules.plan('snapshot')
+        volumes = {'vol-1': VolumeRecord('vol-1', {'Name': 'web', 'device': '/dev/sdf', 'other': 'x'})}
+        self.assertEquals(plan.tags(SnapshotRecord('snap-1', volume_id='vol-1'), {'volume': volumes}),
+                          {'Name': 'web', 'device': '/dev/sdf'})
+
+    def test_inspected_resource_is_looked_at_once(self):
+        plan = self.rules.plan('snapshot')
+        volumes = mock.Mock()
+        volumes.get.return_value = VolumeRecord('vol-1', {'Name': 'web'})
+        for n in range(3):
+            plan.tags(SnapshotRecord('snap-%d' % n, volume_id='vol-1'), {'volume': volumes})
+        self.assertEquals(volumes.get.call_count, 1)
+
+    def test_fixed_values_and_left_out_types(self):
+        compiled = rules.Rules({'volume': {'collect': {'id': 'id'}, 'tag': {'self': 'id', 'role': {'value': 'ebs'}}}})
+        self.assertEquals(compiled.plan('volume').tags(VolumeRecord('vol-1'), {}), {'self': 'vol-1', 'role': 'ebs'})
+        self.assertEquals(compiled.plan('volume').tag_keys('instance'), [])
+        self.assertEquals(compiled.plan('snapshot'), None)
+
+    def test_mistakes_are_found_when_compiling(self):
+        for bad in ({'volume': {'collect': {'x': 'colour'}}},
+                    {'volume': {'tag': {'Name': 'name'}}},
+                    {'volume': {'collect': {'v': 'id'}, 'inspect': {'s': {'type': 'snapshot', 'id': 'v'}}}},
+                    {'volume': {'inspect': {'i': {'type': 'instance', 'id': 'instance_id'}}}},
+                    {'image': {}}):
+            self.assertRaises(GraffitiMonkeyException, rules.Rules, bad)
+
+    def test_bad_rules_file_is_reported(self):
+        for tag in ('[Name, team]', '{default: web}'):
+            fh = StringIO.StringIO('volume:\n  collect: {id: id}\n  tag:\n    Name: %s\n' % tag)
+            self.assertRaises(GraffitiMonkeyException, rules.load, fh)
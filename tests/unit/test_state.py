@@ -0,0 +1,66 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from graffiti_monkey.exceptions import GraffitiMonkeyException
+from graffiti_monkey.state import StateFile
+
+
+class StateFileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_missing_file_gives_empty_sections(self):
+        self.assertEquals(StateFile(self.path).get('default/us-east-1'), {})
+
+    def test_values_survive_reloading(self):
+        StateFile(self.path).update('default/us-east-1', snapshots_since='2013-09-30T19:33:42.000Z')
+        section = StateFile(self.path).get('default/us-east-1')
+        self.assertEquals(section['snapshots_since'], '2013-09-30T19:33:42.000Z')
+
+    def test_sections_are_kept_apart(self):
+        state = StateFile(self.path)
+        state.update('default/us-east-1', last_run_status='completed')
+        state.update('default/us-west-1', last_run_status='running')
+        self.assertEquals(StateFile(self.path).get('default/us-east-1')['last_run_status'], 'completed')
+
+    def test_processes_sharing_the_file_keep_each_others_sections(self):
+        shard_0, shard_1 = StateFile(self.path), StateFile(self.path)
+        shard_0.get('default/us-east-1#0/2')
+        shard_1.get('default/us-east-1#1/2')
+        shard_1.update('default/us-east-1#1/2', last_run_status='completed', snapshots_since='2013-09-30T19:33:42.000Z')
+        shard_0.update('default/us-east-1#0/2', last_run_status='running')
+        state = StateFile(self.path)
+        self.assertEquals(state.get('default/us-east-1#1/2')['snapshots_since'], '2013-09-30T19:33:42.000Z')
+        self.assertEquals(state.get('default/us-east-1#0/2')['last_run_status'], 'running')
+
+    def test_none_removes_value(self):
+        state = StateFile(self.path)
+        state.update('default/us-east-1', checkpoint='x')
+        state.update('default/us-east-1', checkpoint=None)
+        self.assertEquals(state.get('default/us-east-1'), {})
+
+    def test_corrupt_file_raises(self):
+        with open(self.path, 'w') as fh:
+            fh.write('{')
+        self.assertRaises(GraffitiMonkeyException, StateFile(self.path).get, 'default/us-east-1')
@@ -0,0 +1,106 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import mock
+
+from boto.exception import EC2ResponseError
+
+from graffiti_monkey.tagger import TagWriter
+
+
+class TagWriterTests(unittest.TestCase):
+
+    def test_identical_tags_are_written_in_one_call(self):
+        create_tags = mock.Mock()
+        writer = TagWriter(create_tags, batch_size=10)
+        writer.add('snap-1', {'Name': 'a'})
+        writer.add('snap-2', {'Name': 'a'})
+        self.assertFalse(create_tags.called)
+        writer.flush()
+        create_tags.assert_called_once_with(['snap-1', 'snap-2'], {'Name': 'a'})
+
+    def test_different_tags_are_written_separately(self):
+        create_tags = mock.Mock()
+        writer = TagWriter(create_tags, batch_size=10)
+        writer.add('snap-1', {'Name': 'a'})
+        writer.add('snap-2', {'Name': 'b'})
+        writer.flush()
+        self.assertEquals(create_tags.call_count, 2)
+
+    def test_full_batch_is_written_immediately(self):
+        create_tags = mock.Mock()
+        writer = TagWriter(create_tags, batch_size=2)
+        writer.add('vol-1', {'Name': 'a'})
+        writer.add('vol-2', {'Name': 'a'})
+        create_tags.assert_called_once_with(['vol-1', 'vol-2'], {'Name': 'a'})
+        writer.flush()
+        self.assertEquals(create_tags.call_count, 1)
+
+    def test_failed_batch_is_retried_per_resource(self):
+        def create_tags(resource_ids, tags):
+            if 'snap-gone' in resource_ids:
+                raise EC2ResponseError(400, 'Bad Request')
+        create_tags = mock.Mock(side_effect=create_tags)
+        writer = TagWriter(create_tags, batch_size=10)
+        writer.add('snap-1', {'Name': 'a'})
+        writer.add('snap-gone', {'Name': 'a'})
+        writer.flush()
+        create_tags.assert_any_call(['snap-1'], {'Name': 'a'})
+        self.assertEquals(create_tags.call_count, 3)
+
+    def test_fingerprints_are_handed_on_once_written(self):
+        def create_tags(resource_ids, tags):
+            if 'snap-gone' in resource_ids:
+                raise EC2ResponseError(400, 'Bad Request')
+        on_success = mock.Mock()
+        writer = TagWriter(mock.Mock(side_effect=create_tags), batch_size=10, on_success=on_success)
+        writer.add('snap-1', {'Name': 'a'}, 'abc')
+        writer.add('snap-gone', {'Name': 'a'}, 'def')
+        writer.add('snap-2', {'Name': 'a'})
+        self.assertFalse(on_success.called)
+        writer.flush()
+        self.assertEquals(on_success.call_args_list, [mock.call([('snap-1', 'abc')]), mock.call([('snap-2', None)])])
+
+    def test_everything_is_written_once_too_much_is_queued(self):
+        create_tags = mock.Mock()
+        writer = TagWriter(create_tags, batch_size=10, max_pending=3)
+        writer.add('snap-1', {'Name': 'a'})
+        writer.add('snap-2', {'Name': 'b'})
+        self.assertFalse(create_tags.called)
+        writer.add('snap-3', {'Name': 'a'})
+        self.assertEquals(create_tags.call_count, 2)
+        create_tags.assert_any_call(['snap-1', 'snap-3'], {'Name': 'a'})
+
+    def test_pending_calls_are_timed_at_the_rate_so_far(self):
+        writer = TagWriter(mock.Mock(), batch_size=10)
+        writer._call_seconds = 0.5
+        writer.add('snap-1', {'Name': 'a'})
+        writer.add('snap-2', {'Name': 'a'})
+        writer.add('snap-3', {'Name': 'b'})
+        self.assertEquals(writer.pending_seconds(), 1.0)
+        writer.flush()
+        self.assertEquals(writer.pending_seconds(), 0.0)
+
+    def test_written_and_failed_resources_are_counted(self):
+        def create_tags(resource_ids, tags):
+            if 'snap-gone' in resource_ids:
+                raise EC2ResponseError(400, 'Bad Request')
+        writer = TagWriter(mock.Mock(side_effect=create_tags), batch_size=10)
+        writer.add('snap-1', {'Name': 'a'})
+        writer.add('snap-gone', {'Name': 'a'})
+        writer.add('snap-2', {'Name': 'b'})
+        writer.flush()
+        self.assertEquals(writer.take_counts(), (2, 4, 1))
+        self.assertEquals(writer.take_counts(), (0, 0, 0))
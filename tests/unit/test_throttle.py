@@ -0,0 +1,71 @@
+# Copyright 2013 Answers for AWS LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from boto.exception import EC2ResponseError, BotoServerError
+
+from graffiti_monkey.throttle import RateLimiter, is_throttle, is_retryable, backoff
+
+
+def ec2_error(status, code):
+    e = EC2ResponseError(status, 'reason')
+    e.error_code = code
+    return e
+
+
+class ClassificationTests(unittest.TestCase):
+
+    def test_request_limit_exceeded_is_a_retryable_throttle(self):
+        e = ec2_error(503, 'RequestLimitExceeded')
+        self.assertTrue(is_throttle(e))
+        self.assertTrue(is_retryable(e))
+
+    def test_missing_resource_is_permanent(self):
+        e = ec2_error(400, 'InvalidVolume.NotFound')
+        self.assertFalse(is_throttle(e))
+        self.assertFalse(is_retryable(e))
+
+    def test_server_errors_are_retryable(self):
+        self.assertTrue(is_retryable(BotoServerError(500, 'Internal Server Error')))
+
+    def test_backoff_is_capped(self):
+        for attempt in range(20):
+            self.assertTrue(0 <= backoff(attempt, cap=3) <= 3)
+
+
+class RateLimiterTests(unittest.TestCase):
+
+    def test_throttle_halves_rate(self):
+        limiter = RateLimiter(max_rate=40)
+        limiter.on_throttle()
+        self.assertEquals(limiter.rate, 20)
+
+    def test_rate_never_drops_below_minimum(self):
+        limiter = RateLimiter(max_rate=4, min_rate=1)
+        for _ in range(10):
+            limiter.on_throttle()
+        self.assertEquals(limiter.rate, 1)
+
+    def test_success_recovers_rate_up_to_maximum(self):
+        limiter = RateLimiter(max_rate=10)
+        limiter.on_throttle()
+        for _ in range(1000):
+            limiter.on_success()
+        self.assertEquals(limiter.rate, 10)
+
+    def test_burst_is_available_immediately(self):
+        limiter = RateLimiter(max_rate=1000, burst=5)
+        for _ in range(5):
+            limiter.acquire()